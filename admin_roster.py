@@ -0,0 +1,107 @@
+# admin_roster.py
+"""
+Per-chat admin roster (chat_id -> set of admin user_ids), answered from memory.
+
+- A chat's roster is loaded on first use with ONE
+  iter_participants(filter=ChannelParticipantsAdmins) call; concurrent first
+  lookups share that call.
+- start() refreshes every known roster each ROSTER_TTL seconds.
+- register() applies admin promotions/demotions (UpdateChannelParticipant,
+  UpdateChatParticipantAdmin) and leaves/kicks (ChatAction) as they arrive.
+"""
+
+import asyncio
+from typing import Dict, Optional, Set
+
+from telethon import events, utils
+from telethon.tl.types import (
+    ChannelParticipantAdmin,
+    ChannelParticipantCreator,
+    ChannelParticipantsAdmins,
+    PeerChannel,
+    PeerChat,
+    UpdateChannelParticipant,
+    UpdateChatParticipantAdmin,
+)
+
+import config
+
+ROSTER_TTL: float = float(getattr(config, "ADMIN_ROSTER_TTL", 600))  # seconds between scheduled refreshes
+
+_rosters: Dict[int, Set[int]] = {}
+_locks: Dict[int, asyncio.Lock] = {}
+_task: Optional[asyncio.Task] = None
+
+
+async def refresh(client, chat_id: int) -> Set[int]:
+    """Reload one chat's admins (one iter_participants call)."""
+    chat_id = int(chat_id)
+    ids = {p.id async for p in client.iter_participants(chat_id, filter=ChannelParticipantsAdmins)}
+    _rosters[chat_id] = ids
+    return ids
+
+
+async def admins(client, chat_id: int) -> Set[int]:
+    """Admin user_ids of chat_id (loaded on first use; raises if that load fails)."""
+    chat_id = int(chat_id)
+    roster = _rosters.get(chat_id)
+    if roster is not None:
+        return roster
+    lock = _locks.setdefault(chat_id, asyncio.Lock())
+    async with lock:
+        roster = _rosters.get(chat_id)
+        if roster is None:
+            roster = await refresh(client, chat_id)
+    return roster
+
+
+async def is_admin(client, chat_id: int, user_id: int) -> bool:
+    return int(user_id) in await admins(client, chat_id)
+
+
+def _set_admin(chat_id: int, user_id: int, admin: bool) -> None:
+    roster = _rosters.get(chat_id)
+    if roster is None:
+        return  # not loaded yet; the first lookup will be fresh anyway
+    if admin:
+        roster.add(int(user_id))
+    else:
+        roster.discard(int(user_id))
+
+
+async def _refresh_loop(client) -> None:
+    while True:
+        await asyncio.sleep(ROSTER_TTL)
+        for chat_id in list(_rosters):
+            try:
+                await refresh(client, chat_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[admin_roster] refresh {chat_id} failed (keeping cached roster): {e!r}")
+
+
+def start(client) -> None:
+    """Start the scheduled refresh of every roster loaded so far."""
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_refresh_loop(client))
+
+
+def register(client):
+    @client.on(events.Raw(types=[UpdateChannelParticipant, UpdateChatParticipantAdmin]))
+    async def admin_change(update):
+        if isinstance(update, UpdateChannelParticipant):
+            chat_id = utils.get_peer_id(PeerChannel(update.channel_id))
+            admin = isinstance(update.new_participant, (ChannelParticipantAdmin, ChannelParticipantCreator))
+            _set_admin(chat_id, update.user_id, admin)
+        else:
+            chat_id = utils.get_peer_id(PeerChat(update.chat_id))
+            _set_admin(chat_id, update.user_id, bool(update.is_admin))
+
+    @client.on(events.ChatAction())
+    async def member_left(event):
+        if not (event.user_left or event.user_kicked):
+            return
+        for uid in (event.user_ids or []):
+            _set_admin(event.chat_id, uid, False)
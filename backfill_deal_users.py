@@ -0,0 +1,14 @@
+import asyncio
+from db import db
+from rank import rebuild_user_volumes
+
+
+async def main():
+    # rebuild_user_volumes() first backfills buyer_user_id / seller_user_id on deals
+    # from users.username, then recomputes the leaderboard from those ids
+    rows = await rebuild_user_volumes(db)
+    print(f"✅ Backfilled deal user_ids and rebuilt user_volumes ({rows} users)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,191 @@
+# badges.py
+"""
+Cached '@exanic' bio badge checks (used by compute_fee on /add and /shift).
+
+Lookup order per username:
+  1. in-memory TTL cache
+  2. users.has_exanic_badge / users.badge_checked_at (one $in query for all misses)
+  3. Telegram GetFullUserRequest — misses resolved concurrently, one in-flight
+     lookup per username shared by concurrent callers
+
+Failed lookups (privacy, unknown username, FloodWait, ...) count as "no badge" and
+are cached for the shorter BADGE_NEGATIVE_TTL. force_refresh skips both caches.
+
+- /badge <username> [refresh]   (escrowers) show / re-check a user's badge
+"""
+
+import asyncio
+import re
+import time
+import unicodedata
+from datetime import datetime, timezone
+UTC = timezone.utc
+from typing import Dict, Iterable, Optional, Tuple
+
+from pymongo import UpdateOne
+from telethon.tl.functions.users import GetFullUserRequest
+
+import config
+import router
+from db import COL_USERS, link_user
+from permissions import is_escrower
+
+BADGE_TTL: float = float(getattr(config, "BADGE_TTL", 6 * 3600))
+BADGE_NEGATIVE_TTL: float = float(getattr(config, "BADGE_NEGATIVE_TTL", 10 * 60))
+
+# Match @exanic as a standalone token (case-insensitive).
+# Allows optional '@' and word boundaries so 'mexanicon' won't match.
+_EXANIC_TOKEN = re.compile(r'(?<![A-Za-z0-9_])@?exanic(?![A-Za-z0-9_])', re.IGNORECASE)
+
+# Zero-width + BOM chars that can break matching when users copy/paste
+_ZW_CHARS = "".join([
+    "\u200B",  # ZERO WIDTH SPACE
+    "\u200C",  # ZERO WIDTH NON-JOINER
+    "\u200D",  # ZERO WIDTH JOINER
+    "\u2060",  # WORD JOINER
+    "\uFEFF",  # ZERO WIDTH NO-BREAK SPACE (BOM)
+])
+
+_cache: Dict[str, Tuple[bool, float]] = {}          # handle -> (has_badge, expires_at monotonic)
+_inflight: Dict[str, "asyncio.Future[Tuple[bool, bool]]"] = {}
+
+
+def _normalize_handle(u: Optional[str]) -> Optional[str]:
+    if not u:
+        return None
+    return u.strip().lstrip("@").lower() or None
+
+
+def _clean_text(s: Optional[str]) -> str:
+    if not s:
+        return ""
+    # Normalize unicode and strip zero-width characters
+    s = unicodedata.normalize("NFKC", s)
+    return s.translate({ord(c): None for c in _ZW_CHARS})
+
+
+def _remember(handle: str, has_badge: bool, failed: bool, age: float = 0.0) -> None:
+    ttl = BADGE_NEGATIVE_TTL if failed else BADGE_TTL
+    _cache[handle] = (has_badge, time.monotonic() + ttl - age)
+
+
+async def _fetch(client, handle: str) -> Tuple[bool, bool]:
+    """(has_badge, failed) straight from Telegram."""
+    try:
+        full = await client(GetFullUserRequest(handle))
+        about = getattr(getattr(full, "full_user", None), "about", "") or ""
+    except Exception as e:
+        # Username not found / privacy / FloodWait → treat as no badge, retry after the negative TTL
+        print(f"[badges] lookup failed for {handle}: {e!r}")
+        return False, True
+    # the lookup resolved the handle: record its id (late-binds the user's deals)
+    for u in getattr(full, "users", None) or ():
+        if (getattr(u, "username", None) or "").lower() == handle:
+            try:
+                await link_user(u.id, handle)
+            except Exception as e:
+                print(f"[badges] could not link {handle}: {e!r}")
+            break
+    return bool(_EXANIC_TOKEN.search(_clean_text(about))), False
+
+
+async def _fetch_shared(client, handle: str) -> Tuple[bool, bool]:
+    fut = _inflight.get(handle)
+    if fut is not None:
+        return await asyncio.shield(fut)
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[handle] = fut
+    try:
+        result = await _fetch(client, handle)
+        fut.set_result(result)
+        return result
+    except BaseException:
+        fut.cancel()
+        raise
+    finally:
+        _inflight.pop(handle, None)
+
+
+async def _load_persisted(handles: Iterable[str]) -> Dict[str, bool]:
+    """Fresh badge results stored on `users` (also warms the memory cache)."""
+    now = datetime.now(UTC)
+    out: Dict[str, bool] = {}
+    cursor = COL_USERS.find(
+        {"username": {"$in": list(handles)}, "badge_checked_at": {"$ne": None}},
+        {"username": 1, "has_exanic_badge": 1, "badge_checked_at": 1, "badge_lookup_failed": 1},
+    )
+    async for u in cursor:
+        checked = u["badge_checked_at"]
+        if checked.tzinfo is None:
+            checked = checked.replace(tzinfo=UTC)
+        failed = bool(u.get("badge_lookup_failed"))
+        age = (now - checked).total_seconds()
+        if age >= (BADGE_NEGATIVE_TTL if failed else BADGE_TTL):
+            continue
+        has_badge = bool(u.get("has_exanic_badge"))
+        out[u["username"]] = has_badge
+        _remember(u["username"], has_badge, failed, age)
+    return out
+
+
+async def has_badges(client, usernames: Iterable[Optional[str]], *, force_refresh: bool = False) -> Dict[str, bool]:
+    """Badge status for each (normalized) username; misses are looked up concurrently."""
+    handles = list({h for h in (_normalize_handle(u) for u in usernames) if h})
+    out: Dict[str, bool] = {}
+    missing = []
+    now = time.monotonic()
+    for h in handles:
+        hit = None if force_refresh else _cache.get(h)
+        if hit is not None and hit[1] > now:
+            out[h] = hit[0]
+        else:
+            missing.append(h)
+    if not missing:
+        return out
+
+    if not force_refresh:
+        out.update(await _load_persisted(missing))
+        missing = [h for h in missing if h not in out]
+        if not missing:
+            return out
+
+    results = await asyncio.gather(*(_fetch_shared(client, h) for h in missing))
+    checked_at = datetime.now(UTC)
+    ops = []
+    for h, (has_badge, failed) in zip(missing, results):
+        out[h] = has_badge
+        _remember(h, has_badge, failed)
+        ops.append(UpdateOne(
+            {"username": h},
+            {"$set": {"has_exanic_badge": has_badge, "badge_checked_at": checked_at,
+                      "badge_lookup_failed": failed},
+             "$setOnInsert": {"created_at": checked_at}},
+            upsert=True,
+        ))
+    try:
+        await COL_USERS.bulk_write(ops, ordered=False)
+    except Exception as e:
+        print(f"[badges] could not persist badge results: {e!r}")
+    return out
+
+
+async def has_badge(client, username: Optional[str], *, force_refresh: bool = False) -> bool:
+    h = _normalize_handle(username)
+    if not h:
+        return False
+    return (await has_badges(client, [h], force_refresh=force_refresh)).get(h, False)
+
+
+def register(client):
+    @router.command(r"^/badge(?:@[\w_]+)?\s+@?([A-Za-z0-9_]{1,32})(?:\s+(refresh))?$")
+    async def badge_handler(event):
+        if not await is_escrower(event.sender_id):
+            await event.reply("⛔ You are not authorized to use this command.")
+            return
+        handle = event.pattern_match.group(1).lower()
+        refresh = bool(event.pattern_match.group(2))
+        ok = await has_badge(event.client, handle, force_refresh=refresh)
+        await event.reply(
+            f"🏷️ @{handle}: " + ("has @exanic in bio ✅" if ok else "no @exanic in bio ❌")
+            + (" (re-checked)" if refresh else "")
+        )
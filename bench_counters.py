@@ -0,0 +1,112 @@
+# bench_counters.py
+"""
+Benchmark for db.increment_counters_for_closed (the /close counter path).
+
+Runs N sequential closes against scratch collections in <DB_NAME>_bench on the
+deployment given by BENCH_MONGO_URI (default mongodb://localhost:27017) and reports,
+for the old per-scope update_one path and the current bulk_write path:
+  - MongoDB round-trips per close (counted with a pymongo CommandListener)
+  - p50 / p99 latency per close
+
+Usage: BENCH_MONGO_URI=mongodb://host:port/?replicaSet=rs0 python bench_counters.py [N]   (default 200)
+config.MONGO_URI is never used, so production is never touched. Use a replica set:
+both paths commit in a transaction.
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+UTC = timezone.utc
+
+from pymongo import monitoring
+
+
+class _RoundTrips(monitoring.CommandListener):
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+LISTENER = _RoundTrips()
+monitoring.register(LISTENER)  # must happen before db.py creates its client
+
+import config  # noqa: E402
+
+config.MONGO_URI = os.environ.get("BENCH_MONGO_URI", "mongodb://localhost:27017")  # before db.py connects
+config.COUNTERS_WRITE_BEHIND = False  # measure the synchronous path
+
+import db  # noqa: E402
+from config import DB_NAME  # noqa: E402
+
+
+async def _legacy_increment(deal: dict) -> None:
+    """The pre-bulk implementation: gate, then 5 sequential update_one in a transaction."""
+    res = await db.COL_DEALS.update_one(
+        {"_id": deal["_id"], "counters_applied": {"$ne": True}},
+        {"$set": {"counters_applied": True}},
+    )
+    if res.modified_count != 1:
+        return
+    amount = float(deal["main_amount"])
+    day = deal["closed_at"].astimezone(UTC).date().isoformat()  # old UTC day key
+    now = datetime.now(UTC)
+    inc = {"$inc": {"deals": 1, "volume_main": amount}, "$set": {"updated_at": now}}
+    async with await db._client.start_session() as session:
+        async with session.start_transaction():
+            await db.COL_COUNT_SIMPLE.update_one({"_id": "1"}, {"$inc": {"amount": amount, "count": 1}},
+                                                 upsert=True, session=session)
+            await db.COL_COUNTS.update_one({"scope": "global"}, inc, upsert=True, session=session)
+            await db.COL_COUNTS.update_one({"scope": "daily", "date_utc": day}, inc, upsert=True, session=session)
+            await db.COL_COUNTS.update_one({"scope": "group_daily", "group_id": deal["form_chat_id"], "date_utc": day},
+                                           inc, upsert=True, session=session)
+            await db.COL_COUNTS.update_one({"scope": "escrower_daily", "escrower_id": deal["escrower_id"], "date_utc": day},
+                                           inc, upsert=True, session=session)
+
+
+async def _run(label: str, fn, n: int) -> None:
+    for col in (db.COL_DEALS, db.COL_COUNTS, db.COL_COUNT_SIMPLE):
+        await col.delete_many({})
+    now = datetime.now(UTC)
+    deals = [{"status": "closed", "closed_at": now, "main_amount": 10.0 + i,
+              "form_chat_id": -100123, "escrower_id": 42} for i in range(n)]
+    await db.COL_DEALS.insert_many(deals)
+
+    lat, trips = [], []
+    for d in deals:
+        before = LISTENER.count
+        t0 = time.perf_counter()
+        await fn(d)
+        lat.append((time.perf_counter() - t0) * 1000)
+        trips.append(LISTENER.count - before)
+
+    lat.sort()
+    p99 = lat[min(len(lat) - 1, int(round(0.99 * (len(lat) - 1))))]
+    print(f"{label:<10} round-trips/close={statistics.mean(trips):.1f}  "
+          f"p50={statistics.median(lat):.1f}ms  p99={p99:.1f}ms")
+
+
+async def main(n: int) -> None:
+    bench = db._client[f"{DB_NAME}_bench"]
+    db.COL_DEALS = bench["deals"]
+    db.COL_COUNTS = bench["counts"]
+    db.COL_COUNT_SIMPLE = bench["count"]
+
+    print(f"increment_counters_for_closed x{n} (db={DB_NAME}_bench on {config.MONGO_URI})")
+    await _run("before", _legacy_increment, n)
+    await _run("after", db.increment_counters_for_closed, n)
+    await db._client.drop_database(f"{DB_NAME}_bench")
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,133 @@
+# bench_router.py
+"""
+Micro-benchmark of per-message NewMessage dispatch cost (handler bodies excluded).
+
+Compares, on the same synthetic message mix:
+  - legacy: one events.NewMessage(pattern=...) per command plus the catch-all
+    listeners — every message is checked against every handler's chats/pattern
+  - router: router.Router.resolve() — one tokenize + dict lookup, scoped listeners
+
+Reports µs per message and the CPU spent per second of traffic at 100 and 1,000
+messages per second.
+
+Usage: python bench_router.py [N]   (default 200000 messages)
+"""
+
+import random
+import re
+import sys
+import time
+
+from router import Router
+
+MAIN_GROUP_ID = -1002888180583
+ESCROW_GROUPS = (-1002248727398, -1002676048878, -4885554031)
+OTHER_CHATS = (123456789, 987654321, -1001111111111)
+
+# The NewMessage patterns registered before the router (bot.py + register() modules)
+LEGACY_PATTERNS = [
+    r"^/start$", r"^/help$", r"^/escrowers$", r"^/admin\s+(\d+)\s+(\d+(?:\.\d+)?)$",
+    r"^/unadmin\s+(\d+)$", r"^/add\s+([0-9]+(\.[0-9]+)?)$", r"^/cut\s+(\d+(?:\.\d+)?)$",
+    r"^/ext\s+(\d+(?:\.\d+)?)$", r"^/shift\s+(DL-[A-Z0-9]{6})$", r"^/stats$", r"^/gstats$",
+    r"^/close(?:@[\w_]+)?\s+([0-9]+(?:\.[0-9]+)?)$", r"^/dinfo(?:\s+(\S+))?", r"^/s\s+(\S+)",
+    r"^/cancel\s+(\S+)", r"^/mkick\s+(.+)", r"^/eday(?:@[\w_]+)?$", r"^/gday(?:@[\w_]+)?$",
+    r"^/eweek(?:@[\w_]+)?$", r"^/emonth(?:@[\w_]+)?$", r"^/gmonth(?:@[\w_]+)?$",
+    r"^/info(?:@[\w_]+)?(?:\s+(\S+))?$", r"^/rank(?:@[\w_]+)?(?:\s+(\d+))?$",
+    r"^/rebuildrank(?:@[\w_]+)?$", r"^/addfee\s+(\d+)\s+([\d.]+)\s+(.+)$", r"^/listfees$",
+    r"^/myfees$", r"^/editfee\s+([a-fA-F0-9]+)\s+([\d.]+)(?:\s+(.+))?$",
+    r"^/delfee\s+([a-fA-F0-9]+)$", r"^/fees$", r"^/feestats$", r"^/rebuildfees$",
+    r"^/editcache(?:@[\w_]+)?$", r"^/reconcile(?:@[\w_]+)?(?:\s+(apply))?$",
+    r"^/badge(?:@[\w_]+)?\s+@?([A-Za-z0-9_]{1,32})(?:\s+(refresh))?$", r"^/kickall$",
+]
+
+SAMPLE_TEXT = [
+    "hello everyone", "anyone selling usdt?", "deal done, thanks!", "ok", "👍",
+    "Seller - @alice\nBuyer - @bob\nAmount - 120", "what's the fee for 500?",
+    "https://t.me/Exanic", "gm", "lol that's wild",
+]
+SAMPLE_COMMANDS = [
+    "/add 120", "/close 50", "/s DL-AB12CD", "/info", "/rank 10", "/eday", "/gstats",
+    "/start", "/help", "/badge @alice", "/dinfo DL-AB12CD", "/unknown", "/shrug", "/add@SomeBot 5",
+]
+
+
+def _noop(event):
+    pass
+
+
+def legacy_handlers():
+    """(chats or None, compiled pattern or None) in registration order, as Telethon checks them."""
+    hs = [(None, re.compile(p)) for p in LEGACY_PATTERNS]
+    hs.append((None, None))                                  # bot.form_listener (catch-all)
+    hs.append((frozenset([MAIN_GROUP_ID]), None))            # manage.cache_original_message
+    hs.append((frozenset([MAIN_GROUP_ID]), None))            # manage.force_subscribe_handler
+    return hs
+
+
+def legacy_resolve(handlers, text: str, chat_id: int) -> list:
+    found = []
+    for chats, pattern in handlers:
+        if chats is not None and chat_id not in chats:
+            continue
+        if pattern is not None:
+            m = pattern.match(text)
+            if not m:
+                continue
+            found.append((_noop, m))
+        else:
+            found.append((_noop, None))
+    return found
+
+
+def build_router() -> Router:
+    r = Router()
+    for p in LEGACY_PATTERNS:
+        r.command(p)(_noop)
+    r.listener(chats=ESCROW_GROUPS)(_noop)                  # bot.form_listener (escrow groups)
+    r.listener(chats=[MAIN_GROUP_ID])(_noop)                # manage.cache_original_message
+    r.listener(chats=[MAIN_GROUP_ID])(_noop)                # manage.force_subscribe_handler
+    return r
+
+
+def messages(n: int, command_share: float = 0.1, seed: int = 7) -> list:
+    rnd = random.Random(seed)
+    chats = (MAIN_GROUP_ID,) * 6 + ESCROW_GROUPS + OTHER_CHATS
+    out = []
+    for _ in range(n):
+        pool = SAMPLE_COMMANDS if rnd.random() < command_share else SAMPLE_TEXT
+        out.append((rnd.choice(pool), rnd.choice(chats)))
+    return out
+
+
+def _time(fn, msgs) -> float:
+    """Best-of-3 seconds per message."""
+    best = float("inf")
+    for _ in range(3):
+        t0 = time.perf_counter()
+        for text, chat_id in msgs:
+            fn(text, chat_id)
+        best = min(best, time.perf_counter() - t0)
+    return best / len(msgs)
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    msgs = messages(n)
+    legacy = legacy_handlers()
+    router = build_router()
+
+    per_msg = {
+        "legacy": _time(lambda t, c: legacy_resolve(legacy, t, c), msgs),
+        "router": _time(lambda t, c: router.resolve(t, c), msgs),
+    }
+
+    print(f"{n} messages, {len(LEGACY_PATTERNS)} command patterns, ~10% commands")
+    print(f"{'':8} {'µs/msg':>8} {'@100 msg/s':>14} {'@1000 msg/s':>14}")
+    for label, sec in per_msg.items():
+        cols = [f"{sec * rate * 1000:.2f} ms/s" for rate in (100, 1000)]
+        print(f"{label:8} {sec * 1e6:8.2f} {cols[0]:>14} {cols[1]:>14}")
+    print(f"speed-up: {per_msg['legacy'] / per_msg['router']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
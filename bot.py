@@ -2,26 +2,28 @@ import asyncio
 import re
 import traceback
 import sys
-import random
-import string
-import unicodedata
 from datetime import datetime, timezone
 UTC = timezone.utc
-from telethon.tl.functions.users import GetFullUserRequest
-from telethon import TelegramClient, events
+from telethon import events
 from telethon.tl.custom.message import Message
 
 from config import API_ID, API_HASH, BOT_TOKEN, OWNER_ID, ESCROW_GROUP_IDS, FOOTER_INFO_DATE
-from db import db, COL_DEALS, COL_ESCROWERS, ensure_indexes , COL_USERS
+from db import db, COL_DEALS, COL_ESCROWERS, ensure_indexes , COL_USERS, resolve_user_ids, link_user, save_form_stub, get_form_stub, delete_form_stub
 from parsing import parse_deal_form
 from utils.format import normalize_username
 from permissions import is_owner, is_escrower, is_admin_or_owner
-from rank import get_top20_by_volume
+import escrower_cache
+import counter_buffer
+import log_publisher
+import metrics
+import router
+from rank import get_top20_by_volume, ensure_user_volumes, load_volume_index
 from info import build_info_card
 from holdings import escrower_holdings
 from gstats import global_stats
 from config import LOG_CHANNEL_ID
-from deal_logic import create_deal_from_form, recalc_amount_fields , compute_fee, _new_deal_id
+from deal_logic import create_deal_from_form, recalc_amount_fields , compute_fee, prefetch_form_fee
+from deal_ids import next_deal_id
 import re
 from datetime import datetime
 from telethon import events
@@ -48,10 +50,10 @@ from utils.format import mask_name
 # Create the client object, but DO NOT start it here.
 # (Starting happens inside main() on the same event loop.)
 # ------------------------------------------------------------------
-client = TelegramClient("escrow_bot", API_ID, API_HASH)
+client = metrics.MeteredClient("escrow_bot", API_ID, API_HASH)  # TelegramClient + per-handler metrics
 
 # bot.py (after you define client)
-import dinfo , show , cancel , mkick , eday , gday , close_cmd
+import dinfo , show , cancel , mkick , eday , gday , close_cmd , eweek , emonth , gmonth
 close_cmd.register(client)
 dinfo.register(client)
 show.register(client)
@@ -59,14 +61,25 @@ cancel.register(client)
 mkick.register(client)
 eday.register(client)
 gday.register(client)
+eweek.register(client)
+emonth.register(client)
+gmonth.register(client)
 import logging
 logging.basicConfig(level=logging.INFO)
 
-import rank_cmd , info_cmd , fee_cmd , manage
+import rank_cmd , info_cmd , fee_cmd , manage , reconcile , badges , kickall , admin_roster
 info_cmd.register(client)
 rank_cmd.register(client)
 fee_cmd.register(client)
 manage.register(client)
+reconcile.register(client)
+badges.register(client)
+kickall.register(client)
+admin_roster.register(client)
+metrics.register(client)
+
+# One NewMessage handler for every @router.command / @router.listener (incl. the ones below)
+router.install(client)
 
 
 # --------- helpers
@@ -76,8 +89,8 @@ async def require_reply_to_form(event: events.NewMessage.Event) -> Message:
 
 async def in_allowed_group(event: events.NewMessage.Event) -> bool:
     if not ESCROW_GROUP_IDS: return True
-    chat_id_str = str(getattr(event.chat, "id", "")) if event.chat else ""
-    return chat_id_str in ESCROW_GROUP_IDS
+    # ESCROW_GROUP_IDS is keyed by marked ids ("-100…"), like event.chat_id (not chat.id)
+    return str(event.chat_id) in ESCROW_GROUP_IDS
 
 def _display_name_from_entity(e) -> str:
     """Prefer First + Last; fallback to @username; finally numeric id."""
@@ -93,8 +106,7 @@ def _display_name_from_entity(e) -> str:
 
 
 from telethon import events, Button
-import requests
-from io import BytesIO
+import start_media
 
 # === CONFIG ===
 MAIN_GROUP_LINK = "https://t.me/Exanic"
@@ -103,13 +115,11 @@ VOUCH_CHANNEL = "https://t.me/vouchhats"
 LOGS_CHANNEL = "https://t.me/Strawhatsescrowlogs"
 IMAGE_URL = "https://envs.sh/zpH.png"
 
-@client.on(events.NewMessage(pattern=r"^/start$"))
+@router.command(r"^/start$")
 async def start_cmd(event):
     if not event.is_private:
         return  # ignore groups/channels
 
-    await ensure_indexes()
-
     caption = (
         "** Hello , strawHats Manager Welcomes You!**\n\n"
         "I am an Escrow Tracker and Logger for strawHats — one of the "
@@ -129,22 +139,15 @@ async def start_cmd(event):
     ]
 
     try:
-        # Download the image into memory (preserves resolution)
-        response = requests.get(IMAGE_URL, timeout=10)
-        if response.status_code != 200:
-            raise Exception(f"HTTP {response.status_code}")
-        image_stream = BytesIO(response.content)
-        image_stream.name = "start_image.png"  # Telethon needs a filename
-
-        # Send with full quality (as document)
-        await event.respond(
+        # Uploaded once, then sent by cached photo reference (no per-call download)
+        await start_media.respond_with_photo(
+            event,
+            "start_image",
+            IMAGE_URL,
             caption,
-            file=image_stream,
             buttons=keyboard,
             parse_mode="markdown",
-            force_document=False
         )
-        image_stream.close()
 
     except Exception as e:
         print(f"Unable to send the start image. Error: {e}")
@@ -161,7 +164,7 @@ async def callback_handler(event):
         except Exception:
             await event.answer("Closed.", alert=False)
 
-@client.on(events.NewMessage(pattern=r"^/help$"))
+@router.command(r"^/help$")
 async def help_cmd(event):
     await event.respond(
         "📖 Help Menu\n"
@@ -177,17 +180,19 @@ async def help_cmd(event):
         "/info - Your profile card.\n"
         "/stats <owner> - Escrower-wise holdings.\n"
         "/gstats - Global statistics.\n"
+        "/eweek, /emonth <escrowers> - Your closed deals this week / month (IST).\n"
+        "/gmonth <escrowers> - All closed deals this month (IST).\n"
+        "/badge (username) [refresh] <escrowers> - Check a user's @exanic bio badge.\n"
         "/fees <owner> - Fees earned per escrower."
     )
 
 # --------- /escrowers, /admin, /unadmin
-@client.on(events.NewMessage(pattern=r"^/escrowers$"))
+@router.command(r"^/escrowers$")
 async def escrowers_cmd(event):
     if not await is_escrower(event.sender_id):
         await event.respond("❌ Only escrowers can use this command.")
         return
-    cur = COL_ESCROWERS.find()
-    escrowers = [e async for e in cur]
+    escrowers = escrower_cache.all_escrowers()
     if not escrowers:
         await event.respond("No verified escrowers yet.")
         return
@@ -198,7 +203,7 @@ async def escrowers_cmd(event):
         lines.append(f"• {disp} ({e.get('user_id')})")
     await event.respond("\n".join(lines))
 
-@client.on(events.NewMessage(pattern=r"^/admin\s+(\d+)\s+(\d+(?:\.\d+)?)$"))
+@router.command(r"^/admin\s+(\d+)\s+(\d+(?:\.\d+)?)$")
 async def admin_cmd(event):
     if not await is_owner(event.sender_id):
         await event.respond("❌ Only owner can use this command.")
@@ -218,6 +223,11 @@ async def admin_cmd(event):
             entity = await event.get_sender()
 
     display_name = _display_name_from_entity(entity) if entity else str(user_id)
+    if getattr(entity, "username", None):
+        try:
+            await link_user(user_id, entity.username)
+        except Exception as e:
+            print(f"[bot][admin] link_user failed: {e!r}")
 
     # Upsert AND refresh display_name every time /admin runs
     await COL_ESCROWERS.update_one(
@@ -225,23 +235,25 @@ async def admin_cmd(event):
         {"$set": {"user_id": user_id, "limit": limit, "display_name": display_name}},
         upsert=True,
     )
+    escrower_cache.put(user_id, display_name, limit)
 
     shown_limit = int(limit) if float(limit).is_integer() else limit
     await event.respond(f"Hence user {user_id} became escrower with a limit of {shown_limit}$.")
 
-@client.on(events.NewMessage(pattern=r"^/unadmin\s+(\d+)$"))
+@router.command(r"^/unadmin\s+(\d+)$")
 async def unadmin_cmd(event):
     if not await is_owner(event.sender_id):
         await event.respond("❌ Only owner can use this command."); return
     uid = int(event.pattern_match.group(1))
     res = await COL_ESCROWERS.delete_one({"user_id": uid})
+    escrower_cache.drop(uid)
     if res.deleted_count:
         await event.respond(f"✅ Removed escrower: {uid}")
     else:
         await event.respond(f"❌ User {uid} is not an escrower.")
 
-# --------- deal form listener (capture seller/buyer only)
-@client.on(events.NewMessage())
+# --------- deal form listener (capture seller/buyer only; escrow groups only)
+@router.listener(chats=[int(c) for c in ESCROW_GROUP_IDS] or None)
 async def form_listener(event):
     if not await in_allowed_group(event): return
     text = event.raw_text or ""
@@ -249,29 +261,14 @@ async def form_listener(event):
     from parsing import parse_deal_form
     parsed = parse_deal_form(text)
     if not parsed: return
-    # store minimal stub for traceability (no amount here)
-    await COL_DEALS.insert_one({
-        "deal_id": None,
-        "escrower_id": None,
-        "escrower_name": None,
-        "buyer_username": parsed["buyer_username"].lower(),
-        "seller_username": parsed["seller_username"].lower(),
-        "amount": 0.0,
-        "main_amount": 0.0,
-        "fee": 0.0,
-        "remaining": 0.0,
-        "status": "pending",
-        "form_chat_id": getattr(event.chat,'id',None),
-        "form_message_id": event.message.id,
-        "created_at": __import__("datetime").datetime.utcnow(),
-    })
+    # warm both parties' bio badges before anyone replies /add
+    prefetch_form_fee(event.client, parsed["buyer_username"], parsed["seller_username"])
+    # store minimal stub for traceability (no amount here); expires unless /add consumes it
+    await save_form_stub(event.chat_id, event.message.id,
+                         parsed["buyer_username"], parsed["seller_username"])
 
 # --------- /add (escrower only; reply to form)
 
-def _new_deal_id() -> str:
-    return "DL-" + "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
-
-
 def _display_name_from_entity(e) -> str:
     """Prefer First + Last; fallback to @username; finally numeric id."""
     first = getattr(e, "first_name", "") or ""
@@ -284,70 +281,8 @@ def _display_name_from_entity(e) -> str:
         return f"@{username}"
     return str(getattr(e, "id", ""))  # last resort
 
-from telethon.tl.functions.users import GetFullUserRequest
-
-def _normalize_handle(u: str | None) -> str | None:
-    if not u:
-        return None
-    return u.strip().lstrip("@").lower()
-
-
-# Match @exanic as a standalone token (case-insensitive).
-# Allows optional '@' and word boundaries so 'mexanicon' won't match.
-_EXANIC_TOKEN = re.compile(r'(?<![A-Za-z0-9_])@?exanic(?![A-Za-z0-9_])', re.IGNORECASE)
-
-# Zero-width + BOM chars that can break matching when users copy/paste
-_ZW_CHARS = "".join([
-    "\u200B",  # ZERO WIDTH SPACE
-    "\u200C",  # ZERO WIDTH NON-JOINER
-    "\u200D",  # ZERO WIDTH JOINER
-    "\u2060",  # WORD JOINER
-    "\uFEFF",  # ZERO WIDTH NO-BREAK SPACE (BOM)
-])
-
-def _normalize_handle(u: str | None) -> str | None:
-    if not u:
-        return None
-    return u.strip().lstrip("@").lower()
-
-def _clean_text(s: str | None) -> str:
-    if not s:
-        return ""
-    # Normalize unicode and strip zero-width characters
-    s = unicodedata.normalize("NFKC", s)
-    return s.translate({ord(c): None for c in _ZW_CHARS})
-
-async def _user_has_exanic_in_bio(client, username: str | None) -> bool:
-    """
-    True iff the user's BIO contains '@exanic' (case-insensitive).
-    Robust to '@' missing, zero-width chars, unicode normalization.
-    """
-    handle = _normalize_handle(username)
-    if not handle:
-        return False
-    try:
-        entity = await client.get_entity(handle)
-        full = await client(GetFullUserRequest(entity))
-        about = getattr(getattr(full, "full_user", None), "about", "") or ""
-        about = _clean_text(about)
-        return bool(_EXANIC_TOKEN.search(about))
-    except Exception:
-        # Username not found / privacy / transient error → treat as no badge
-        return False
-
-
-
-
-async def compute_fee(client, buyer_username: str, seller_username: str) -> float:
-    b = await _user_has_exanic_in_bio(client, buyer_username)
-    s = await _user_has_exanic_in_bio(client, seller_username)
-    if b and s:
-        return 1
-    else:
-        return 2    
-
 #------------/add--------------------------
-@client.on(events.NewMessage(pattern=r"^/add\s+([0-9]+(\.[0-9]+)?)$"))
+@router.command(r"^/add\s+([0-9]+(\.[0-9]+)?)$")
 async def add_cmd(event: events.NewMessage.Event):
     # 1) Only escrowers can /add
     if not await is_escrower(event.sender_id):
@@ -368,18 +303,23 @@ async def add_cmd(event: events.NewMessage.Event):
     form_msg: Message = await event.get_reply_message()
     text = form_msg.raw_text or ""
 
-    # 3) Extract seller/buyer
+    # 3) Extract seller/buyer (form_listener stub only if the text no longer parses)
     seller_match = re.search(r"(?mi)^\s*Seller\s*-\s*@?([A-Za-z0-9_]{1,32})", text)
     buyer_match = re.search(r"(?mi)^\s*Buyer\s*-\s*@?([A-Za-z0-9_]{1,32})", text)
     seller_username = seller_match.group(1) if seller_match else None
     buyer_username = buyer_match.group(1) if buyer_match else None
+    stub = None
+    if not (seller_username and buyer_username):
+        stub = await get_form_stub(form_msg.chat_id, form_msg.id)
+        if stub:
+            seller_username, buyer_username = stub["seller_username"], stub["buyer_username"]
 
     if not (seller_username and buyer_username):
         await event.respond("❌ Could not extract seller/buyer usernames from the form.")
         return
 
     # 4) Escrower display name
-    esc = await COL_ESCROWERS.find_one({"user_id": event.sender_id})
+    esc = escrower_cache.get(event.sender_id)
     if esc and esc.get("display_name"):
         escrower_name = esc["display_name"]
     else:
@@ -396,6 +336,11 @@ async def add_cmd(event: events.NewMessage.Event):
         seller_username=seller_username,
         main_amount=main_amount,
     )
+    # the deal exists now: the form's stub (read above or not) has served its purpose
+    try:
+        await delete_form_stub(form_msg.chat_id, form_msg.id)
+    except Exception as e:
+        print(f"[add_cmd] could not delete form stub: {e!r}")
 
     # 6) Calculate net release amount
     release_amt = deal["main_amount"] - deal["fee"]
@@ -432,7 +377,7 @@ async def deal_from_card_reply(event):
     return deal
 
 # --------- /cut-----------------------------------------
-@client.on(events.NewMessage(pattern=r"^/cut\s+(\d+(?:\.\d+)?)$"))
+@router.command(r"^/cut\s+(\d+(?:\.\d+)?)$")
 async def cut_cmd(event):
     # Only admins/owners can cut
     if not await is_admin_or_owner(event.sender_id):
@@ -476,7 +421,7 @@ async def cut_cmd(event):
         f"~ {release_amount:.2f}$ **to be released**"
     )
 
-@client.on(events.NewMessage(pattern=r"^/ext\s+(\d+(?:\.\d+)?)$"))
+@router.command(r"^/ext\s+(\d+(?:\.\d+)?)$")
 async def ext_cmd(event):
     # Only admins/owner can extend
     if not await is_admin_or_owner(event.sender_id):
@@ -529,7 +474,7 @@ async def ext_cmd(event):
 
 # --------- /shift (admins/owner), reply to NEW form
 
-@client.on(events.NewMessage(pattern=r"^/shift\s+(DL-[A-Z0-9]{6})$"))
+@router.command(r"^/shift\s+(DL-[A-Z0-9]{6})$")
 async def shift_cmd(event):
     # only admins/owner can shift
     if not await is_admin_or_owner(event.sender_id):
@@ -561,9 +506,12 @@ async def shift_cmd(event):
     base_fee = await compute_fee(client, new_buyer, old_deal["seller_username"])
     fee = base_fee + 1.0
 
-    new_deal_id = _new_deal_id()
+    new_deal_id = await next_deal_id()
     total = float(old_deal["main_amount"]) - fee
 
+    # party user_ids: seller carries over, new buyer resolved if already linked
+    uids = await resolve_user_ids(new_buyer)
+
     # insert new deal
     new_deal = {
         "deal_id": new_deal_id,
@@ -571,6 +519,8 @@ async def shift_cmd(event):
         "escrower_name": str(event.sender.first_name or event.sender.id),
         "buyer_username": new_buyer.lower(),
         "seller_username": old_deal["seller_username"].lower(),
+        "buyer_user_id": uids.get(new_buyer.lower()),
+        "seller_user_id": old_deal.get("seller_user_id"),
         "amount": total,
         "main_amount": float(old_deal["main_amount"]),
         "fee": fee,
@@ -641,105 +591,8 @@ async def _upsert_user(db, uid: int | None, uname: str | None) -> None:
             upsert=True,
         )
 
-import asyncio
-from telethon import events, Button
-from telethon.tl.functions.channels import GetParticipantRequest, EditBannedRequest
-from telethon.tl.types import ChatBannedRights
-from config import ESCROW_GROUP_IDS  # import your escrow group list/dict
-
-KICK_DELAY = 0.7  # seconds between each kick to avoid FloodWait
-
-@client.on(events.NewMessage(pattern=r"^/kickall$", incoming=True))
-async def kickall_request(event):
-    chat_id = str(event.chat_id)
-
-    # ✅ Allow only escrow groups
-    if chat_id not in ESCROW_GROUP_IDS:
-        await event.reply("⚠️ This command is only available in escrow groups.")
-        return
-
-    # ✅ Check if user is admin
-    try:
-        part = await client(GetParticipantRequest(event.chat_id, event.sender_id))
-        is_admin = getattr(part.participant, "admin_rights", None)
-        if not is_admin:
-            await event.reply("🚫 Only admins can use /kickall.")
-            return
-    except Exception as e:
-        await event.reply(f"Cannot verify admin: {e}")
-        return
-
-    # ✅ Confirmation buttons
-    keyboard = [
-        [Button.inline("✅ Confirm Kick All", data=f"kickall_confirm:{event.sender_id}:{chat_id}"),
-         Button.inline("❌ Cancel", data=f"kickall_cancel:{event.sender_id}:{chat_id}")]
-    ]
-    await event.reply("⚠️ **Are you sure you want to kick all non-admins in this escrow group?**", buttons=keyboard)
-
-
-@client.on(events.CallbackQuery(pattern=b"kickall_"))
-async def kickall_callback(event):
-    try:
-        data = event.data.decode().split(":")
-        action = data[0]
-        sender_id = int(data[1])
-        chat_id = data[2]
-    except Exception:
-        await event.answer("Malformed data.", alert=True)
-        return
-
-    # ✅ Allow only the initiator
-    if event.sender_id != sender_id:
-        await event.answer("Not your confirmation button!", alert=True)
-        return
-
-    # ✅ Ensure chat is escrow group
-    if chat_id not in ESCROW_GROUP_IDS:
-        await event.answer("This command is not allowed here.", alert=True)
-        return
-
-    if action == "kickall_cancel":
-        await event.edit("❌ Kick-all cancelled.")
-        return
-
-    if action == "kickall_confirm":
-        await event.edit("🚨 Kicking all non-admin members... please wait.")
-        kicked, failed = 0, 0
-        ban_rights = ChatBannedRights(until_date=None, view_messages=True)
-        me = await client.get_me()
-
-        async for member in client.iter_participants(int(chat_id)):
-            try:
-                # Skip bot, sender, and admins
-                if member.id in (me.id, sender_id):
-                    continue
-                try:
-                    p = await client(GetParticipantRequest(int(chat_id), member.id))
-                    if getattr(p.participant, "admin_rights", None):
-                        continue
-                except Exception:
-                    continue
-
-                try:
-                    await client.kick_participant(int(chat_id), member.id)
-                except Exception:
-                    try:
-                        await client(EditBannedRequest(int(chat_id), member.id, ban_rights))
-                    except Exception:
-                        failed += 1
-                        continue
-
-                kicked += 1
-                await asyncio.sleep(KICK_DELAY)
-            except Exception:
-                failed += 1
-                await asyncio.sleep(KICK_DELAY)
-
-        await event.edit(f"✅ Done. Kicked **{kicked}** members. Failed: **{failed}**.")
-
-
 # --------- /stats (owner)
-@client.on(events.NewMessage(pattern=r"^/stats$"))
+@router.command(r"^/stats$")
 async def stats_cmd(event):
     if not await is_escrower(event.sender_id):
         await event.respond("❌ Only escrowers can use this command.")
@@ -751,7 +604,7 @@ async def stats_cmd(event):
     await event.respond("\n".join(lines))
 
 # --------- /gstats (everyone)
-@client.on(events.NewMessage(pattern=r"^/gstats$"))
+@router.command(r"^/gstats$")
 async def gstats_cmd(event):
     if not await is_owner(event.sender_id):
         await event.respond("❌ Only owner can use this command.")
@@ -774,6 +627,30 @@ async def main():
         traceback.print_exc()
         return
 
+    # Seed the user_volumes leaderboard on first run and load the rank index
+    try:
+        await ensure_user_volumes(db)
+        await load_volume_index(db)
+    except Exception as e:
+        print("\n[STARTUP] leaderboard warm-up failed:", repr(e))
+        traceback.print_exc()
+
+    # Warm the escrower roster (permission checks are answered from memory)
+    try:
+        await escrower_cache.start()
+    except Exception as e:
+        print("\n[STARTUP] escrower_cache.start() failed:", repr(e))
+        traceback.print_exc()
+        return
+
+    # Replay + start the write-behind counter flusher (no-op unless enabled in config)
+    try:
+        await counter_buffer.start()
+    except Exception as e:
+        print("\n[STARTUP] counter_buffer.start() failed:", repr(e))
+        traceback.print_exc()
+        return
+
     # Start Telethon client INSIDE the running loop
     try:
         await client.start(bot_token=BOT_TOKEN)
@@ -782,12 +659,34 @@ async def main():
         traceback.print_exc()
         return
 
+    # Log-channel publisher (replays log_queue left over from the last run)
+    await log_publisher.start(client)
+
+    # Prometheus text endpoint for per-handler metrics (disabled if METRICS_PORT is 0)
+    try:
+        await metrics.start_server()
+    except Exception as e:
+        print("\n[STARTUP] metrics.start_server() failed:", repr(e))
+
+    # Scheduled refresh of the cached group-admin rosters
+    admin_roster.start(client)
+
+    # Resume /kickall runs interrupted by a restart
+    try:
+        await kickall.resume_jobs(client)
+    except Exception as e:
+        print("\n[STARTUP] kickall.resume_jobs() failed:", repr(e))
+
     print("Escrow bot is running…")
     try:
         await client.run_until_disconnected()
     except Exception as e:
         print("\n[RUNTIME] client.run_until_disconnected() failed:", repr(e))
         traceback.print_exc()
+    finally:
+        await metrics.stop_server()
+        await log_publisher.stop()
+        await counter_buffer.stop()
 
 if __name__ == "__main__":
     try:
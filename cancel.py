@@ -1,11 +1,9 @@
-from telethon import events
-from db import COL_DEALS, COL_ESCROWERS
-async def is_escrower(user_id: int) -> bool:
-    doc = await COL_ESCROWERS.find_one({"user_id": user_id})
-    return bool(doc)
+import router
+from db import COL_DEALS
+from permissions import is_escrower
 
 def register(client):
-    @client.on(events.NewMessage(pattern=r"^/cancel\s+(\S+)"))
+    @router.command(r"^/cancel\s+(\S+)")
     async def cancel_deal(event):
         # ✅ Restriction check
         if not await is_escrower(event.sender_id):
@@ -1,33 +1,22 @@
 # close_cmd.py
-from telethon import events
+import router
 from datetime import datetime, timezone
 UTC = timezone.utc
 from pymongo import ReturnDocument
-from typing import Union, Any
+from typing import Any, Optional
 import re
 from html import escape as htmlesc
 
-from db import COL_DEALS, COL_ESCROWERS, read_simple_global, increment_counters_for_closed
+from db import db, COL_DEALS, read_simple_global, increment_counters_for_closed
+from rank import apply_closed_deal_volume
 from utils.format import mask_name
-from config import LOG_CHANNEL_ID
+from permissions import is_escrower
+import log_publisher
 
 # Baselines (if you still want seeded totals)
 BASE_TOTAL = 531_713.64
 BASE_COUNT = 797
 
-async def _is_escrower(uid: int) -> bool:
-    return bool(await COL_ESCROWERS.find_one({"user_id": uid}))
-
-async def _resolve_log_peer(client, target: Union[int, str]) -> Any:
-    if isinstance(target, int):
-        return await client.get_entity(target)
-    t = str(target).strip()
-    if t.startswith("-100") and t.lstrip("-").isdigit():
-        return await client.get_entity(int(t))
-    if not t.startswith("@"):
-        t = "@" + t
-    return await client.get_entity(t)
-
 def _safe(s: Any) -> str:
     return htmlesc(str(s or ""))
 
@@ -37,11 +26,31 @@ async def _delete_cmd_msg(event):
     except Exception:
         pass
 
+async def _close_deal(deal_id: str, escrower_id: int, close_amount: float) -> Optional[dict]:
+    """
+    Atomically close an open deal: remaining = max(0, remaining - amount), status closed.
+    Returns the closed document, or None if no open deal matched (already closed, wrong owner).
+    """
+    return await COL_DEALS.find_one_and_update(
+        {
+            "deal_id": deal_id,
+            "escrower_id": escrower_id,
+            "status": {"$in": ["pending", "active"]},
+        },
+        [{"$set": {
+            "remaining": {"$max": [0.0, {"$subtract": [{"$ifNull": ["$remaining", 0.0]}, close_amount]}]},
+            "status": "closed",
+            "closed_at": datetime.now(UTC),
+            "closed_by": escrower_id,
+        }}],
+        return_document=ReturnDocument.AFTER,
+    )
+
 def register(client):
-    @client.on(events.NewMessage(pattern=r"^/close(?:@[\w_]+)?\s+([0-9]+(?:\.[0-9]+)?)$"))
+    @router.command(r"^/close(?:@[\w_]+)?\s+([0-9]+(?:\.[0-9]+)?)$")
     async def close_cmd(event):
         # Permissions
-        if not await _is_escrower(event.sender_id):
+        if not await is_escrower(event.sender_id):
             await event.respond("❌ Only escrowers can use /close.")
             await _delete_cmd_msg(event)
             return
@@ -74,44 +83,27 @@ def register(client):
             return
         deal_id = m.group(1).upper()
 
-        # Fetch open deal owned by this escrower
-        deal = await COL_DEALS.find_one({
-            "deal_id": deal_id,
-            "escrower_id": event.sender_id,
-            "status": {"$in": ["pending", "active"]},
-        })
-        if not deal:
+        # Close in ONE conditional update: only an open deal owned by this escrower
+        # matches, so concurrent /close calls cannot both succeed
+        closed_deal = await _close_deal(deal_id, event.sender_id, close_amount)
+        if not closed_deal:
             await card.reply("❌ Deal not found or already closed.")
             await _delete_cmd_msg(event)
             return
 
-        # Decrement remaining
-        updated = await COL_DEALS.find_one_and_update(
-            {"_id": deal["_id"]},
-            {"$inc": {"remaining": -close_amount}},
-            return_document=ReturnDocument.AFTER
-        )
-        new_remaining = max(0.0, float(updated.get("remaining", 0.0)))
-
-        # Mark closed
-        now = datetime.now(UTC)
-        await COL_DEALS.update_one(
-            {"_id": deal["_id"]},
-            {"$set": {
-                "status": "closed",
-                "closed_at": now,
-                "remaining": new_remaining,
-                "closed_by": event.sender_id
-            }}
-        )
-        closed_deal = await COL_DEALS.find_one({"_id": deal["_id"]})
-
-        # Update counters (simple + scoped)
+        # Update counters (simple + scoped); returns the new simple totals for the log
+        totals = None
         try:
-            await increment_counters_for_closed(closed_deal, amount_field="main_amount")
+            totals = await increment_counters_for_closed(closed_deal, amount_field="main_amount")
         except Exception as e:
             print(f"⚠️ Closed, but counters update failed: {e!r}")
 
+        # Update the per-user leaderboard (buyer + seller)
+        try:
+            await apply_closed_deal_volume(db, closed_deal)
+        except Exception as e:
+            print(f"⚠️ Closed, but leaderboard update failed: {e!r}")
+
         # Build announcement (reply to the card to keep thread)
         seller_open = (closed_deal.get("seller_username") or "").lstrip("@")
         buyer_open  = (closed_deal.get("buyer_username")  or "").lstrip("@")
@@ -123,7 +115,7 @@ def register(client):
         await card.reply(announce_html, parse_mode="html", link_preview=False)
 
         # Totals for logging (simple global + baseline)
-        vol, cnt = await read_simple_global()
+        vol, cnt = totals if totals is not None else await read_simple_global()
         total_worth = vol + BASE_TOTAL
         total_deals = cnt + BASE_COUNT
 
@@ -140,15 +132,11 @@ def register(client):
             "<b>By @Exanic</b>"
         )
 
-        # Send log to channel
+        # Queue the log for the channel (sent in the background by log_publisher)
         try:
-            peer = await _resolve_log_peer(event.client, LOG_CHANNEL_ID)
-            await event.client.send_message(peer, log_html, parse_mode="html", link_preview=False)
+            await log_publisher.publish(log_html)
         except Exception as e:
-            print(
-                f"⚠️ Deal closed, but logging failed: {e!r}\n"
-                f"Please verify LOG_CHANNEL_ID (use -100… or @username) and that the bot is a member."
-            )
+            print(f"⚠️ Deal closed, but queuing the log failed: {e!r}")
 
         # Finally: delete the /close command message
         await _delete_cmd_msg(event)
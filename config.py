@@ -7,4 +7,49 @@ DB_NAME = "ExanicNew"
 OWNER_ID = [8145806296 , 6426715166]
 ESCROW_GROUP_IDS = {"-1002248727398": True , "-1002676048878": True , "-4885554031":True}
 LOG_CHANNEL_ID = -1002747246243
-FOOTER_INFO_DATE = "💡 Data Recorded from 30/08/2025 20:00 IST"
\ No newline at end of file
+FOOTER_INFO_DATE = "💡 Data Recorded from 30/08/2025 20:00 IST"
+
+# Write-behind counters (counter_buffer.py): fold /close increments in memory and flush in bulk
+COUNTERS_WRITE_BEHIND = False
+COUNTERS_FLUSH_INTERVAL = 5      # seconds
+COUNTERS_FLUSH_MAX_PENDING = 200 # closes buffered before an early flush
+
+# form_listener stubs (form_stubs collection) expire after this many seconds unless /add uses them
+FORM_STUB_TTL = 7 * 24 * 3600
+
+# @exanic bio badge cache (badges.py): successful checks / failed lookups are reused for this long
+BADGE_TTL = 6 * 3600
+BADGE_NEGATIVE_TTL = 10 * 60
+
+# form_listener badge prefetch (deal_logic.py): max queued prefetches / concurrent speculative lookups
+FEE_PREFETCH_MAX = 256
+FEE_PREFETCH_CONCURRENCY = 2
+
+# Log-channel publisher (log_publisher.py): in-memory queue size / waiting entries merged into a digest
+LOG_QUEUE_MAX = 1000
+LOG_DIGEST_THRESHOLD = 5
+LOG_MAX_ATTEMPTS = 3   # non-transient send failures before an entry is parked in log_queue
+
+# /kickall (kickall.py): kick rate ceiling (per second, shared "kick" token bucket) / parallel kicks
+KICKALL_RATE = 5
+KICKALL_CONCURRENCY = 4
+
+# Main-group edit detection (manage.py): message-text hashes remembered / how long
+EDIT_CACHE_CAPACITY = 50_000
+EDIT_CACHE_MAX_AGE = 48 * 3600
+
+# Group-admin roster cache (admin_roster.py): seconds between scheduled refreshes
+ADMIN_ROSTER_TTL = 600
+
+# Force-subscribe membership cache (membership.py): members / non-members, seconds; max in-memory entries
+FORCE_SUB_TTL = 24 * 3600
+FORCE_SUB_NEGATIVE_TTL = 60
+FORCE_SUB_CACHE_MAX = 100_000
+
+# Per-handler metrics (metrics.py): Prometheus text endpoint (METRICS_PORT = 0 disables); latencies kept per handler for /perf
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+METRICS_SAMPLE_WINDOW = 2048
+
+# Leaderboard first-run seed (rank.py): closed deals credited per transaction
+RANK_SEED_BATCH = 1000
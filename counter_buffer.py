@@ -0,0 +1,198 @@
+# counter_buffer.py
+"""
+Optional write-behind aggregator for the /close counter path.
+
+When config.COUNTERS_WRITE_BEHIND is on, db.increment_counters_for_closed does not
+touch the hot counter docs (count/_id="1", counts{scope:"global"}, today's daily
+buckets). Instead, per close:
+  - the idempotency gate and a `counter_journal` doc (the deltas) commit together,
+  - the deltas are folded in memory per counter doc (scope/key/day filter).
+Every COUNTERS_FLUSH_INTERVAL seconds (or once COUNTERS_FLUSH_MAX_PENDING closes are
+buffered) the folded deltas go out as one bulk upsert, and the journal docs they cover
+are deleted in the same transaction. On startup the journal is replayed into memory,
+so a crash loses nothing.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+UTC = timezone.utc
+from typing import Any, Dict, List, Optional, Tuple
+
+import config
+import metrics
+from db import _client, COL_DEALS, COL_COUNTS, COL_COUNT_SIMPLE, COL_COUNTER_JOURNAL, _scoped_counter_ops
+
+ENABLED: bool = bool(getattr(config, "COUNTERS_WRITE_BEHIND", False))
+FLUSH_INTERVAL: float = float(getattr(config, "COUNTERS_FLUSH_INTERVAL", 5))
+FLUSH_MAX_PENDING: int = int(getattr(config, "COUNTERS_FLUSH_MAX_PENDING", 200))
+
+
+class _Pending:
+    """Folded, not-yet-flushed deltas plus the journal ids they came from."""
+    __slots__ = ("simple_amount", "simple_count", "scoped", "journal_ids")
+
+    def __init__(self) -> None:
+        self.simple_amount = 0.0
+        self.simple_count = 0
+        self.scoped: Dict[tuple, Tuple[dict, Dict[str, float]]] = {}
+        self.journal_ids: List[Any] = []
+
+    def add(self, journal_id: Any, amount: float, count: int, targets: List[Tuple[dict, dict]]) -> None:
+        self.simple_amount += amount
+        self.simple_count += count
+        for f, inc in targets:
+            key = tuple(sorted(f.items()))
+            slot = self.scoped.get(key)
+            if slot is None:
+                slot = self.scoped[key] = (dict(f), {})
+            for field, v in inc.items():
+                slot[1][field] = slot[1].get(field, 0) + v
+        self.journal_ids.append(journal_id)
+
+    def merge(self, other: "_Pending") -> None:
+        self.simple_amount += other.simple_amount
+        self.simple_count += other.simple_count
+        for key, (f, inc) in other.scoped.items():
+            slot = self.scoped.setdefault(key, (f, {}))
+            for field, v in inc.items():
+                slot[1][field] = slot[1].get(field, 0) + v
+        self.journal_ids.extend(other.journal_ids)
+
+
+class _JournalMismatch(Exception):
+    """Some journal docs in the batch were already flushed (e.g. by another process)."""
+
+
+_pending = _Pending()
+_inflight: Optional[_Pending] = None  # batch being written by flush()
+_flush_lock = asyncio.Lock()
+_task: Optional[asyncio.Task] = None
+
+
+def pending_simple() -> Tuple[float, int]:
+    """(amount, count) buffered on top of the persisted count/_id="1" doc."""
+    amount, count = _pending.simple_amount, _pending.simple_count
+    if _inflight is not None:
+        amount += _inflight.simple_amount
+        count += _inflight.simple_count
+    return amount, count
+
+
+def _journal_doc(deal_oid: Any, amount: float, targets: List[Tuple[dict, dict]]) -> dict:
+    return {
+        "deal_oid": deal_oid,
+        "simple": {"amount": amount, "count": 1},
+        "scoped": [{"filter": f, "inc": inc} for f, inc in targets],
+        "created_at": datetime.now(UTC),
+    }
+
+
+async def journal_close(gate_filter: dict, gate_update: dict, amount: float,
+                        targets: List[Tuple[dict, dict]]) -> None:
+    """Idempotency gate + durable journal entry, then fold into memory."""
+    doc = _journal_doc(gate_filter["_id"], amount, targets)
+    try:
+        async with await _client.start_session() as session:
+            async with session.start_transaction():
+                res = await COL_DEALS.update_one(gate_filter, gate_update, session=session)
+                if res.modified_count != 1:
+                    return
+                ins = await COL_COUNTER_JOURNAL.insert_one(doc, session=session)
+    except Exception:
+        # no transactions: gate first, then journal (a crash in between loses one close)
+        res = await COL_DEALS.update_one(gate_filter, gate_update)
+        if res.modified_count != 1:
+            return
+        doc.pop("_id", None)
+        ins = await COL_COUNTER_JOURNAL.insert_one(doc)
+
+    _pending.add(ins.inserted_id, amount, 1, targets)
+    if len(_pending.journal_ids) >= FLUSH_MAX_PENDING and not _flush_lock.locked():
+        metrics.background(flush())
+
+
+async def flush() -> int:
+    """Write all buffered deltas in one bulk upsert; returns the number of closes flushed."""
+    global _pending, _inflight
+    async with _flush_lock:
+        batch, _pending = _pending, _Pending()
+        if not batch.journal_ids:
+            return 0
+        _inflight = batch
+        try:
+            return await _write_batch(batch)
+        finally:
+            _inflight = None
+
+
+async def _write_batch(batch: _Pending) -> int:
+    """One transaction: drop the covered journal docs and apply the folded deltas."""
+    global _pending
+    ops = _scoped_counter_ops([(f, inc) for f, inc in batch.scoped.values()])
+    simple_update = {"$inc": {"amount": batch.simple_amount, "count": batch.simple_count}}
+    try:
+        async with await _client.start_session() as session:
+            async with session.start_transaction():
+                res = await COL_COUNTER_JOURNAL.delete_many({"_id": {"$in": batch.journal_ids}}, session=session)
+                if res.deleted_count != len(batch.journal_ids):
+                    # another process flushed some of these; abort and rebuild from the journal
+                    raise _JournalMismatch()
+                await COL_COUNT_SIMPLE.update_one({"_id": "1"}, simple_update, upsert=True, session=session)
+                if ops:
+                    await COL_COUNTS.bulk_write(ops, ordered=False, session=session)
+    except _JournalMismatch:
+        await _reload(batch.journal_ids)
+        return 0
+    except Exception:
+        # no transactions: counters first, then the journal (at-least-once on a crash in between)
+        try:
+            await asyncio.gather(
+                COL_COUNT_SIMPLE.update_one({"_id": "1"}, simple_update, upsert=True),
+                COL_COUNTS.bulk_write(ops, ordered=False) if ops else asyncio.sleep(0),
+            )
+            await COL_COUNTER_JOURNAL.delete_many({"_id": {"$in": batch.journal_ids}})
+        except Exception as e:
+            print(f"[counter_buffer] flush failed, keeping {len(batch.journal_ids)} closes buffered: {e!r}")
+            batch.merge(_pending)
+            _pending = batch
+            return 0
+    return len(batch.journal_ids)
+
+
+async def _reload(only_ids: Optional[List[Any]] = None) -> None:
+    """Fold journal docs (all, or a subset) back into the in-memory buffer."""
+    query = {"_id": {"$in": only_ids}} if only_ids is not None else {}
+    async for j in COL_COUNTER_JOURNAL.find(query):
+        simple = j.get("simple") or {}
+        targets = [(t["filter"], t["inc"]) for t in j.get("scoped", [])]
+        _pending.add(j["_id"], float(simple.get("amount", 0.0)), int(simple.get("count", 0)), targets)
+
+
+async def _flush_loop() -> None:
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL)
+        try:
+            await flush()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[counter_buffer] periodic flush error: {e!r}")
+
+
+async def start() -> None:
+    """Replay unflushed journal entries (crash recovery) and start the flush loop."""
+    global _task
+    if not ENABLED or _task is not None:
+        return
+    await _reload()
+    await flush()
+    _task = asyncio.create_task(_flush_loop())
+
+
+async def stop() -> None:
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
+    if ENABLED:
+        await flush()
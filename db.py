@@ -1,6 +1,7 @@
 # db.py
 from __future__ import annotations
-from datetime import datetime, timezone, date
+import asyncio
+from datetime import datetime, timezone
 UTC = timezone.utc
 from typing import Iterable, List, Tuple, Any, Optional
 
@@ -9,8 +10,10 @@ from motor.motor_asyncio import (
     AsyncIOMotorCollection,
     AsyncIOMotorDatabase,
 )
-from pymongo import ASCENDING, IndexModel, ReturnDocument
-from pymongo.errors import OperationFailure
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne, DeleteMany
+from pymongo.errors import OperationFailure, DuplicateKeyError
+
+from utils.timebuckets import UNITS as BUCKET_UNITS, period_key, legacy_day_to_key
 
 # -----------------------------------------------------------------------------
 # Config
@@ -19,11 +22,16 @@ try:
     from config import MONGO_URI, DB_NAME
 except Exception as e:
     raise RuntimeError("Missing config.MONGO_URI or config.DB_NAME") from e
+import config
+import metrics
+FORM_STUB_TTL: int = int(getattr(config, "FORM_STUB_TTL", 7 * 24 * 3600))
+FORCE_SUB_TTL: int = int(getattr(config, "FORCE_SUB_TTL", 24 * 3600))
 
 # -----------------------------------------------------------------------------
 # Client / DB / Collections (public API unchanged + one new)
 # -----------------------------------------------------------------------------
-_client: AsyncIOMotorClient = AsyncIOMotorClient(MONGO_URI)
+# MONGO_LISTENER counts round-trips per handler (metrics.py)
+_client: AsyncIOMotorClient = AsyncIOMotorClient(MONGO_URI, event_listeners=[metrics.MONGO_LISTENER])
 db: AsyncIOMotorDatabase = _client[DB_NAME]
 
 COL_USERS: AsyncIOMotorCollection = db["users"]
@@ -31,6 +39,40 @@ COL_DEALS: AsyncIOMotorCollection = db["deals"]
 COL_ESCROWERS: AsyncIOMotorCollection = db["escrowers"]
 COL_COUNTS: AsyncIOMotorCollection = db["counts"]  # scoped counters (newer design)
 
+# Materialized per-user leaderboard, maintained on deal close (see rank.py)
+# Shape: { user_id: <int>, total_volume: <float>, count: <int>, name: <str>, updated_at }
+COL_USER_VOLUMES: AsyncIOMotorCollection = db["user_volumes"]
+
+# Write-behind journal: one doc per closed deal whose counter deltas are not flushed yet
+COL_COUNTER_JOURNAL: AsyncIOMotorCollection = db["counter_journal"]
+
+# Deal forms seen by form_listener, consumed by /add; expire after FORM_STUB_TTL
+# Shape: { chat_id, message_id, buyer_username, seller_username, created_at }
+COL_FORM_STUBS: AsyncIOMotorCollection = db["form_stubs"]
+
+# Durable queue for log-channel messages (log_publisher.py)
+# Shape: { html, created_at, parked?, attempts?, error?, parked_at? }  (parked: gave up sending, not replayed)
+COL_LOG_QUEUE: AsyncIOMotorCollection = db["log_queue"]
+
+# /kickall runs (kickall.py), resumed after a restart while status == "running" (one per chat)
+# Shape: { chat_id, initiator_id, status, kicked, failed, status_chat_id, status_msg_id, started_at, updated_at }
+COL_KICKALL_JOBS: AsyncIOMotorCollection = db["kickall_jobs"]
+
+# Confirmed force-subscribe channel members (membership.py); expire after FORCE_SUB_TTL
+# Shape: { channel, user_id, verified_at }
+COL_SUB_MEMBERS: AsyncIOMotorCollection = db["sub_members"]
+
+# Uploaded media reused by reference (start_media.py)
+# Shape: { _id: <name>, url, photo_id, access_hash, file_reference, updated_at }
+COL_MEDIA_CACHE: AsyncIOMotorCollection = db["media_cache"]
+
+# Sequence counters (deal_ids.py): { _id: "deal_id", next: <int> }
+COL_SEQUENCES: AsyncIOMotorCollection = db["sequences"]
+
+# One-off state markers, e.g. rank.py's leaderboard seed:
+# { _id: "user_volumes", seeded: <bool>, legacy_applied: <bool>, seeded_at }
+COL_META: AsyncIOMotorCollection = db["meta"]
+
 # NEW: the old simple global counter (single doc)
 # Shape: { _id: "1", amount: <float>, count: <int> }
 COL_COUNT_SIMPLE: AsyncIOMotorCollection = db["count"]
@@ -53,6 +95,9 @@ def _has_equivalent_index(indexes_info: dict, *, key, unique: bool = False) -> b
             return True
     return False
 
+def _key_has(index_info: dict, field: str) -> bool:
+    return any(k == field for k, _ in _key_tuple(index_info.get("key", [])))
+
 async def _create_indexes_safely(col: AsyncIOMotorCollection, models: List[IndexModel]) -> None:
     if not models:
         return
@@ -95,6 +140,8 @@ async def ensure_indexes() -> None:
         ([("form_chat_id", ASCENDING)], "deal_form_chat_id"),
         ([("buyer_username", ASCENDING)], "deal_buyer_username"),
         ([("seller_username", ASCENDING)], "deal_seller_username"),
+        ([("buyer_user_id", ASCENDING), ("status", ASCENDING)], "deal_buyer_uid_status"),
+        ([("seller_user_id", ASCENDING), ("status", ASCENDING)], "deal_seller_uid_status"),
     ):
         if not _has_equivalent_index(deals_info, key=k):
             deal_models.append(IndexModel(k, name=name))
@@ -119,29 +166,74 @@ async def ensure_indexes() -> None:
             unique=True,
             partialFilterExpression={"scope": "global"},
         ))
-    if "daily_idx" not in counts_info:
-        counts_models.append(IndexModel(
-            [("scope", ASCENDING), ("date_utc", ASCENDING)],
-            name="daily_idx",
-            unique=True,
-            partialFilterExpression={"scope": "daily"},
-        ))
-    if "group_daily_idx" not in counts_info:
-        counts_models.append(IndexModel(
-            [("scope", ASCENDING), ("group_id", ASCENDING), ("date_utc", ASCENDING)],
-            name="group_daily_idx",
-            unique=True,
-            partialFilterExpression={"scope": "group_daily"},
-        ))
-    if "escrower_daily_idx" not in counts_info:
-        counts_models.append(IndexModel(
-            [("scope", ASCENDING), ("escrower_id", ASCENDING), ("date_utc", ASCENDING)],
-            name="escrower_daily_idx",
-            unique=True,
-            partialFilterExpression={"scope": "escrower_daily"},
-        ))
+    # Periodic buckets (IST, see utils/timebuckets.py): one unique index per
+    # (dimension, unit) scope, keyed by `period`. Old date_utc-keyed daily docs are
+    # re-keyed by migrate_counts_buckets.py only; until then the daily indexes wait.
+    unmigrated = any(_key_has(info, "date_utc") for info in counts_info.values())
+    if unmigrated:
+        print("[db][ensure_indexes] counts still has date_utc daily docs: run `python migrate_counts_buckets.py`")
+    for unit in BUCKET_UNITS:
+        for scope, dim in ((unit, None), (f"group_{unit}", "group_id"), (f"escrower_{unit}", "escrower_id")):
+            name = f"{scope}_idx"
+            if name in counts_info or (unmigrated and scope in LEGACY_DAILY_SCOPES):
+                continue
+            keys = [("scope", ASCENDING)] + ([(dim, ASCENDING)] if dim else []) + [("period", ASCENDING)]
+            counts_models.append(IndexModel(keys, name=name, unique=True, partialFilterExpression={"scope": scope}))
     await _create_indexes_safely(COL_COUNTS, counts_models)
 
+    # FORM STUBS (TTL)
+    stub_info = await COL_FORM_STUBS.index_information()
+    stub_models: List[IndexModel] = []
+    if not _has_equivalent_index(stub_info, key=[("chat_id", ASCENDING), ("message_id", ASCENDING)], unique=True):
+        stub_models.append(IndexModel([("chat_id", ASCENDING), ("message_id", ASCENDING)],
+                                      name="form_stub_key_unique", unique=True))
+    if not _has_equivalent_index(stub_info, key=[("created_at", ASCENDING)]):
+        stub_models.append(IndexModel([("created_at", ASCENDING)], name="form_stub_ttl",
+                                      expireAfterSeconds=int(FORM_STUB_TTL)))
+    await _create_indexes_safely(COL_FORM_STUBS, stub_models)
+
+    # LOG QUEUE (replayed oldest-first on startup)
+    lq_info = await COL_LOG_QUEUE.index_information()
+    if not _has_equivalent_index(lq_info, key=[("created_at", ASCENDING)]):
+        await _create_indexes_safely(COL_LOG_QUEUE, [IndexModel([("created_at", ASCENDING)], name="log_queue_created_at")])
+
+    # KICKALL JOBS: at most one "running" job per chat (a double-tapped confirm loses the race)
+    kj_info = await COL_KICKALL_JOBS.index_information()
+    if "kickall_running_chat_unique" not in kj_info:
+        # runs duplicated before the index existed: keep the newest, retire the rest
+        dup = COL_KICKALL_JOBS.aggregate([
+            {"$match": {"status": "running"}},
+            {"$sort": {"started_at": -1}},
+            {"$group": {"_id": "$chat_id", "ids": {"$push": "$_id"}, "n": {"$sum": 1}}},
+            {"$match": {"n": {"$gt": 1}}},
+        ])
+        async for g in dup:
+            await COL_KICKALL_JOBS.update_many({"_id": {"$in": g["ids"][1:]}}, {"$set": {"status": "duplicate"}})
+        await _create_indexes_safely(COL_KICKALL_JOBS, [IndexModel(
+            [("chat_id", ASCENDING)], name="kickall_running_chat_unique", unique=True,
+            partialFilterExpression={"status": "running"},
+        )])
+
+    # SUB MEMBERS (TTL)
+    sm_info = await COL_SUB_MEMBERS.index_information()
+    sm_models: List[IndexModel] = []
+    if not _has_equivalent_index(sm_info, key=[("channel", ASCENDING), ("user_id", ASCENDING)], unique=True):
+        sm_models.append(IndexModel([("channel", ASCENDING), ("user_id", ASCENDING)],
+                                    name="sub_member_key_unique", unique=True))
+    if not _has_equivalent_index(sm_info, key=[("verified_at", ASCENDING)]):
+        sm_models.append(IndexModel([("verified_at", ASCENDING)], name="sub_member_ttl",
+                                    expireAfterSeconds=int(FORCE_SUB_TTL)))
+    await _create_indexes_safely(COL_SUB_MEMBERS, sm_models)
+
+    # USER VOLUMES (leaderboard projection)
+    uv_info = await COL_USER_VOLUMES.index_information()
+    uv_models: List[IndexModel] = []
+    if not _has_equivalent_index(uv_info, key=[("user_id", ASCENDING)], unique=True):
+        uv_models.append(IndexModel([("user_id", ASCENDING)], name="uv_user_id_unique", unique=True))
+    if not _has_equivalent_index(uv_info, key=[("total_volume", DESCENDING), ("user_id", ASCENDING)]):
+        uv_models.append(IndexModel([("total_volume", DESCENDING), ("user_id", ASCENDING)], name="uv_volume_desc"))
+    await _create_indexes_safely(COL_USER_VOLUMES, uv_models)
+
     # COUNT (simple, one doc with _id="1")
     # _id is already unique; no extra index needed. Ensure doc exists:
     await COL_COUNT_SIMPLE.update_one(
@@ -156,19 +248,256 @@ async def ensure_indexes() -> None:
 async def ping() -> dict:
     return await db.command("ping")
 
-def _utc_day_str(dt: Optional[datetime] = None) -> str:
-    if dt is None:
-        return date.fromtimestamp(datetime.now(UTC).timestamp()).isoformat()
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=UTC)
-    return dt.date().isoformat()
+# -----------------------------------------------------------------------------
+# Deal party user_ids (buyer_user_id / seller_user_id on deals)
+# -----------------------------------------------------------------------------
+async def resolve_user_ids(*usernames: Optional[str]) -> dict:
+    """Map lowercase username -> user_id for the usernames already linked in `users`."""
+    names = list({u.strip().lstrip("@").lower() for u in usernames if u})
+    if not names:
+        return {}
+    out = {}
+    cursor = COL_USERS.find({"username": {"$in": names}, "user_id": {"$ne": None}}, {"username": 1, "user_id": 1})
+    async for u in cursor:
+        out[u["username"]] = int(u["user_id"])
+    return out
+
+async def backfill_deal_user_ids() -> None:
+    """
+    One server-side pass: fill buyer_user_id/seller_user_id on deals that lack them
+    from `users` (username -> user_id). Deals whose usernames are still unlinked keep nulls.
+    """
+    pipeline = [
+        {"$match": {"$or": [{"buyer_user_id": None}, {"seller_user_id": None}]}},
+        {"$lookup": {"from": "users", "localField": "buyer_username", "foreignField": "username", "as": "b"}},
+        {"$lookup": {"from": "users", "localField": "seller_username", "foreignField": "username", "as": "s"}},
+        {"$project": {
+            "buyer_user_id": {"$ifNull": ["$buyer_user_id", {"$arrayElemAt": ["$b.user_id", 0]}]},
+            "seller_user_id": {"$ifNull": ["$seller_user_id", {"$arrayElemAt": ["$s.user_id", 0]}]},
+        }},
+        {"$merge": {"into": "deals", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}},
+    ]
+    async for _ in COL_DEALS.aggregate(pipeline):
+        pass
+
+_linked: set = set()  # (user_id, username) pairs already linked by this process
+
+
+async def link_user(user_id: int, username: Optional[str]) -> int:
+    """
+    Record username -> user_id in `users`, then late-bind deals that only carry the
+    username. Returns the number of deal sides bound. Cheap to call on every path
+    that learns a user's id and username (repeat pairs are skipped in-process).
+
+    Deals not yet credited to the leaderboard are just bound (their volumes_applied
+    gate in rank.apply_closed_deal_volume reads the id back); a deal already past the
+    gate is bound one side at a time and that side is credited here, so each deal
+    side reaches user_volumes exactly once.
+    """
+    uname = (username or "").strip().lstrip("@").lower()
+    if not uname:
+        return 0
+    uid = int(user_id)
+    if (uid, uname) in _linked:
+        return 0
+    now = datetime.now(UTC)
+    try:
+        await COL_USERS.update_one(
+            {"user_id": uid},
+            {"$set": {"username": uname, "updated_at": now}, "$setOnInsert": {"created_at": now}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # another row holds the username: merge a username-only row (deal_logic creates
+        # one per party at /add) into the id row; an other id's row (renamed since) loses it
+        async def merge(session):
+            holder = await COL_USERS.find_one({"username": uname}, session=session)
+            extra: dict = {}
+            if holder is not None and holder.get("user_id") is None:
+                await COL_USERS.delete_one({"_id": holder["_id"]}, session=session)
+                extra = {k: v for k, v in holder.items() if k not in ("_id", "user_id", "username", "updated_at")}
+            elif holder is not None and int(holder["user_id"]) != uid:
+                await COL_USERS.update_one({"_id": holder["_id"]}, {"$unset": {"username": ""}}, session=session)
+            created = extra.pop("created_at", now)
+            await COL_USERS.update_one(
+                {"user_id": uid},
+                {"$set": {**extra, "username": uname, "updated_at": now}, "$setOnInsert": {"created_at": created}},
+                upsert=True, session=session,
+            )
+        try:
+            await run_in_transaction(merge)
+        except DuplicateKeyError as e:
+            print(f"[db][link_user] cannot link {uname} -> {uid}: {e}")
+            return 0
+
+    from rank import CONSIDERED_STATUSES
+    bound = 0
+    volume, count = 0.0, 0
+    for side, other in (("buyer", "seller"), ("seller", "buyer")):
+        res = await COL_DEALS.update_many(
+            {f"{side}_username": uname, f"{side}_user_id": None, "volumes_applied": {"$ne": True}},
+            {"$set": {f"{side}_user_id": uid}},
+        )
+        bound += res.modified_count
+        cursor = COL_DEALS.find(
+            {f"{side}_username": uname, f"{side}_user_id": None, "volumes_applied": True},
+            {"amount": 1, "status": 1, f"{other}_user_id": 1},
+        )
+        async for d in cursor:
+            res = await COL_DEALS.update_one(
+                {"_id": d["_id"], f"{side}_user_id": None},
+                {"$set": {f"{side}_user_id": uid}},
+            )
+            if res.modified_count != 1:
+                continue
+            bound += 1
+            # buyer == seller: the deal counts once per user
+            if d.get("status") in CONSIDERED_STATUSES and d.get(f"{other}_user_id") != uid:
+                volume += float(d.get("amount", 0.0) or 0.0)
+                count += 1
+    if count:
+        from rank import credit_user_volume
+        await credit_user_volume(db, uid, volume, count)
+    _linked.add((uid, uname))
+    return bound
+
+# -----------------------------------------------------------------------------
+# One-off migration: daily counts keyed by date_utc → IST `period`
+# -----------------------------------------------------------------------------
+LEGACY_DAILY_SCOPES = ("daily", "group_daily", "escrower_daily")
+
+async def migrate_counts_to_ist_periods() -> int:
+    """
+    Re-key every daily/group_daily/escrower_daily doc that still carries `date_utc`
+    (UTC ISO string from the old db writer, or IST-midnight datetime from the old
+    stats_counters writer) onto the canonical IST `period` key, merging docs that
+    land on the same bucket. Returns docs re-keyed.
+
+    Run from migrate_counts_buckets.py only. The old date_utc unique indexes are
+    dropped first (index builds cannot run in a transaction); the rewrite itself — the
+    re-keyed upserts and deleting exactly the docs they replace — runs in one
+    transaction where available, so a failure leaves the legacy docs in place to retry.
+    Docs whose date_utc cannot be parsed are kept, moved to "<scope>_unparsed" so they
+    stay out of the period indexes, for manual review.
+    """
+    for name, info in (await COL_COUNTS.index_information()).items():
+        if _key_has(info, "date_utc"):
+            await COL_COUNTS.drop_index(name)
+
+    async def op(session):
+        folded: dict = {}
+        rekeyed: List[Any] = []
+        unparsed: List[Any] = []
+        cursor = COL_COUNTS.find({"scope": {"$in": list(LEGACY_DAILY_SCOPES)}, "date_utc": {"$exists": True}},
+                                 session=session)
+        async for d in cursor:
+            period = legacy_day_to_key(d.get("date_utc"))
+            if period is None:
+                unparsed.append((d["_id"], d["scope"]))
+                continue
+            rekeyed.append(d["_id"])
+            f = {"scope": d["scope"], "period": period}
+            if d["scope"] == "group_daily":
+                f["group_id"] = d.get("group_id")
+            elif d["scope"] == "escrower_daily":
+                f["escrower_id"] = d.get("escrower_id")
+            key = tuple(sorted(f.items()))
+            slot = folded.setdefault(key, (f, {"deals": 0, "volume_main": 0.0, "fees": 0.0}))
+            for field in ("deals", "volume_main", "fees"):
+                slot[1][field] += d.get(field, 0) or 0
+
+        now = datetime.now(UTC)
+        ops: List[Any] = [UpdateOne({"_id": oid}, {"$set": {"scope": f"{scope}_unparsed"}}) for oid, scope in unparsed]
+        if rekeyed:
+            ops.append(DeleteMany({"_id": {"$in": rekeyed}}))
+            ops += [UpdateOne(f, {"$inc": inc, "$set": {"updated_at": now}}, upsert=True) for f, inc in folded.values()]
+        if ops:
+            await COL_COUNTS.bulk_write(ops, ordered=True, session=session)
+        if unparsed:
+            print(f"[db][migrate_counts] kept {len(unparsed)} docs with an unparseable date_utc as <scope>_unparsed")
+        return len(rekeyed)
+
+    return await run_in_transaction(op)
+
+# -----------------------------------------------------------------------------
+# Form stubs (form_listener → /add)
+# -----------------------------------------------------------------------------
+async def save_form_stub(chat_id: int, message_id: int, buyer_username: str, seller_username: str) -> None:
+    """One stub per (chat_id, message_id); repeats just refresh the usernames."""
+    await COL_FORM_STUBS.update_one(
+        {"chat_id": int(chat_id), "message_id": int(message_id)},
+        {"$set": {"buyer_username": buyer_username.lower(), "seller_username": seller_username.lower()},
+         "$setOnInsert": {"created_at": datetime.now(UTC)}},
+        upsert=True,
+    )
+
+async def get_form_stub(chat_id: Optional[int], message_id: int) -> Optional[dict]:
+    """The stub for a form message (None if never seen or expired). Read-only."""
+    if chat_id is None:
+        return None
+    return await COL_FORM_STUBS.find_one({"chat_id": int(chat_id), "message_id": int(message_id)})
+
+async def delete_form_stub(chat_id: Optional[int], message_id: int) -> None:
+    """Drop a stub once its deal exists (unused stubs just expire via the TTL index)."""
+    if chat_id is None:
+        return
+    await COL_FORM_STUBS.delete_one({"chat_id": int(chat_id), "message_id": int(message_id)})
+
+def _marked_chat_id(chat_id: int) -> int:
+    """
+    Legacy stubs stored the unmarked `event.chat.id`; form_listener and /add use the
+    marked `event.chat_id` (-100… for channels/supergroups, -… for basic groups).
+    A positive id is marked as a basic group only when that form is a configured
+    escrow group and the channel form is not; otherwise as a channel.
+    """
+    if chat_id < 0:
+        return chat_id
+    from telethon.utils import get_peer_id
+    from telethon.tl.types import PeerChannel, PeerChat
+    known = {int(c) for c in (getattr(config, "ESCROW_GROUP_IDS", None) or {})}
+    as_channel = get_peer_id(PeerChannel(chat_id))
+    as_chat = get_peer_id(PeerChat(chat_id))
+    return as_chat if as_chat in known and as_channel not in known else as_channel
+
+async def migrate_deal_stubs_to_form_stubs(batch: int = 1000) -> int:
+    """
+    Move the old form_listener stubs (deals with deal_id None, status "pending")
+    out of `deals` into `form_stubs`, keyed by the marked chat id /add looks up.
+    Returns the number of deal docs removed.
+    """
+    moved = 0
+    query = {"deal_id": None, "status": "pending"}
+    while True:
+        docs = [d async for d in COL_DEALS.find(query).limit(batch)]
+        if not docs:
+            return moved
+        ops = []
+        for d in docs:
+            if d.get("form_chat_id") is None or d.get("form_message_id") is None:
+                continue
+            ops.append(UpdateOne(
+                {"chat_id": _marked_chat_id(int(d["form_chat_id"])), "message_id": int(d["form_message_id"])},
+                {"$setOnInsert": {
+                    "buyer_username": d.get("buyer_username"),
+                    "seller_username": d.get("seller_username"),
+                    "created_at": d.get("created_at") or datetime.now(UTC),
+                }},
+                upsert=True,
+            ))
+        if ops:
+            await COL_FORM_STUBS.bulk_write(ops, ordered=False)
+        res = await COL_DEALS.delete_many({"_id": {"$in": [d["_id"] for d in docs]}})
+        moved += res.deleted_count
 
 # -----------------------------------------------------------------------------
 # Simple global counters (old design) — fast path for /gstats & logging
 # -----------------------------------------------------------------------------
 async def read_simple_global() -> tuple[float, int]:
+    """Persisted totals plus any deltas still buffered by the write-behind aggregator."""
     doc = await COL_COUNT_SIMPLE.find_one({"_id": "1"}) or {}
-    return float(doc.get("amount", 0.0)), int(doc.get("count", 0))
+    import counter_buffer
+    p_amount, p_count = counter_buffer.pending_simple()
+    return float(doc.get("amount", 0.0)) + p_amount, int(doc.get("count", 0)) + p_count
 
 async def inc_simple_global(amount_delta: float, count_delta: int = 1) -> None:
     await COL_COUNT_SIMPLE.update_one(
@@ -186,7 +515,7 @@ async def set_simple_global(amount_total: float, count_total: int) -> dict:
     )
 
 # -----------------------------------------------------------------------------
-# Scoped counters (new design) — global/daily/group_daily/escrower_daily
+# Scoped counters (new design) — global + IST daily/weekly/monthly/yearly buckets
 # -----------------------------------------------------------------------------
 async def init_counts_documents() -> None:
     await COL_COUNTS.update_one(
@@ -204,9 +533,9 @@ async def inc_counts_global(amount: float) -> None:
     )
 
 async def inc_counts_daily(amount: float, when: Optional[datetime] = None) -> None:
-    day = _utc_day_str(when)
+    day = period_key("daily", when)
     await COL_COUNTS.update_one(
-        {"scope": "daily", "date_utc": day},
+        {"scope": "daily", "period": day},
         {"$inc": {"deals": 1, "volume_main": float(amount)},
          "$set": {"updated_at": datetime.now(UTC)}},
         upsert=True,
@@ -215,9 +544,9 @@ async def inc_counts_daily(amount: float, when: Optional[datetime] = None) -> No
 async def inc_counts_group_daily(amount: float, group_id: Optional[int], when: Optional[datetime] = None) -> None:
     if group_id is None:
         return
-    day = _utc_day_str(when)
+    day = period_key("daily", when)
     await COL_COUNTS.update_one(
-        {"scope": "group_daily", "group_id": int(group_id), "date_utc": day},
+        {"scope": "group_daily", "group_id": int(group_id), "period": day},
         {"$inc": {"deals": 1, "volume_main": float(amount)},
          "$set": {"updated_at": datetime.now(UTC)}},
         upsert=True,
@@ -226,9 +555,9 @@ async def inc_counts_group_daily(amount: float, group_id: Optional[int], when: O
 async def inc_counts_escrower_daily(amount: float, escrower_id: Optional[int], when: Optional[datetime] = None) -> None:
     if escrower_id is None:
         return
-    day = _utc_day_str(when)
+    day = period_key("daily", when)
     await COL_COUNTS.update_one(
-        {"scope": "escrower_daily", "escrower_id": int(escrower_id), "date_utc": day},
+        {"scope": "escrower_daily", "escrower_id": int(escrower_id), "period": day},
         {"$inc": {"deals": 1, "volume_main": float(amount)},
          "$set": {"updated_at": datetime.now(UTC)}},
         upsert=True,
@@ -237,27 +566,47 @@ async def inc_counts_escrower_daily(amount: float, escrower_id: Optional[int], w
 # -----------------------------------------------------------------------------
 # ONE entry point to keep BOTH stores consistent (idempotent)
 # -----------------------------------------------------------------------------
-async def increment_counters_for_closed(deal: dict, *, amount_field: str = "main_amount") -> None:
+def _scoped_counter_targets(amount: float, when: datetime, form_chat_id: Optional[int],
+                            escrower_id: Optional[int], fee: float = 0.0) -> List[Tuple[dict, dict]]:
+    """(filter, $inc fields) for every `counts` scope touched by one closed deal (in write order)."""
+    inc = {"deals": 1, "volume_main": amount, "fees": fee}
+    targets = [({"scope": "global"}, inc)]
+    for unit in BUCKET_UNITS:
+        period = period_key(unit, when)
+        targets.append(({"scope": unit, "period": period}, inc))
+        if form_chat_id is not None:
+            targets.append(({"scope": f"group_{unit}", "group_id": int(form_chat_id), "period": period}, inc))
+        if escrower_id is not None:
+            targets.append(({"scope": f"escrower_{unit}", "escrower_id": int(escrower_id), "period": period}, inc))
+    return targets
+
+def _scoped_counter_ops(targets: List[Tuple[dict, dict]]) -> List[UpdateOne]:
+    now = datetime.now(UTC)
+    return [UpdateOne(f, {"$inc": inc, "$set": {"updated_at": now}}, upsert=True) for f, inc in targets]
+
+async def increment_counters_for_closed(deal: dict, *, amount_field: str = "main_amount") -> Optional[Tuple[float, int]]:
     """
     Call this exactly once when a deal is marked closed.
     - Idempotent via 'counters_applied'=True gate on the deal document.
-    - Updates BOTH the simple global doc and the scoped counters.
+    - Updates BOTH the simple global doc and the scoped counters (deals, volume_main, fees).
     - amount_field should match what you want to report everywhere ('main_amount' recommended).
 
+    Gate + simple global + one ordered bulk_write of the scoped upserts commit in a
+    single transaction (3 round-trips + commit). Without transactions the same writes
+    go out as the gate followed by the simple update and the bulk_write concurrently.
+    With config.COUNTERS_WRITE_BEHIND the deltas are journaled and flushed in batches
+    by counter_buffer instead.
+
+    Returns the simple global (amount, count) right after this deal was applied (so
+    the close log needs no extra read), or None when nothing was written here
+    (already applied, or write-behind mode) — use read_simple_global() then.
+
     Expects deal with:
       _id, status='closed', closed_at (datetime, tz-aware preferred),
       form_chat_id (int), escrower_id (int), and amount field provided by 'amount_field'.
     """
     if not deal:
-        return
-
-    # Idempotency guard: only first caller performs increments
-    res = await COL_DEALS.update_one(
-        {"_id": deal["_id"], "counters_applied": {"$ne": True}},
-        {"$set": {"counters_applied": True}},
-    )
-    if res.modified_count != 1:
-        return  # already applied → do nothing
+        return None
 
     when: datetime = deal.get("closed_at") or datetime.now(UTC)
     form_chat_id: Optional[int] = deal.get("form_chat_id")
@@ -268,59 +617,51 @@ async def increment_counters_for_closed(deal: dict, *, amount_field: str = "main
         amount = float(raw_amount)
     except Exception:
         amount = 0.0
+    try:
+        fee = float(deal.get("fee") or 0.0)
+    except Exception:
+        fee = 0.0
+
+    gate_filter = {"_id": deal["_id"], "counters_applied": {"$ne": True}}
+    gate_update = {"$set": {"counters_applied": True}}
+    simple_update = {"$inc": {"amount": amount, "count": 1}}
+    targets = _scoped_counter_targets(amount, when, form_chat_id, escrower_id, fee)
+
+    # Write-behind mode: journal the deltas durably, fold them in memory, flush later
+    import counter_buffer
+    if counter_buffer.ENABLED:
+        await counter_buffer.journal_close(gate_filter, gate_update, amount, targets)
+        return None
 
-    # Update BOTH stores. Try a transaction; if unavailable, fall back to separate ops.
-    session = await _client.start_session()
+    ops = _scoped_counter_ops(targets)
+
+    # Preferred: everything (including the idempotency gate) in one transaction
     try:
-        async with session.start_transaction():
-            # Simple global
-            await COL_COUNT_SIMPLE.update_one(
-                {"_id": "1"},
-                {"$inc": {"amount": amount, "count": 1}},
-                upsert=True,
-                session=session,
-            )
-            # Scoped
-            await COL_COUNTS.update_one(
-                {"scope": "global"},
-                {"$inc": {"deals": 1, "volume_main": amount},
-                 "$set": {"updated_at": datetime.now(UTC)}},
-                upsert=True,
-                session=session,
-            )
-            day = _utc_day_str(when)
-            await COL_COUNTS.update_one(
-                {"scope": "daily", "date_utc": day},
-                {"$inc": {"deals": 1, "volume_main": amount},
-                 "$set": {"updated_at": datetime.now(UTC)}},
-                upsert=True,
-                session=session,
-            )
-            if form_chat_id is not None:
-                await COL_COUNTS.update_one(
-                    {"scope": "group_daily", "group_id": int(form_chat_id), "date_utc": day},
-                    {"$inc": {"deals": 1, "volume_main": amount},
-                     "$set": {"updated_at": datetime.now(UTC)}},
-                    upsert=True,
-                    session=session,
-                )
-            if escrower_id is not None:
-                await COL_COUNTS.update_one(
-                    {"scope": "escrower_daily", "escrower_id": int(escrower_id), "date_utc": day},
-                    {"$inc": {"deals": 1, "volume_main": amount},
-                     "$set": {"updated_at": datetime.now(UTC)}},
-                    upsert=True,
-                    session=session,
+        async with await _client.start_session() as session:
+            async with session.start_transaction():
+                res = await COL_DEALS.update_one(gate_filter, gate_update, session=session)
+                if res.modified_count != 1:
+                    return None  # already applied → do nothing
+                simple = await COL_COUNT_SIMPLE.find_one_and_update(
+                    {"_id": "1"}, simple_update, upsert=True,
+                    return_document=ReturnDocument.AFTER, session=session,
                 )
+                await COL_COUNTS.bulk_write(ops, ordered=True, session=session)
+        return float(simple.get("amount", 0.0)), int(simple.get("count", 0))
     except Exception:
-        # Fallback: best-effort separate ops (idempotency still protects from double counts)
-        await inc_simple_global(amount, 1)
-        await inc_counts_global(amount)
-        await inc_counts_daily(amount, when)
-        await inc_counts_group_daily(amount, form_chat_id, when)
-        await inc_counts_escrower_daily(amount, escrower_id, when)
-    finally:
-        await session.end_session()
+        pass  # no transaction support (or aborted → gate rolled back); fall through
+
+    # Fallback: gate first, then both stores in parallel (idempotency still protects from double counts)
+    res = await COL_DEALS.update_one(gate_filter, gate_update)
+    if res.modified_count != 1:
+        return None
+    simple, _ = await asyncio.gather(
+        COL_COUNT_SIMPLE.find_one_and_update(
+            {"_id": "1"}, simple_update, upsert=True, return_document=ReturnDocument.AFTER,
+        ),
+        COL_COUNTS.bulk_write(ops, ordered=True),
+    )
+    return float(simple.get("amount", 0.0)), int(simple.get("count", 0))
 
 # db.py  (patched additions at bottom)
 
@@ -331,6 +672,11 @@ async def increment_counters_for_closed(deal: dict, *, amount_field: str = "main
 # -----------------------------------------------------------------------------
 COL_FEES: AsyncIOMotorCollection = db["fees"]
 
+# Running fee totals, maintained in the same transaction as every fees write.
+# Shapes: { scope: "admin", admin_id, admin_name, total, deals, updated_at }
+#         { scope: "grand", sum, count, updated_at }   (every fee record, with or without admin_id)
+COL_FEE_TOTALS: AsyncIOMotorCollection = db["fee_totals"]
+
 async def ensure_fees_indexes() -> None:
     """Ensure indexes for the fees collection."""
     info = await COL_FEES.index_information()
@@ -341,24 +687,180 @@ async def ensure_fees_indexes() -> None:
         models.append(IndexModel([("name", ASCENDING)], name="fees_name"))
     await _create_indexes_safely(COL_FEES, models)
 
+    # at most one fee record per deal (manual /addfee records carry no deal_id)
+    if "fees_deal_id_unique" not in info:
+        try:
+            await COL_FEES.create_index(
+                [("deal_id", ASCENDING)],
+                name="fees_deal_id_unique",
+                unique=True,
+                partialFilterExpression={"deal_id": {"$type": "string"}},
+            )
+        except DuplicateKeyError:
+            dupes = [d["_id"] async for d in COL_FEES.aggregate([
+                {"$match": {"deal_id": {"$type": "string"}}},
+                {"$group": {"_id": "$deal_id", "n": {"$sum": 1}}},
+                {"$match": {"n": {"$gt": 1}}},
+                {"$limit": 20},
+            ])]
+            print(f"[db][ensure_fees_indexes] WARNING: duplicate fee records for deals {dupes}; "
+                  f"fees_deal_id_unique not created. Remove the extra records (/delfee) and restart.")
+
+    t_info = await COL_FEE_TOTALS.index_information()
+    t_models: List[IndexModel] = []
+    if "fee_totals_admin_idx" not in t_info:
+        t_models.append(IndexModel(
+            [("scope", ASCENDING), ("admin_id", ASCENDING)],
+            name="fee_totals_admin_idx",
+            unique=True,
+            partialFilterExpression={"scope": "admin"},
+        ))
+    if "fee_totals_grand_idx" not in t_info:
+        t_models.append(IndexModel(
+            [("scope", ASCENDING)],
+            name="fee_totals_grand_idx",
+            unique=True,
+            partialFilterExpression={"scope": "grand"},
+        ))
+    if not _has_equivalent_index(t_info, key=[("scope", ASCENDING), ("total", DESCENDING)]):
+        t_models.append(IndexModel([("scope", ASCENDING), ("total", DESCENDING)], name="fee_totals_by_total"))
+    await _create_indexes_safely(COL_FEE_TOTALS, t_models)
+
+    # first run (or wiped summary): build fee_totals from the fees collection
+    if await COL_FEE_TOTALS.find_one({"scope": "grand"}) is None:
+        await rebuild_fee_totals()
+
 # extend ensure_indexes() to call it
 _old_ensure_indexes = ensure_indexes
 async def ensure_indexes() -> None:
     await _old_ensure_indexes()
+    await transactions_supported()
     await ensure_fees_indexes()
 
+# -----------------------------------------------------------------------------
+# fee_totals maintenance
+# -----------------------------------------------------------------------------
+def _fee_total_ops(admin_id: Optional[int], fee_delta: float, count_delta: int,
+                   admin_name: Optional[str] = None) -> List[UpdateOne]:
+    """fee_totals updates for one fee change; records without an admin count in the grand doc only."""
+    now = datetime.now(UTC)
+    ops = [
+        UpdateOne(
+            {"scope": "grand"},
+            {"$inc": {"sum": float(fee_delta), "count": int(count_delta)}, "$set": {"updated_at": now}},
+            upsert=True,
+        ),
+    ]
+    if admin_id is not None:
+        admin_set: dict = {"updated_at": now}
+        if admin_name:
+            admin_set["admin_name"] = admin_name
+        ops.insert(0, UpdateOne(
+            {"scope": "admin", "admin_id": int(admin_id)},
+            {"$inc": {"total": float(fee_delta), "deals": int(count_delta)}, "$set": admin_set},
+            upsert=True,
+        ))
+    return ops
+
+_txn_supported: Optional[bool] = None
+
+async def transactions_supported() -> bool:
+    """Topology check, made once: transactions need a replica set or a sharded cluster."""
+    global _txn_supported
+    if _txn_supported is None:
+        hello = await _client.admin.command("hello")
+        _txn_supported = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+        if not _txn_supported:
+            print("[db][transactions_supported] standalone server: multi-document writes run without a transaction")
+    return _txn_supported
+
+async def run_in_transaction(op):
+    """
+    Run op(session) inside a transaction (e.g. a fees write and its fee_totals update,
+    or a deal insert and its fee record). session.with_transaction retries the whole op
+    on TransientTransactionError (write conflicts) and UnknownTransactionCommitResult,
+    so op must be safe to re-run. Only when the deployment has no transaction support
+    (standalone, or IllegalOperation code 20) does op run with session=None.
+    """
+    global _txn_supported
+    if await transactions_supported():
+        try:
+            async with await _client.start_session() as session:
+                return await session.with_transaction(op)
+        except OperationFailure as e:
+            if e.code != 20:  # IllegalOperation: "Transaction numbers are only allowed on a replica set ..."
+                raise
+            _txn_supported = False
+            print(f"[db][run_in_transaction] transactions not supported, writing without them: {e}")
+    return await op(None)
+
+async def rebuild_fee_totals() -> int:
+    """Recompute fee_totals from the whole fees collection. Returns the number of admins."""
+    pipeline = [{"$group": {
+        "_id": "$admin_id",
+        "admin_name": {"$max": "$admin_name"},
+        "total": {"$sum": {"$ifNull": ["$fee", 0]}},
+        "deals": {"$sum": 1},
+    }}]
+    now = datetime.now(UTC)
+    docs: List[dict] = []
+    g_sum, g_count = 0.0, 0
+    async for d in COL_FEES.aggregate(pipeline):
+        # records without an admin have no per-admin row but still count in the grand total
+        g_sum += float(d.get("total", 0.0))
+        g_count += int(d.get("deals", 0))
+        if d["_id"] is None:
+            continue
+        docs.append({"scope": "admin", "admin_id": int(d["_id"]), "admin_name": d.get("admin_name"),
+                     "total": float(d.get("total", 0.0)), "deals": int(d.get("deals", 0)), "updated_at": now})
+    docs.append({"scope": "grand", "sum": g_sum, "count": g_count, "updated_at": now})
+
+    async def op(session):
+        await COL_FEE_TOTALS.delete_many({}, session=session)
+        await COL_FEE_TOTALS.insert_many(docs, session=session)
+    await run_in_transaction(op)
+    return len(docs) - 1
+
 # -----------------------------------------------------------------------------
 # CRUD HELPERS (async)
 # -----------------------------------------------------------------------------
-async def create_fee_record(admin_id: int, fee: float, name: str) -> dict:
+async def create_fee_record(admin_id: int, fee: float, name: str, *,
+                            admin_name: Optional[str] = None, deal_id: Optional[str] = None,
+                            created_at: Optional[datetime] = None, session=None) -> Optional[dict]:
+    """
+    Insert a fee record and bump fee_totals. With a deal_id the write is a single
+    $setOnInsert upsert on the unique deal_id index: returns None if the deal already
+    has a fee record. Pass `session` to join the caller's transaction.
+    """
     doc = {
         "admin_id": int(admin_id),
         "fee": float(fee),
         "name": str(name),
-        "created_at": datetime.now(UTC),
+        "created_at": created_at or datetime.now(UTC),
     }
-    res = await COL_FEES.insert_one(doc)
-    doc["_id"] = str(res.inserted_id)
+    if admin_name:
+        doc["admin_name"] = admin_name
+    if deal_id is not None:
+        doc["deal_id"] = deal_id
+
+    async def op(session):
+        doc.pop("_id", None)
+        if deal_id is None:
+            await COL_FEES.insert_one(doc, session=session)
+        else:
+            res = await COL_FEES.update_one({"deal_id": deal_id}, {"$setOnInsert": doc},
+                                            upsert=True, session=session)
+            if res.upserted_id is None:
+                return False
+            doc["_id"] = res.upserted_id
+        await COL_FEE_TOTALS.bulk_write(_fee_total_ops(admin_id, doc["fee"], 1, admin_name),
+                                        ordered=True, session=session)
+        return True
+
+    created = await op(session) if session is not None else await run_in_transaction(op)
+    if not created:
+        return None
+    doc["_id"] = str(doc["_id"])
     return doc
 
 async def get_fee_record(fee_id: str) -> Optional[dict]:
@@ -401,11 +903,22 @@ async def update_fee_record(fee_id: str, updates: dict) -> Optional[dict]:
         allowed["name"] = str(updates["name"])
     if not allowed:
         return await get_fee_record(fee_id)
-    doc = await COL_FEES.find_one_and_update(
-        {"_id": oid},
-        {"$set": allowed},
-        return_document=ReturnDocument.AFTER
-    )
+
+    async def op(session):
+        before = await COL_FEES.find_one_and_update(
+            {"_id": oid},
+            {"$set": allowed},
+            return_document=ReturnDocument.BEFORE,
+            session=session,
+        )
+        if before is None:
+            return None
+        delta = float(allowed.get("fee", before.get("fee", 0.0))) - float(before.get("fee", 0.0) or 0.0)
+        if delta:
+            await COL_FEE_TOTALS.bulk_write(_fee_total_ops(before.get("admin_id"), delta, 0),
+                                            ordered=True, session=session)
+        return {**before, **allowed}
+    doc = await run_in_transaction(op)
     if doc:
         doc["_id"] = str(doc["_id"])
     return doc
@@ -416,5 +929,12 @@ async def delete_fee_record(fee_id: str) -> bool:
         oid = ObjectId(fee_id)
     except Exception:
         return False
-    res = await COL_FEES.delete_one({"_id": oid})
-    return res.deleted_count == 1
+
+    async def op(session):
+        doc = await COL_FEES.find_one_and_delete({"_id": oid}, session=session)
+        if doc is None:
+            return False
+        await COL_FEE_TOTALS.bulk_write(_fee_total_ops(doc.get("admin_id"), -float(doc.get("fee", 0.0) or 0.0), -1),
+                                        ordered=True, session=session)
+        return True
+    return await run_in_transaction(op)
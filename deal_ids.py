@@ -0,0 +1,64 @@
+# deal_ids.py
+"""
+Deal ID allocator for the DL-XXXXXX format (6 chars, A-Z0-9).
+
+- Each process reserves blocks of BLOCK_SIZE sequence numbers with one $inc on
+  sequences/_id="deal_id", so IDs stay unique across bot processes.
+- Sequence number n is mapped to a 6-char base36 code by a fixed bijection
+  (n * MULTIPLIER + OFFSET) mod 36^6, so IDs still look random and never repeat.
+- Codes already taken by older (randomly drawn) deal_ids are dropped from a block
+  with a single $in query when it is reserved, so next_deal_id() never retries.
+"""
+
+import asyncio
+from collections import deque
+from typing import Deque
+
+from pymongo import ReturnDocument
+
+from db import COL_DEALS, COL_SEQUENCES
+
+ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+WIDTH = 6
+SPACE = len(ALPHABET) ** WIDTH   # 2,176,782,336 codes
+BLOCK_SIZE = 1000
+
+# Never change these once IDs have been issued: the mapping must stay the same bijection.
+MULTIPLIER = 1580030195          # coprime to 36^6 (odd, not a multiple of 3)
+OFFSET = 918273645
+
+_ready: Deque[str] = deque()
+_lock = asyncio.Lock()
+
+
+def encode(n: int) -> str:
+    """Sequence number -> DL-XXXXXX (bijective on 0 <= n < 36^6)."""
+    v = (n * MULTIPLIER + OFFSET) % SPACE
+    chars = []
+    for _ in range(WIDTH):
+        v, r = divmod(v, 36)
+        chars.append(ALPHABET[r])
+    return "DL-" + "".join(reversed(chars))
+
+
+async def _reserve_block() -> None:
+    doc = await COL_SEQUENCES.find_one_and_update(
+        {"_id": "deal_id"},
+        {"$inc": {"next": BLOCK_SIZE}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    end = int(doc["next"])
+    if end > SPACE:
+        raise RuntimeError("deal_id space exhausted")
+    ids = [encode(n) for n in range(end - BLOCK_SIZE, end)]
+    taken = {d["deal_id"] async for d in COL_DEALS.find({"deal_id": {"$in": ids}}, {"deal_id": 1})}
+    _ready.extend(i for i in ids if i not in taken)
+
+
+async def next_deal_id() -> str:
+    """Next unused deal_id; a Mongo round-trip only once per block."""
+    async with _lock:
+        while not _ready:
+            await _reserve_block()
+        return _ready.popleft()
@@ -1,77 +1,75 @@
-import random, string
+import asyncio
 from datetime import datetime
-from typing import Dict, Tuple
-import re
-import unicodedata
+from typing import Dict, Optional, Tuple
 
-# Telethon imports
-from telethon.tl.functions.users import GetFullUserRequest
+import config
+import metrics
 
 # Database collections
-from db import COL_DEALS, COL_USERS
+from db import COL_DEALS, COL_USERS, resolve_user_ids, run_in_transaction
+from deal_ids import next_deal_id
 
 # Import the backend fee helper
 from fees import record_fee_from_deal
 
+# Cached @exanic bio checks
+from badges import has_badges
 
-def _new_deal_id() -> str:
-    return "DL-" + "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
 
+def _handle(u: Optional[str]) -> str:
+    return (u or "").strip().lstrip("@").lower()
 
-def _normalize_handle(u: str | None) -> str | None:
-    if not u:
-        return None
-    return u.strip().lstrip("@").lower()
 
-
-# Regex to detect '@exanic' in BIO (case-insensitive, not partial)
-_EXANIC_TOKEN = re.compile(r'(?<![A-Za-z0-9_])@?exanic(?![A-Za-z0-9_])', re.IGNORECASE)
-
-# Zero-width characters that can break pattern matching
-_ZW_CHARS = "".join([
-    "\u200B", "\u200C", "\u200D", "\u2060", "\uFEFF"
-])
-
-
-def _clean_text(s: str | None) -> str:
-    if not s:
-        return ""
-    s = unicodedata.normalize("NFKC", s)
-    return s.translate({ord(c): None for c in _ZW_CHARS})
-
-
-async def _user_has_exanic_in_bio(client, username: str | None) -> bool:
-    """
-    Returns True if the user's BIO contains '@exanic' (case-insensitive).
-    """
-    handle = _normalize_handle(username)
-    if not handle:
-        return False
-    try:
-        entity = await client.get_entity(handle)
-        full = await client(GetFullUserRequest(entity))
-        about = getattr(getattr(full, "full_user", None), "about", "") or ""
-        about = _clean_text(about)
-        return bool(_EXANIC_TOKEN.search(about))
-    except Exception:
-        # Privacy errors, username not found, etc.
-        return False
-
-
-async def compute_fee(client, buyer_username: str, seller_username: str) -> float:
+async def compute_fee(client, buyer_username: str, seller_username: str, *, force_refresh: bool = False) -> float:
     """
     Fee logic:
       - If both buyer and seller have '@exanic' in BIO → fee = $1
       - Otherwise → fee = $2
+    Badge checks are cached (badges.py); uncached parties are looked up concurrently.
     """
-    b = await _user_has_exanic_in_bio(client, buyer_username)
-    s = await _user_has_exanic_in_bio(client, seller_username)
+    badges = await has_badges(client, [buyer_username, seller_username], force_refresh=force_refresh)
+    b = badges.get(_handle(buyer_username), False)
+    s = badges.get(_handle(seller_username), False)
     if b and s:
         return 1.0
     else:
         return 2.0
 
 
+# ---------- Speculative badge prefetch (form_listener → /add) ----------
+# The prefetch only warms the badges cache (subject to BADGE_TTL); /add always
+# recomputes the fee from that cache, so a form /add-ed hours later is not charged
+# a stale fee, and a lookup still in flight is shared with the /add.
+PREFETCH_MAX: int = int(getattr(config, "FEE_PREFETCH_MAX", 256))
+_prefetch_slots = asyncio.Semaphore(int(getattr(config, "FEE_PREFETCH_CONCURRENCY", 2)))
+_prefetch_pending = 0
+
+
+async def _prefetch_fee(client, buyer_username: str, seller_username: str) -> None:
+    global _prefetch_pending
+    try:
+        # rate limit: at most FEE_PREFETCH_CONCURRENCY speculative lookups at a time
+        async with _prefetch_slots:
+            await compute_fee(client, buyer_username, seller_username)
+    except Exception as e:
+        print(f"[deal_logic][prefetch] badge prefetch failed: {e!r}")
+    finally:
+        _prefetch_pending -= 1
+
+
+def prefetch_form_fee(client, buyer_username: str, seller_username: str) -> None:
+    """
+    Start resolving both parties' badges in the background as soon as a form is
+    posted, so /add finds them cached. Fire-and-forget; dropped when PREFETCH_MAX
+    prefetches are already waiting.
+    """
+    global _prefetch_pending
+    if _prefetch_pending >= PREFETCH_MAX:
+        return
+    _prefetch_pending += 1
+    metrics.background(_prefetch_fee(client, buyer_username, seller_username))
+
+
 async def create_deal_from_form(
     client,
     form_message,
@@ -84,17 +82,23 @@ async def create_deal_from_form(
     """
     Creates a new deal record and automatically records the fee in the fees collection.
     """
-    # Compute dynamic fee
-    fee = await compute_fee(client, buyer_username, seller_username)
+    # Compute dynamic fee (badges usually cached by form_listener's prefetch); party
+    # user_ids are stored when the usernames are already linked (late-bound otherwise)
+    fee, uids = await asyncio.gather(
+        compute_fee(client, buyer_username, seller_username),
+        resolve_user_ids(buyer_username, seller_username),
+    )
     total = float(main_amount) + fee
 
     # Create the deal document
     deal = {
-        "deal_id": _new_deal_id(),
+        "deal_id": await next_deal_id(),
         "escrower_id": escrower_id,
         "escrower_name": escrower_name,
         "buyer_username": buyer_username.lower(),
         "seller_username": seller_username.lower(),
+        "buyer_user_id": uids.get(buyer_username.lower()),
+        "seller_user_id": uids.get(seller_username.lower()),
         "amount": float(total),          # displayed total (main + fee)
         "main_amount": float(main_amount),
         "fee": float(fee),
@@ -105,15 +109,21 @@ async def create_deal_from_form(
         "form_message_id": form_message.id,
     }
 
-    # Insert into deals collection
-    await COL_DEALS.insert_one(deal)
-
-    # ✅ Automatically record the fee in the fees collection
-    try:
-        await record_fee_from_deal(deal)
-    except Exception as e:
-        # Log or print the error but don't block deal creation
-        print(f"[WARN] Failed to record fee for deal {deal.get('deal_id')}: {e}")
+    # Insert the deal and record its fee in one transaction (re-run as a whole on
+    # transient conflicts; a DuplicateKeyError aborts both writes and propagates)
+    async def _insert(session):
+        deal.pop("_id", None)
+        await COL_DEALS.insert_one(deal, session=session)
+        if session is not None:
+            await record_fee_from_deal(deal, session=session)
+            return
+        # ✅ No transactions: still record the fee, but don't block deal creation
+        try:
+            await record_fee_from_deal(deal)
+        except Exception as e:
+            print(f"[WARN] Failed to record fee for deal {deal.get('deal_id')}: {e}")
+
+    await run_in_transaction(_insert)
 
     # Ensure buyer/seller users exist
     if buyer_username:
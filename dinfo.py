@@ -1,7 +1,7 @@
-from telethon import events
 from telethon.tl.functions.users import GetFullUserRequest
 from telethon.tl.types import User
-from db import COL_DEALS
+import router
+from db import COL_DEALS, link_user
 from permissions import is_owner, is_escrower, is_admin_or_owner
 
 
@@ -22,6 +22,11 @@ async def _resolve_user(client, arg: str, fallback_sender):
     try:
         entity = await client.get_entity(handle if not handle.isdigit() else int(handle))
         uid = entity.id
+        if getattr(entity, "username", None):
+            try:
+                await link_user(uid, entity.username)
+            except Exception as e:
+                print(f"[dinfo] link_user failed: {e!r}")
         name = f"{getattr(entity,'first_name','') or ''} {getattr(entity,'last_name','') or ''}".strip() \
                or (getattr(entity,'username',None) or str(uid))
         return uid, name
@@ -33,7 +38,7 @@ async def _resolve_user(client, arg: str, fallback_sender):
         return uid, name
 
 def register(client):
-    @client.on(events.NewMessage(pattern=r'^/dinfo(?:\s+(\S+))?'))
+    @router.command(r'^/dinfo(?:\s+(\S+))?')
     async def dinfo_handler(event):
         if not await is_escrower(event.sender_id):
             await event.respond("❌ Only escrowers can use this command.")
@@ -1,19 +1,11 @@
 # eday.py (counts-backed)
-from telethon import events
-from datetime import datetime, timedelta
-from db import COL_ESCROWERS, COL_COUNTS, COL_USERS
-
-async def is_escrower(user_id: int) -> bool:
-    return bool(await COL_ESCROWERS.find_one({"user_id": user_id}))
-
-def ist_bucket_utc() -> datetime:
-    now_utc = datetime.utcnow()
-    now_ist = now_utc + timedelta(hours=5, minutes=30)
-    start_ist = datetime(now_ist.year, now_ist.month, now_ist.day)
-    return start_ist - timedelta(hours=5, minutes=30)
+import router
+from permissions import is_escrower
+from db import COL_COUNTS, COL_USERS
+from utils.timebuckets import day_key
 
 def register(client):
-    @client.on(events.NewMessage(pattern=r"^/eday(?:@[\w_]+)?$"))
+    @router.command(r"^/eday(?:@[\w_]+)?$")
     async def eday_handler(event):
         uid = event.sender_id
         if not await is_escrower(uid):
@@ -24,9 +16,9 @@ def register(client):
         user_doc = await COL_USERS.find_one({"user_id": uid}, {"name": 1})
         esc_name = user_doc.get("name") if user_doc else str(uid)
 
-        day = ist_bucket_utc()
+        day = day_key()
         doc = await COL_COUNTS.find_one(
-            {"scope": "escrower_daily", "escrower_id": uid, "date_utc": day}
+            {"scope": "escrower_daily", "escrower_id": uid, "period": day}
         ) or {}
 
         deals = int(doc.get("deals", 0))
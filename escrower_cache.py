@@ -0,0 +1,133 @@
+# escrower_cache.py
+"""
+In-process escrower roster (user_id -> display_name, limit).
+
+- Loaded once at startup via start().
+- Kept current by a change stream on `escrowers`; a periodic full refresh
+  covers deployments where change streams are unavailable or drop out.
+- /admin and /unadmin call put()/drop() so changes apply immediately.
+"""
+
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from db import COL_ESCROWERS
+
+REFRESH_TTL = 300        # seconds between full refreshes (fallback)
+WATCH_RETRY_DELAY = 30   # seconds before reopening a failed change stream
+
+_roster: Dict[int, dict] = {}      # user_id -> {"user_id", "display_name", "limit"}
+_oid_to_uid: Dict[object, int] = {}  # escrowers._id -> user_id (delete events only carry _id)
+_loaded_at: float = 0.0
+_tasks: List[asyncio.Task] = []
+
+
+def _entry(doc: dict) -> dict:
+    return {
+        "user_id": int(doc["user_id"]),
+        "display_name": doc.get("display_name"),
+        "limit": float(doc.get("limit", 0) or 0),
+    }
+
+
+async def refresh() -> None:
+    """Reload the full roster from Mongo (one round-trip)."""
+    global _roster, _oid_to_uid, _loaded_at
+    roster: Dict[int, dict] = {}
+    oids: Dict[object, int] = {}
+    async for doc in COL_ESCROWERS.find({}, {"user_id": 1, "display_name": 1, "limit": 1}):
+        if doc.get("user_id") is None:
+            continue
+        e = _entry(doc)
+        roster[e["user_id"]] = e
+        oids[doc["_id"]] = e["user_id"]
+    _roster, _oid_to_uid = roster, oids
+    _loaded_at = time.monotonic()
+
+
+async def ensure_loaded() -> None:
+    if not _loaded_at:
+        await refresh()
+
+
+def _apply_change(change: dict) -> None:
+    op = change.get("operationType")
+    oid = (change.get("documentKey") or {}).get("_id")
+    if op == "delete":
+        uid = _oid_to_uid.pop(oid, None)
+        if uid is not None:
+            _roster.pop(uid, None)
+        return
+    if op in ("insert", "update", "replace"):
+        doc = change.get("fullDocument")
+        if not doc or doc.get("user_id") is None:
+            return
+        e = _entry(doc)
+        old_uid = _oid_to_uid.get(oid)
+        if old_uid is not None and old_uid != e["user_id"]:
+            _roster.pop(old_uid, None)
+        _oid_to_uid[oid] = e["user_id"]
+        _roster[e["user_id"]] = e
+    elif op in ("drop", "rename", "dropDatabase", "invalidate"):
+        _roster.clear()
+        _oid_to_uid.clear()
+
+
+async def _watch_loop() -> None:
+    while True:
+        try:
+            async with COL_ESCROWERS.watch(full_document="updateLookup") as stream:
+                # resync once the stream is open so nothing between load and watch is missed
+                await refresh()
+                async for change in stream:
+                    _apply_change(change)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[escrower_cache] change stream unavailable, relying on TTL refresh: {e!r}")
+        await asyncio.sleep(WATCH_RETRY_DELAY)
+
+
+async def _refresh_loop() -> None:
+    while True:
+        await asyncio.sleep(REFRESH_TTL)
+        try:
+            await refresh()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[escrower_cache] refresh failed: {e!r}")
+
+
+async def start() -> None:
+    """Load the roster and start the change-stream watcher + TTL refresher."""
+    await refresh()
+    if not _tasks:
+        _tasks.append(asyncio.create_task(_watch_loop()))
+        _tasks.append(asyncio.create_task(_refresh_loop()))
+
+
+# ---------- local lookups ----------
+def is_escrower(user_id: int) -> bool:
+    return user_id in _roster
+
+
+def get(user_id: int) -> Optional[dict]:
+    return _roster.get(user_id)
+
+
+def all_escrowers() -> List[dict]:
+    return list(_roster.values())
+
+
+# ---------- write-through from /admin and /unadmin ----------
+def put(user_id: int, display_name: Optional[str], limit: float) -> None:
+    _roster[int(user_id)] = {"user_id": int(user_id), "display_name": display_name, "limit": float(limit)}
+
+
+def drop(user_id: int) -> None:
+    _roster.pop(int(user_id), None)
+    for oid, uid in list(_oid_to_uid.items()):
+        if uid == user_id:
+            del _oid_to_uid[oid]
@@ -0,0 +1,34 @@
+# eweek.py (counts-backed, IST week rollup)
+import router
+from permissions import is_escrower
+from db import COL_COUNTS
+from utils.timebuckets import week_key
+import escrower_cache
+
+def register(client):
+    @router.command(r"^/eweek(?:@[\w_]+)?$")
+    async def eweek_handler(event):
+        uid = event.sender_id
+        if not await is_escrower(uid):
+            await event.reply("⛔ You are not authorized to use this command.")
+            return
+
+        esc = escrower_cache.get(uid) or {}
+        esc_name = esc.get("display_name") or str(uid)
+
+        week = week_key()
+        doc = await COL_COUNTS.find_one(
+            {"scope": "escrower_weekly", "escrower_id": uid, "period": week}
+        ) or {}
+
+        deals = int(doc.get("deals", 0))
+        fees  = float(doc.get("fees", 0.0))
+        main  = float(doc.get("volume_main", 0.0))
+
+        await event.reply(
+            f"📅 Escrower Summary (This Week from {week}, IST)\n"
+            f"➥ Escrower: {esc_name}\n"
+            f"➥ Deals Closed: {deals}\n"
+            f"➥ Fees Earned: {fees:.2f}$\n"
+            f"➥ Week Volume: {main:.2f}$"
+        )
@@ -8,12 +8,12 @@ Handlers for fee-related commands (register-style).
   from your deals creation flow (call once when deal is created).
 """
 
-from telethon import events
+import router
 from typing import Optional
 import re
 
 # DB/backend helpers
-from db import create_fee_record, list_fee_records, list_fees_by_admin, update_fee_record, delete_fee_record
+from db import create_fee_record, list_fee_records, update_fee_record, delete_fee_record
 import fees as fees_backend  # backend module implemented above
 
 # Permissions helpers (adjust import path if needed)
@@ -26,7 +26,7 @@ def register(client):
     # ----------------------------
     # /addfee <admin_id> <fee> <name>   (OWNER only) - manual backfill
     # ----------------------------
-    @client.on(events.NewMessage(pattern=r"^/addfee\s+(\d+)\s+([\d.]+)\s+(.+)$"))
+    @router.command(r"^/addfee\s+(\d+)\s+([\d.]+)\s+(.+)$")
     async def addfee_cmd(event):
         if not await is_owner(event.sender_id):
             return await event.respond("❌ Owner-only command.")
@@ -45,7 +45,7 @@ def register(client):
     # ----------------------------
     # /listfees   (OWNER only) -- raw listing
     # ----------------------------
-    @client.on(events.NewMessage(pattern=r"^/listfees$"))
+    @router.command(r"^/listfees$")
     async def listfees_cmd(event):
         if not await is_owner(event.sender_id):
             return await event.respond("❌ Owner-only command.")
@@ -63,7 +63,7 @@ def register(client):
     # ----------------------------
     # /myfees   (Escrower can view their own fees)
     # ----------------------------
-    @client.on(events.NewMessage(pattern=r"^/myfees$"))
+    @router.command(r"^/myfees$")
     async def myfees_cmd(event):
         # Only escrowers can use this
         if not await is_escrower(event.sender_id):
@@ -73,20 +73,14 @@ def register(client):
         sender = await event.get_sender()
         sender_name = sender.first_name or sender.username or str(uid)
 
-        # Fetch all fees for this escrower
-        rows = await list_fees_by_admin(uid)
-        if not rows:
+        # O(1): read this escrower's running total from fee_totals
+        summary = await fees_backend.admin_summary(uid)
+        if not summary["deals"]:
             return await event.respond(f"💼 {sender_name}, you have no recorded fees yet.")
 
-        total_fee = sum(float(d.get("fee", 0)) for d in rows)
+        total_fee = float(summary["total"])
         lines = [f"💼 **Fees for {sender_name}**\n **Total** → ${total_fee:.2f}"]
 
-        # List all individual records
-        for d in rows:
-            deal_label = d.get("name", "Unnamed Deal")
-            fee_value = float(d.get("fee", 0))
-            lines.append(f" ")
-
         await event.respond("\n".join(lines))
 
 
@@ -94,7 +88,7 @@ def register(client):
     # ----------------------------
     # /editfee <fee_id> <new_fee> [new_name]   (OWNER only)
     # ----------------------------
-    @client.on(events.NewMessage(pattern=r"^/editfee\s+([a-fA-F0-9]+)\s+([\d.]+)(?:\s+(.+))?$"))
+    @router.command(r"^/editfee\s+([a-fA-F0-9]+)\s+([\d.]+)(?:\s+(.+))?$")
     async def editfee_cmd(event):
         if not await is_owner(event.sender_id):
             return await event.respond("❌ Owner-only command.")
@@ -116,7 +110,7 @@ def register(client):
     # ----------------------------
     # /delfee <fee_id>   (OWNER only)
     # ----------------------------
-    @client.on(events.NewMessage(pattern=r"^/delfee\s+([a-fA-F0-9]+)$"))
+    @router.command(r"^/delfee\s+([a-fA-F0-9]+)$")
     async def delfee_cmd(event):
         if not await is_owner(event.sender_id):
             return await event.respond("❌ Owner-only command.")
@@ -130,7 +124,7 @@ def register(client):
     # ----------------------------
     # /fees   (OWNER only) — grouped totals per admin
     # ----------------------------
-    @client.on(events.NewMessage(pattern=r"^/fees$"))
+    @router.command(r"^/fees$")
     async def fees_cmd(event):
         if not await is_owner(event.sender_id):
             return await event.respond("❌ Owner-only command.")
@@ -150,9 +144,21 @@ def register(client):
     # ----------------------------
     # /feestats  (OWNER only) — grand totals
     # ----------------------------
-    @client.on(events.NewMessage(pattern=r"^/feestats$"))
+    @router.command(r"^/feestats$")
     async def feestats_cmd(event):
         if not await is_owner(event.sender_id):
             return await event.respond("❌ Owner-only command.")
         gt = await fees_backend.grand_totals()
         await event.respond(f"📊 {gt['count']} fee records • Sum: ${gt['sum']:.2f}")
+
+
+    # ----------------------------
+    # /rebuildfees  (OWNER only) — recompute fee_totals from all fee records
+    # ----------------------------
+    @router.command(r"^/rebuildfees$")
+    async def rebuildfees_cmd(event):
+        if not await is_owner(event.sender_id):
+            return await event.respond("❌ Owner-only command.")
+        admins = await fees_backend.rebuild_totals()
+        gt = await fees_backend.grand_totals()
+        await event.respond(f"♻️ Fee totals rebuilt: {admins} admins • {gt['count']} records • Sum: ${gt['sum']:.2f}")
@@ -2,67 +2,43 @@
 """
 Backend helpers for the 'fees' collection.
 
-- Provides aggregation utilities (totals_by_admin, admin_summary, grand_totals).
+- Provides summary reads (totals_by_admin, admin_summary, grand_totals) backed by the
+  fee_totals collection, plus rebuild_totals() to recompute it.
 - Provides record_fee_from_deal(deal) to create a fee record exactly once when a deal is CREATED.
 - Exposes small wrappers for editing/removing fees (used by owner-only commands).
 - All outputs include a 'legacy' field with value 0 to remain compatible with older schemas.
 """
 
 from typing import List, Dict, Any, Optional
-from datetime import datetime
-from bson import ObjectId
+
+from pymongo.errors import DuplicateKeyError
 
 # Import DB helpers / collection. Adjust names if your db.py exports different symbols.
-from db import COL_FEES, create_fee_record, list_fee_records, list_fees_by_admin, update_fee_record, delete_fee_record, db
+from db import COL_FEE_TOTALS, create_fee_record, list_fee_records, update_fee_record, delete_fee_record, rebuild_fee_totals
 
-# ---------- Aggregation / summary helpers ----------
+# ---------- Summary helpers (read the fee_totals collection) ----------
 async def totals_by_admin(limit: int = 0) -> List[Dict[str, Any]]:
     """
-    Corrected aggregation: group by admin_id, use $first at top level to pick admin_name.
+    Per-admin totals, highest first. Reads the fee_totals summary docs maintained by
+    the db fee helpers (one doc per admin), not the fees collection.
     """
-    pipeline = [
-        {
-            "$group": {
-                "_id": "$admin_id",
-                "admin_name": {"$first": "$admin_name"},
-                "total": {"$sum": {"$ifNull": ["$fee", 0]}},
-                "deals": {"$sum": 1},
-            }
-        },
-        {"$sort": {"total": -1}},
-    ]
+    cursor = COL_FEE_TOTALS.find({"scope": "admin", "deals": {"$gt": 0}}).sort("total", -1)
     if limit and isinstance(limit, int) and limit > 0:
-        pipeline.append({"$limit": int(limit)})
+        cursor = cursor.limit(int(limit))
 
     out = []
-    async for doc in COL_FEES.aggregate(pipeline):
-        admin_id = doc.get("_id")
-        admin_name = doc.get("admin_name")
+    async for doc in cursor:
         out.append({
-            "admin_id": int(admin_id) if admin_id is not None else None,
-            "admin_name": admin_name,
+            "admin_id": int(doc["admin_id"]),
+            "admin_name": doc.get("admin_name"),
             "total": float(doc.get("total", 0.0)),
             "deals": int(doc.get("deals", 0)),
             "legacy": 0,
         })
     return out
+
 async def admin_summary(admin_id: int) -> Dict[str, Any]:
-    pipeline = [
-        {"$match": {"admin_id": int(admin_id)}},
-        {
-            "$group": {
-                "_id": "$admin_id",
-                "admin_name": {"$first": "$admin_name"},
-                "total": {"$sum": {"$ifNull": ["$fee", 0]}},
-                "deals": {"$sum": 1},
-            }
-        },
-    ]
-    cursor = COL_FEES.aggregate(pipeline)
-    doc = None
-    async for d in cursor:
-        doc = d
-        break
+    doc = await COL_FEE_TOTALS.find_one({"scope": "admin", "admin_id": int(admin_id)})
     if not doc:
         return {"admin_id": int(admin_id), "admin_name": None, "total": 0.0, "deals": 0, "legacy": 0}
     return {
@@ -74,32 +50,29 @@ async def admin_summary(admin_id: int) -> Dict[str, Any]:
     }
 
 
-
 async def grand_totals() -> Dict[str, Any]:
     """
-    Return overall totals across the fees collection.
+    Return overall totals across the fees collection (from the fee_totals grand doc).
     Shape: { count: int, sum: float, legacy_sum: 0 }
     """
-    pipeline = [
-        {"$group": {"_id": None, "count": {"$sum": 1}, "sum": {"$sum": {"$ifNull": ["$fee", 0]}}}}
-    ]
-    cursor = COL_FEES.aggregate(pipeline)
-    doc = None
-    async for d in cursor:
-        doc = d
-        break
+    doc = await COL_FEE_TOTALS.find_one({"scope": "grand"})
     if not doc:
         return {"count": 0, "sum": 0.0, "legacy_sum": 0}
     return {"count": int(doc.get("count", 0)), "sum": float(doc.get("sum", 0.0)), "legacy_sum": 0}
 
 
+async def rebuild_totals() -> int:
+    """Recompute fee_totals from every fee record. Returns the number of admins."""
+    return await rebuild_fee_totals()
+
+
 # ---------- Auto-record helper (call this when a deal is CREATED) ----------
 
-async def record_fee_from_deal(deal: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+async def record_fee_from_deal(deal: Dict[str, Any], session=None) -> Optional[Dict[str, Any]]:
     """
     Create a fee record derived from a deal object. This must be called exactly once when a deal is CREATED.
     Safety:
-      - If the deal has a 'deal_id' and a fee record for that 'deal_id' already exists, this will NOT create another.
+      - fees.deal_id is unique: if the deal already has a fee record, this will NOT create another.
       - If there is no escrower_id, nothing is recorded.
     Expected deal fields (commonly available):
       - deal_id (unique identifier used to avoid duplicates)
@@ -107,6 +80,8 @@ async def record_fee_from_deal(deal: Dict[str, Any]) -> Optional[Dict[str, Any]]
       - fee (numeric)
       - title / name (optional)
       - created_at (optional)
+    Pass `session` to write inside the caller's transaction (e.g. together with the deal insert);
+    a DuplicateKeyError is then re-raised, since the transaction can no longer commit.
     Returns the created doc (with _id string) or None if skipped.
     """
     if not isinstance(deal, dict):
@@ -117,11 +92,6 @@ async def record_fee_from_deal(deal: Dict[str, Any]) -> Optional[Dict[str, Any]]
         return None
 
     deal_id = deal.get("deal_id")
-    # Safety: don't duplicate by deal_id
-    if deal_id is not None:
-        existing = await COL_FEES.find_one({"deal_id": deal_id})
-        if existing:
-            return None
 
     # Normalize fee
     try:
@@ -135,29 +105,23 @@ async def record_fee_from_deal(deal: Dict[str, Any]) -> Optional[Dict[str, Any]]
     # record name/label for this fee record
     name = deal.get("title") or deal.get("name") or f"deal-{deal_id}" if deal_id is not None else (deal.get("title") or "deal")
 
-    doc = {
-        "admin_id": int(escrower_id),
-        "admin_name": admin_name,
-        "fee": fee_val,
-        "name": str(name),
-        "deal_id": deal_id,
-        "created_at": deal.get("created_at") or datetime.utcnow(),
-    }
-
-    # Use db helper if available, otherwise insert directly
+    # one upsert keyed by deal_id: fee record + fee_totals update commit together
     try:
-        created = await create_fee_record(int(escrower_id), fee_val, str(name))
-        # create_fee_record may not set deal_id/admin_name; update those if needed
-        if deal_id is not None:
-            await COL_FEES.update_one({"_id": ObjectId(created["_id"])}, {"$set": {"deal_id": deal_id}})
-        if admin_name:
-            await COL_FEES.update_one({"_id": ObjectId(created["_id"])}, {"$set": {"admin_name": admin_name}})
-        return created
-    except Exception:
-        # fallback: insert directly
-        res = await COL_FEES.insert_one(doc)
-        doc["_id"] = str(res.inserted_id)
-        return doc
+        return await create_fee_record(
+            int(escrower_id),
+            fee_val,
+            str(name),
+            admin_name=admin_name,
+            deal_id=deal_id,
+            created_at=deal.get("created_at"),
+            session=session,
+        )
+    except DuplicateKeyError:
+        if session is not None:
+            # the server already aborted the caller's transaction: let the caller see it
+            raise
+        # a concurrent call recorded this deal first
+        return None
 
 
 # ---------- Simple pass-throughs used by owner commands ----------
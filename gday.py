@@ -1,26 +1,18 @@
 # gday.py (counts-backed)
-from telethon import events
-from datetime import datetime, timedelta
-from db import COL_ESCROWERS, COL_COUNTS
-
-async def is_escrower(user_id: int) -> bool:
-    return bool(await COL_ESCROWERS.find_one({"user_id": user_id}))
-
-def ist_bucket_utc() -> datetime:
-    now_utc = datetime.utcnow()
-    now_ist = now_utc + timedelta(hours=5, minutes=30)
-    start_ist = datetime(now_ist.year, now_ist.month, now_ist.day)
-    return start_ist - timedelta(hours=5, minutes=30)
+import router
+from permissions import is_escrower
+from db import COL_COUNTS
+from utils.timebuckets import day_key
 
 def register(client):
-    @client.on(events.NewMessage(pattern=r"^/gday(?:@[\w_]+)?$"))
+    @router.command(r"^/gday(?:@[\w_]+)?$")
     async def gday_handler(event):
         if not await is_escrower(event.sender_id):
             await event.reply("⛔ You are not authorized to use this command.")
             return
 
-        day = ist_bucket_utc()
-        cursor = COL_COUNTS.find({"scope": "group_daily", "date_utc": day})
+        day = day_key()
+        cursor = COL_COUNTS.find({"scope": "group_daily", "period": day})
         rows = [doc async for doc in cursor]
 
         if not rows:
@@ -0,0 +1,30 @@
+# gmonth.py (counts-backed, IST month rollup)
+import router
+from permissions import is_escrower
+from db import COL_COUNTS
+from utils.timebuckets import month_key
+
+def register(client):
+    @router.command(r"^/gmonth(?:@[\w_]+)?$")
+    async def gmonth_handler(event):
+        if not await is_escrower(event.sender_id):
+            await event.reply("⛔ You are not authorized to use this command.")
+            return
+
+        month = month_key()
+        doc = await COL_COUNTS.find_one({"scope": "monthly", "period": month}) or {}
+
+        deals = int(doc.get("deals", 0))
+        fees  = float(doc.get("fees", 0.0))
+        main  = float(doc.get("volume_main", 0.0))
+
+        if not deals:
+            await event.reply(f"📊 Global Summary (This Month from {month}, IST)\n➥ No closed deals this month.")
+            return
+
+        await event.reply(
+            f"📊 Global Summary (This Month from {month}, IST)\n"
+            f"➥ Deals Closed: {deals}\n"
+            f"➥ Fees Earned: {fees:.2f}$\n"
+            f"➥ Month Volume: {main:.2f}$"
+        )
@@ -1,10 +1,10 @@
 # info_cmd.py
-from telethon import events
-from db import COL_USERS
+import router
+from db import COL_USERS, link_user
 from info import build_info_card  # id-based version
 
 def register(client):
-    @client.on(events.NewMessage(pattern=r"^/info(?:@[\w_]+)?(?:\s+(\S+))?$"))
+    @router.command(r"^/info(?:@[\w_]+)?(?:\s+(\S+))?$")
     async def info_handler(event):
         """
         Usage:
@@ -27,6 +27,12 @@ def register(client):
         elif event.is_reply:  # replied to someone's msg
             reply_msg = await event.get_reply_message()
             user_id = reply_msg.sender_id
+            reply_uname = getattr(reply_msg.sender, "username", None)
+            if user_id and reply_uname:
+                try:
+                    await link_user(user_id, reply_uname)
+                except Exception as e:
+                    print("[/info link_user error]", e)
         else:  # fallback: use sender
             user_id = event.sender_id
 
@@ -34,6 +40,14 @@ def register(client):
             await event.reply("❌ Could not resolve user.")
             return
 
+        # Late-bind: the sender's own username -> user_id (attributes their past deals)
+        sender_uname = getattr(event.sender, "username", None)
+        if sender_uname:
+            try:
+                await link_user(event.sender_id, sender_uname)
+            except Exception as e:
+                print("[/info link_user error]", e)
+
         db = COL_USERS.database
         try:
             card = await build_info_card(db, user_id=user_id)
@@ -0,0 +1,217 @@
+# kickall.py
+"""
+/kickall — remove every non-admin member from an escrow group.
+
+- The admin set comes from admin_roster (refreshed once at the start of a run)
+  instead of one GetParticipantRequest per member.
+- Kicks run on KICKALL_CONCURRENCY workers through moderation.kick_member (shared
+  "kick" token bucket + slots, backs off on FloodWait).
+- The status message is edited with progress every PROGRESS_INTERVAL seconds.
+- Each run is a `kickall_jobs` doc; runs still marked "running" are resumed by
+  resume_jobs() after a restart (already-kicked members are simply gone from the
+  participant list, so the run continues where it stopped).
+"""
+
+import asyncio
+from datetime import datetime, timezone
+UTC = timezone.utc
+from typing import Set
+
+from pymongo.errors import DuplicateKeyError
+from telethon import events, Button
+
+from config import ESCROW_GROUP_IDS  # import your escrow group list/dict
+from db import COL_KICKALL_JOBS
+from moderation import KICK_CONCURRENCY, kick_member
+import admin_roster
+import metrics
+import router
+
+PROGRESS_INTERVAL = 5  # seconds between status edits
+
+_running: Set[int] = set()  # chat ids with a run in this process
+
+
+async def _edit_status(client, job: dict, text: str) -> None:
+    try:
+        await client.edit_message(job["status_chat_id"], job["status_msg_id"], text)
+    except Exception:
+        pass
+
+
+def _start(client, job: dict) -> bool:
+    """Claim the chat (synchronously, before any await) and run the job in the background."""
+    chat_id = int(job["chat_id"])
+    if chat_id in _running:
+        return False
+    _running.add(chat_id)
+    metrics.background(_run_job(client, job))
+    return True
+
+
+async def _run_job(client, job: dict) -> None:
+    """Run a claimed job (see _start); releases the chat when it ends."""
+    chat_id = int(job["chat_id"])
+    kicked, failed = int(job.get("kicked", 0)), int(job.get("failed", 0))
+    try:
+        me = await client.get_me()
+        # fresh roster for the run (also updates the shared cache)
+        skip = set(await admin_roster.refresh(client, chat_id))
+        skip.update({me.id, int(job["initiator_id"])})
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=KICK_CONCURRENCY * 4)
+
+        async def worker():
+            nonlocal kicked, failed
+            while True:
+                uid = await queue.get()
+                if uid is None:
+                    return
+                try:
+                    await kick_member(client, chat_id, uid, ban_fallback=True)
+                    kicked += 1
+                except Exception:
+                    failed += 1
+
+        async def progress():
+            while True:
+                await asyncio.sleep(PROGRESS_INTERVAL)
+                await COL_KICKALL_JOBS.update_one(
+                    {"_id": job["_id"]},
+                    {"$set": {"kicked": kicked, "failed": failed, "updated_at": datetime.now(UTC)}},
+                )
+                await _edit_status(client, job, f"🚨 Kicking all non-admin members...\n"
+                                                f"➥ Kicked: **{kicked}** • Failed: **{failed}**")
+
+        workers = [asyncio.create_task(worker()) for _ in range(KICK_CONCURRENCY)]
+        reporter = asyncio.create_task(progress())
+        try:
+            async for member in client.iter_participants(chat_id):
+                if member.id not in skip:
+                    await queue.put(member.id)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            for w in workers:
+                w.cancel()
+
+        await COL_KICKALL_JOBS.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": "done", "kicked": kicked, "failed": failed, "updated_at": datetime.now(UTC)}},
+        )
+        await _edit_status(client, job, f"✅ Done. Kicked **{kicked}** members. Failed: **{failed}**.")
+    except Exception as e:
+        # keep status "running" so the next start resumes it
+        print(f"[kickall] job in {chat_id} interrupted: {e!r}")
+        await COL_KICKALL_JOBS.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"kicked": kicked, "failed": failed, "updated_at": datetime.now(UTC)}},
+        )
+    finally:
+        _running.discard(chat_id)
+
+
+async def resume_jobs(client) -> int:
+    """Restart every run left "running" by a previous process. Returns how many."""
+    n = 0
+    async for job in COL_KICKALL_JOBS.find({"status": "running"}):
+        if _start(client, job):
+            await _edit_status(client, job, "🔁 Bot restarted — resuming kick-all...")
+            n += 1
+    return n
+
+
+def register(client):
+    @router.command(r"^/kickall$", incoming=True)
+    async def kickall_request(event):
+        chat_id = str(event.chat_id)
+
+        # ✅ Allow only escrow groups
+        if chat_id not in ESCROW_GROUP_IDS:
+            await event.reply("⚠️ This command is only available in escrow groups.")
+            return
+
+        # ✅ Check if user is admin (cached roster)
+        try:
+            if not await admin_roster.is_admin(client, event.chat_id, event.sender_id):
+                await event.reply("🚫 Only admins can use /kickall.")
+                return
+        except Exception as e:
+            await event.reply(f"Cannot verify admin: {e}")
+            return
+
+        # ✅ Confirmation buttons
+        keyboard = [
+            [Button.inline("✅ Confirm Kick All", data=f"kickall_confirm:{event.sender_id}:{chat_id}"),
+             Button.inline("❌ Cancel", data=f"kickall_cancel:{event.sender_id}:{chat_id}")]
+        ]
+        await event.reply("⚠️ **Are you sure you want to kick all non-admins in this escrow group?**", buttons=keyboard)
+
+    @client.on(events.CallbackQuery(pattern=b"kickall_"))
+    async def kickall_callback(event):
+        try:
+            data = event.data.decode().split(":")
+            action = data[0]
+            sender_id = int(data[1])
+            chat_id = data[2]
+        except Exception:
+            await event.answer("Malformed data.", alert=True)
+            return
+
+        # ✅ Allow only the initiator
+        if event.sender_id != sender_id:
+            await event.answer("Not your confirmation button!", alert=True)
+            return
+
+        # ✅ Ensure chat is escrow group
+        if chat_id not in ESCROW_GROUP_IDS:
+            await event.answer("This command is not allowed here.", alert=True)
+            return
+
+        # ✅ Initiator must still be an admin
+        try:
+            if not await admin_roster.is_admin(client, int(chat_id), sender_id):
+                await event.answer("🚫 Only admins can use /kickall.", alert=True)
+                return
+        except Exception as e:
+            await event.answer(f"Cannot verify admin: {e}", alert=True)
+            return
+
+        if action == "kickall_cancel":
+            await event.edit("❌ Kick-all cancelled.")
+            return
+
+        if action == "kickall_confirm":
+            # claim the chat before any await (a double tap sees it); the unique
+            # "running" index on kickall_jobs covers another process
+            chat = int(chat_id)
+            if chat in _running:
+                await event.answer("A kick-all is already running here.", alert=True)
+                return
+            _running.add(chat)
+            now = datetime.now(UTC)
+            job = {
+                "chat_id": chat,
+                "initiator_id": sender_id,
+                "status": "running",
+                "kicked": 0,
+                "failed": 0,
+                "status_chat_id": event.chat_id,
+                "status_msg_id": event.message_id,
+                "started_at": now,
+                "updated_at": now,
+            }
+            try:
+                res = await COL_KICKALL_JOBS.insert_one(job)
+            except DuplicateKeyError:
+                _running.discard(chat)
+                await event.answer("A kick-all is already running here.", alert=True)
+                return
+            except BaseException:
+                _running.discard(chat)
+                raise
+            job["_id"] = res.inserted_id
+            metrics.background(_run_job(client, job))  # already claimed above
+            await event.edit("🚨 Kicking all non-admin members... please wait.")
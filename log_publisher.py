@@ -0,0 +1,229 @@
+# log_publisher.py
+"""
+Background publisher for LOG_CHANNEL_ID messages (deal-close logs).
+
+- publish(html) persists the entry in `log_queue` and hands it to a bounded
+  in-memory queue; the caller never waits for Telegram.
+- One worker sends entries in order. The channel peer is resolved once and cached;
+  FloodWaitError sleeps for the requested time, other errors back off exponentially.
+- When LOG_DIGEST_THRESHOLD or more entries are waiting, they are merged into digest
+  messages (each within Telegram's length limit) instead of one message per entry.
+- An entry is removed from `log_queue` only after it was sent, and the collection
+  is replayed on start(), so a restart loses nothing.
+- Network / server-side errors are retried indefinitely; any other error (BadRequest
+  such as MessageTooLong or an entity parse error, Forbidden, ...) is retried
+  LOG_MAX_ATTEMPTS times, then that entry is parked in `log_queue` (parked, error,
+  attempts) so the entries behind it keep moving. A failing digest is retried entry
+  by entry so only the bad entry is parked.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+UTC = timezone.utc
+from typing import Any, List, Optional, Set, Tuple, Union
+
+from telethon.errors import FloodWaitError, ServerError, TimedOutError
+
+import config
+from config import LOG_CHANNEL_ID
+from db import COL_LOG_QUEUE
+
+QUEUE_MAX: int = int(getattr(config, "LOG_QUEUE_MAX", 1000))
+DIGEST_THRESHOLD: int = int(getattr(config, "LOG_DIGEST_THRESHOLD", 5))
+MESSAGE_LIMIT = 4096
+DIGEST_SEPARATOR = "\n\n➖➖➖➖➖\n\n"
+BACKOFF_MAX = 300  # seconds
+MAX_ATTEMPTS: int = int(getattr(config, "LOG_MAX_ATTEMPTS", 3))
+TRANSIENT_ERRORS = (ConnectionError, OSError, asyncio.TimeoutError, ServerError, TimedOutError)
+
+Entry = Tuple[Any, str]  # (log_queue _id or None, html)
+
+_client = None
+_peer: Any = None
+_queue: Optional["asyncio.Queue[Entry]"] = None
+_queued: Set[Any] = set()  # log_queue ids held in memory (queued or being sent)
+_spilled = False           # entries persisted but not queued (queue full / not loaded yet)
+_task: Optional[asyncio.Task] = None
+
+
+async def _resolve_log_peer(client, target: Union[int, str]) -> Any:
+    if isinstance(target, int):
+        return await client.get_entity(target)
+    t = str(target).strip()
+    if t.startswith("-100") and t.lstrip("-").isdigit():
+        return await client.get_entity(int(t))
+    if not t.startswith("@"):
+        t = "@" + t
+    return await client.get_entity(t)
+
+
+def _enqueue(entry: Entry) -> bool:
+    global _spilled
+    if entry[0] is not None and entry[0] in _queued:
+        return True  # already picked up by _reload()
+    try:
+        _queue.put_nowait(entry)
+    except asyncio.QueueFull:
+        _spilled = True
+        return False
+    if entry[0] is not None:
+        _queued.add(entry[0])
+    return True
+
+
+async def publish(html: str) -> None:
+    """Persist one log message and queue it for the worker (returns without sending)."""
+    doc = {"html": html, "created_at": datetime.now(UTC)}
+    try:
+        await COL_LOG_QUEUE.insert_one(doc)
+    except Exception as e:
+        print(f"[log_publisher] could not persist log entry (sending from memory only): {e!r}")
+        doc["_id"] = None
+    if _queue is not None:
+        _enqueue((doc["_id"], html))
+
+
+async def _reload() -> None:
+    """Queue persisted entries that are not in memory yet, oldest first."""
+    global _spilled
+    _spilled = False
+    room = QUEUE_MAX - _queue.qsize()
+    if room <= 0:
+        _spilled = True
+        return
+    cursor = COL_LOG_QUEUE.find({"_id": {"$nin": list(_queued)}, "parked": {"$ne": True}}).sort("created_at", 1).limit(room)
+    n = 0
+    async for d in cursor:
+        _enqueue((d["_id"], d.get("html") or ""))
+        n += 1
+    if n == room:
+        _spilled = True  # there may be more behind these
+
+
+def _pack(batch: List[Entry]) -> List[List[Entry]]:
+    """Group entries into digests that each fit in one Telegram message."""
+    groups: List[List[Entry]] = []
+    size = 0
+    for entry in batch:
+        extra = len(entry[1]) + len(DIGEST_SEPARATOR)
+        if not groups or size + extra > MESSAGE_LIMIT - 64:
+            groups.append([entry])
+            size = len(entry[1])
+        else:
+            groups[-1].append(entry)
+            size += extra
+    return groups
+
+
+def _render(group: List[Entry]) -> str:
+    if len(group) == 1:
+        return group[0][1]
+    return f"<b>🧾 Log digest ({len(group)} entries)</b>\n\n" + DIGEST_SEPARATOR.join(h for _, h in group)
+
+
+async def _send(text: str) -> Optional[Exception]:
+    """
+    Send it: None once it went through, or the error after MAX_ATTEMPTS non-transient
+    failures. FloodWait → wait as told; network/server errors → backoff, no limit.
+    """
+    global _peer
+    delay = 1.0
+    attempts = 0
+    while True:
+        try:
+            if _peer is None:
+                _peer = await _resolve_log_peer(_client, LOG_CHANNEL_ID)
+            await _client.send_message(_peer, text, parse_mode="html", link_preview=False)
+            return None
+        except FloodWaitError as e:
+            print(f"[log_publisher] FloodWait {e.seconds}s")
+            await asyncio.sleep(e.seconds + 1)
+            continue
+        except TRANSIENT_ERRORS as e:
+            print(f"[log_publisher] send failed (transient), retrying in {delay:.0f}s: {e!r}")
+        except Exception as e:
+            attempts += 1
+            if attempts >= MAX_ATTEMPTS:
+                return e
+            print(
+                f"[log_publisher] send failed ({attempts}/{MAX_ATTEMPTS}), retrying in {delay:.0f}s: {e!r}\n"
+                f"Please verify LOG_CHANNEL_ID (use -100… or @username) and that the bot is a member."
+            )
+            _peer = None
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, BACKOFF_MAX)
+
+
+async def _park(entry: Entry, error: Exception) -> None:
+    """Take an entry that keeps failing out of the way (kept in log_queue for inspection)."""
+    print(f"[log_publisher] giving up on a log entry after {MAX_ATTEMPTS} attempts: {error!r}")
+    if entry[0] is None:
+        return  # memory-only entry: dropped
+    try:
+        await COL_LOG_QUEUE.update_one(
+            {"_id": entry[0]},
+            {"$set": {"parked": True, "error": repr(error), "parked_at": datetime.now(UTC)},
+             "$inc": {"attempts": MAX_ATTEMPTS}},
+        )
+    except Exception as e:
+        print(f"[log_publisher] could not park entry {entry[0]}: {e!r}")
+
+
+async def _dequeue(group: List[Entry]) -> None:
+    ids = [i for i, _ in group if i is not None]
+    if ids:
+        try:
+            await COL_LOG_QUEUE.delete_many({"_id": {"$in": ids}})
+        except Exception as e:
+            print(f"[log_publisher] sent, but could not dequeue {len(ids)} entries: {e!r}")
+        _queued.difference_update(ids)
+
+
+async def _worker() -> None:
+    while True:
+        if _spilled and _queue.empty():
+            try:
+                await _reload()
+            except Exception as e:
+                print(f"[log_publisher] reload failed: {e!r}")
+                await asyncio.sleep(5)
+                continue
+        batch = [await _queue.get()]
+        while not _queue.empty():
+            batch.append(_queue.get_nowait())
+
+        groups = [[e] for e in batch] if len(batch) < DIGEST_THRESHOLD else _pack(batch)
+        for group in groups:
+            error = await _send(_render(group))
+            if error is None:
+                await _dequeue(group)
+                continue
+            # a digest failed: retry its entries one by one so only the bad one is parked
+            singles = [group] if len(group) == 1 else [[e] for e in group]
+            for single in singles:
+                if single is not group:
+                    error = await _send(_render(single))
+                if error is None:
+                    await _dequeue(single)
+                else:
+                    await _park(single[0], error)
+                    _queued.discard(single[0][0])
+
+
+async def start(client) -> None:
+    """Start the worker (call after client.start); persisted entries are replayed first."""
+    global _client, _queue, _spilled, _task
+    if _task is not None:
+        return
+    _client = client
+    _queue = asyncio.Queue(maxsize=QUEUE_MAX)
+    _spilled = True
+    _task = asyncio.create_task(_worker())
+
+
+async def stop() -> None:
+    """Stop the worker; anything unsent stays in log_queue for the next start."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
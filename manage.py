@@ -1,6 +1,16 @@
 # manage.py
+from datetime import datetime, timezone
+UTC = timezone.utc
+
 from telethon import events, Button
-from telethon.tl.functions.channels import GetParticipantRequest
+
+import config
+import admin_roster
+import membership
+import metrics
+import router
+from permissions import is_owner
+from utils.edit_cache import EditCache, text_hash
 
 # === CONFIGURATION ===
 MAIN_GROUP_ID = -1002888180583  # main group
@@ -10,21 +20,23 @@ ESCROW_GROUP_IDS = {
     "-4885554031": True
 }
 FORCE_SUB_CHANNEL = "@exanic"  # channel for force-subscribe
+EDIT_CACHE_CAPACITY = int(getattr(config, "EDIT_CACHE_CAPACITY", 50_000))   # messages remembered
+EDIT_CACHE_MAX_AGE = float(getattr(config, "EDIT_CACHE_MAX_AGE", 48 * 3600))  # seconds
+EDIT_FALLBACK_WINDOW = 60  # cache miss: an edit_date this recent means a real text edit
 
 def register(client):
 
     # ========== 1️⃣ AUTO DELETE EDITED MESSAGES ==========
     from telethon import events
-    from telethon.tl.functions.channels import GetParticipantRequest
 
-    # cache to remember original message text
-    _original_texts = {}
+    # bounded cache of message-text hashes to detect real edits
+    _original_texts = EditCache(EDIT_CACHE_CAPACITY, EDIT_CACHE_MAX_AGE)
 
-    @client.on(events.NewMessage(chats=[MAIN_GROUP_ID]))
+    @router.listener(chats=[MAIN_GROUP_ID])
     async def cache_original_message(event):
-        """Cache every new message's text so we can detect real edits later."""
+        """Cache every new message's text hash so we can detect real edits later."""
         if event.text:
-            _original_texts[event.id] = event.text
+            _original_texts.put(event.id, event.text)
 
     @client.on(events.MessageEdited(chats=[MAIN_GROUP_ID]))
     async def auto_delete_edits(event):
@@ -35,20 +47,29 @@ def register(client):
                 return
 
             # 🧠 Detect real edit vs reaction
-            old_text = _original_texts.get(event.id)
+            old_hash = _original_texts.get(event.id)
             new_text = event.text or ""
 
-            # If text didn’t actually change → it’s a reaction or emoji update → ignore
-            if old_text == new_text:
-                return
-
-            # update cached text so next edit compares correctly
-            _original_texts[event.id] = new_text
-
-            # ✅ check if user is admin
+            if old_hash is not None:
+                # If text didn’t actually change → it’s a reaction or emoji update → ignore
+                if old_hash == text_hash(new_text):
+                    return
+            else:
+                # not cached (old/evicted): only a freshly stamped edit_date is a real edit
+                edit_date = getattr(event.message, "edit_date", None)
+                if edit_date is None:
+                    return
+                if edit_date.tzinfo is None:
+                    edit_date = edit_date.replace(tzinfo=UTC)
+                if (datetime.now(UTC) - edit_date).total_seconds() > EDIT_FALLBACK_WINDOW:
+                    return
+
+            # update cached hash so next edit compares correctly
+            _original_texts.put(event.id, new_text)
+
+            # ✅ check if user is admin (cached roster)
             try:
-                participant = await client(GetParticipantRequest(event.chat_id, sender.id))
-                is_admin = getattr(participant.participant, "admin_rights", None)
+                is_admin = await admin_roster.is_admin(client, event.chat_id, sender.id)
             except Exception:
                 is_admin = True  # fail-safe: assume admin if we can’t fetch info
 
@@ -60,8 +81,23 @@ def register(client):
             print(f"[manage.py][auto_delete_edits] Error: {e}")
 
 
+    @router.command(r"^/editcache(?:@[\w_]+)?$")
+    async def edit_cache_stats(event):
+        """Owner: edit-detection cache metrics (for sizing capacity / max age)."""
+        if not await is_owner(event.sender_id):
+            return
+        st = _original_texts.stats()
+        await event.reply(
+            "🧠 **Edit cache**\n"
+            f"➥ Entries: {st['size']} / {st['capacity']} (max age {st['max_age'] / 3600:.0f}h)\n"
+            f"➥ Hit rate: {st['hit_rate'] * 100:.1f}% ({st['hits']} hits, {st['misses']} misses)\n"
+            f"➥ Expired: {st['expired']} • Evicted: {st['evictions']}\n"
+            f"➥ Memory: {st['bytes'] / 1024:.0f} KiB"
+        )
+
+
     # ========== 2️⃣ FORCE SUBSCRIBE SYSTEM ==========
-    @client.on(events.NewMessage(chats=[MAIN_GROUP_ID]))
+    @router.listener(chats=[MAIN_GROUP_ID])
     async def force_subscribe_handler(event):
         """Restrict new users until they join the specified channel."""
         try:
@@ -69,10 +105,9 @@ def register(client):
             if not user or user.bot:
                 return
 
-            # Skip admins (owner/devs)
+            # Skip admins (owner/devs) — cached roster
             try:
-                participant = await client(GetParticipantRequest(event.chat_id, user.id))
-                is_admin = getattr(participant.participant, "admin_rights", None)
+                is_admin = await admin_roster.is_admin(client, event.chat_id, user.id)
             except Exception:
                 # If we cannot determine, assume not admin
                 is_admin = None
@@ -80,34 +115,39 @@ def register(client):
             if is_admin:
                 return
 
-            # Check if user is already a member of the force-sub channel
-            try:
-                await client(GetParticipantRequest(FORCE_SUB_CHANNEL, user.id))
+            # Check if user is already a member of the force-sub channel (cached)
+            if await membership.is_member(client, FORCE_SUB_CHANNEL, user.id):
                 return  # already in channel -> no restriction needed
-            except Exception:
-                # Not a member -> restrict (mute) them using edit_permissions
-                # NOTE: use edit_permissions(chat, user, send_messages=False) to mute
-                try:
-                    await client.edit_permissions(event.chat_id, user.id, send_messages=False)
-                except Exception as e:
-                    print(f"[manage.py][force_subscribe] Failed to set permissions: {e}")
-
-                # Reply with join + check buttons (appears under the user's message)
-                buttons = [
-                    [Button.url("🔗 Join Channel", f"https://t.me/{FORCE_SUB_CHANNEL.lstrip('@')}")],
-                    [Button.inline("✅ Check", data=f"checksub:{user.id}")]
-                ]
-
-                await event.reply(
-                    f"👋 {user.first_name}, please join our channel **{FORCE_SUB_CHANNEL}** to chat here.",
-                    buttons=buttons,
-                    parse_mode="markdown"
-                )
+
+            # Not a member -> restrict (mute) them using edit_permissions
+            # NOTE: use edit_permissions(chat, user, send_messages=False) to mute
+            try:
+                await client.edit_permissions(event.chat_id, user.id, send_messages=False)
+            except Exception as e:
+                print(f"[manage.py][force_subscribe] Failed to set permissions: {e}")
+
+            # Reply with join + check buttons (appears under the user's message)
+            buttons = [
+                [Button.url("🔗 Join Channel", f"https://t.me/{FORCE_SUB_CHANNEL.lstrip('@')}")],
+                [Button.inline("✅ Check", data=f"checksub:{user.id}")]
+            ]
+
+            await event.reply(
+                f"👋 {user.first_name}, please join our channel **{FORCE_SUB_CHANNEL}** to chat here.",
+                buttons=buttons,
+                parse_mode="markdown"
+            )
         except Exception as e:
             print(f"[manage.py][force_subscribe] Error: {e}")
 
     import asyncio
-    from telethon.tl.functions.channels import GetParticipantRequest
+
+    @client.on(events.ChatAction(chats=[FORCE_SUB_CHANNEL]))
+    async def force_sub_left(event):
+        """Drop cached membership when someone leaves the channel (needs the bot to be a channel admin)."""
+        if event.user_left or event.user_kicked:
+            for uid in (event.user_ids or []):
+                await membership.forget(FORCE_SUB_CHANNEL, uid)
 
     @client.on(events.CallbackQuery(pattern=b"checksub:(\\d+)"))
     async def check_subscription(event):
@@ -117,8 +157,9 @@ def register(client):
             chat_id = MAIN_GROUP_ID
 
             try:
-                # Verify if user joined the channel
-                await client(GetParticipantRequest(FORCE_SUB_CHANNEL, user_id))
+                # Verify if user joined the channel (bypasses and rewrites the cache)
+                if not await membership.is_member(client, FORCE_SUB_CHANNEL, user_id, force_refresh=True):
+                    raise ValueError("not a member")
                 # Unmute the user
                 await client.edit_permissions(chat_id, user_id)
 
@@ -133,7 +174,7 @@ def register(client):
                     except Exception:
                         pass
 
-                asyncio.create_task(delete_later(msg, 3))
+                metrics.background(delete_later(msg, 3))
 
             except Exception:
                 await event.answer("❌ You haven’t joined the required channel yet!", alert=True)
@@ -0,0 +1,88 @@
+# membership.py
+"""
+Cached force-subscribe channel membership checks (manage.force_subscribe_handler).
+
+Lookup order per (channel, user_id):
+  1. in-memory cache — members for SUB_TTL, non-members for SUB_NEGATIVE_TTL
+  2. `sub_members` (confirmed members only; TTL index drops them after SUB_TTL),
+     so the cache is warm after a restart
+  3. Telegram GetParticipantRequest
+
+force_refresh (the "✅ Check" button) skips both caches and rewrites them.
+forget() drops a user who left the channel.
+"""
+
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+UTC = timezone.utc
+from typing import Tuple
+
+from telethon.errors import UserNotParticipantError
+from telethon.tl.functions.channels import GetParticipantRequest
+
+import config
+from db import COL_SUB_MEMBERS
+
+SUB_TTL: float = float(getattr(config, "FORCE_SUB_TTL", 24 * 3600))
+SUB_NEGATIVE_TTL: float = float(getattr(config, "FORCE_SUB_NEGATIVE_TTL", 60))
+SUB_CACHE_MAX: int = int(getattr(config, "FORCE_SUB_CACHE_MAX", 100_000))
+
+_cache: "OrderedDict[Tuple[str, int], Tuple[bool, float]]" = OrderedDict()  # -> (member, expires_at monotonic)
+
+
+def _key(channel: str, user_id: int) -> Tuple[str, int]:
+    return channel.lstrip("@").lower(), int(user_id)
+
+
+def _remember(key: Tuple[str, int], member: bool, age: float = 0.0) -> None:
+    ttl = SUB_TTL if member else SUB_NEGATIVE_TTL
+    _cache[key] = (member, time.monotonic() + ttl - age)
+    _cache.move_to_end(key)
+    while len(_cache) > SUB_CACHE_MAX:
+        _cache.popitem(last=False)
+
+
+async def is_member(client, channel: str, user_id: int, *, force_refresh: bool = False) -> bool:
+    """True if user_id is in channel. Lookup failures count as "not a member" (uncached)."""
+    key = _key(channel, user_id)
+    now = time.monotonic()
+
+    if not force_refresh:
+        hit = _cache.get(key)
+        if hit is not None and hit[1] > now:
+            return hit[0]
+        doc = await COL_SUB_MEMBERS.find_one({"channel": key[0], "user_id": key[1]}, {"verified_at": 1})
+        if doc:
+            verified_at = doc["verified_at"]
+            if verified_at.tzinfo is None:
+                verified_at = verified_at.replace(tzinfo=UTC)
+            age = (datetime.now(UTC) - verified_at).total_seconds()
+            if age < SUB_TTL:
+                _remember(key, True, age)
+                return True
+
+    try:
+        await client(GetParticipantRequest(channel, key[1]))
+    except UserNotParticipantError:
+        _remember(key, False)
+        await COL_SUB_MEMBERS.delete_one({"channel": key[0], "user_id": key[1]})
+        return False
+    except Exception as e:
+        print(f"[membership] lookup failed for {key[1]} in {channel}: {e!r}")
+        return False
+
+    _remember(key, True)
+    await COL_SUB_MEMBERS.update_one(
+        {"channel": key[0], "user_id": key[1]},
+        {"$set": {"verified_at": datetime.now(UTC)}},
+        upsert=True,
+    )
+    return True
+
+
+async def forget(channel: str, user_id: int) -> None:
+    """Drop a cached membership (e.g. the user left the channel)."""
+    key = _key(channel, user_id)
+    _cache.pop(key, None)
+    await COL_SUB_MEMBERS.delete_one({"channel": key[0], "user_id": key[1]})
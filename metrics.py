@@ -0,0 +1,266 @@
+# metrics.py
+"""
+Per-handler latency / error / round-trip metrics.
+
+- Every router command ("/add", ...) and every other event handler registered on a
+  MeteredClient ("module.function") runs inside track(label), which records latency
+  (histogram + a window of recent samples for percentiles) and errors.
+- MongoDB round-trips are counted by MONGO_LISTENER (a pymongo CommandListener passed
+  to the Motor client) and Telegram RPCs by MeteredClient.__call__; both are charged
+  to the handler whose context (contextvar) issued them, or to "(background)".
+  Tasks a handler spawns are started with background() so they do not inherit it.
+- start_server() serves the Prometheus text format on METRICS_HOST:METRICS_PORT
+  (disabled when METRICS_PORT is 0/None).
+
+- /perf [reset]   (owner) p50/p95/p99, errors and round-trips per handler
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+import contextvars
+from contextvars import ContextVar
+from typing import Deque, Dict, List, Optional
+
+from pymongo import monitoring
+from telethon import TelegramClient, events
+
+import config
+
+METRICS_HOST: str = str(getattr(config, "METRICS_HOST", "127.0.0.1"))
+METRICS_PORT: Optional[int] = getattr(config, "METRICS_PORT", 9464)
+SAMPLE_WINDOW: int = int(getattr(config, "METRICS_SAMPLE_WINDOW", 2048))  # recent latencies kept per handler
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+BACKGROUND = "(background)"
+
+
+class _Stats:
+    __slots__ = ("calls", "errors", "total", "buckets", "samples", "mongo", "rpc")
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.buckets: List[int] = [0] * (len(BUCKETS) + 1)  # last one is +Inf
+        self.samples: Deque[float] = deque(maxlen=SAMPLE_WINDOW)
+        self.mongo = 0
+        self.rpc = 0
+
+    def observe(self, seconds: float, failed: bool) -> None:
+        self.calls += 1
+        self.errors += failed
+        self.total += seconds
+        self.samples.append(seconds)
+        for i, le in enumerate(BUCKETS):
+            if seconds <= le:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+
+_stats: Dict[str, _Stats] = {}
+_current: ContextVar[Optional[_Stats]] = ContextVar("metrics_current", default=None)
+_count_lock = threading.Lock()  # mongo events arrive on Motor's executor threads
+_server: Optional[asyncio.AbstractServer] = None
+
+
+def _get(label: str) -> _Stats:
+    st = _stats.get(label)
+    if st is None:
+        st = _stats[label] = _Stats()
+    return st
+
+
+def _charge(field: str, n: int = 1) -> None:
+    st = _current.get() or _get(BACKGROUND)
+    with _count_lock:
+        setattr(st, field, getattr(st, field) + n)
+
+
+class track:
+    """with track("/add"): await handler(event) — StopPropagation is not an error."""
+    __slots__ = ("_st", "_t0", "_token")
+
+    def __init__(self, label: str) -> None:
+        self._st = _get(label)
+
+    def __enter__(self) -> "track":
+        self._token = _current.set(self._st)
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        failed = exc_type is not None and not issubclass(exc_type, events.StopPropagation)
+        self._st.observe(time.perf_counter() - self._t0, failed)
+        _current.reset(self._token)
+        return False
+
+
+def background(coro) -> asyncio.Task:
+    """create_task in an empty context: a task started from a handler is not charged to it."""
+    return asyncio.create_task(coro, context=contextvars.Context())
+
+
+def self_timed(fn):
+    """Mark an event callback that calls track() itself (MeteredClient will not wrap it)."""
+    fn.metrics_self_timed = True
+    return fn
+
+
+# -----------------------------------------------------------------------------
+# Round-trip counters
+# -----------------------------------------------------------------------------
+class _MongoRoundTrips(monitoring.CommandListener):
+    def started(self, event):
+        _charge("mongo")
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+MONGO_LISTENER = _MongoRoundTrips()
+
+
+class MeteredClient(TelegramClient):
+    """TelegramClient that counts RPCs and times every event handler added to it."""
+
+    async def __call__(self, request, ordered=False, flood_sleep_threshold=None):
+        _charge("rpc", len(request) if isinstance(request, (list, tuple)) else 1)
+        return await super().__call__(request, ordered=ordered, flood_sleep_threshold=flood_sleep_threshold)
+
+    def add_event_handler(self, callback, event=None):
+        if event is None or getattr(callback, "metrics_self_timed", False):
+            return super().add_event_handler(callback, event)
+        label = f"{callback.__module__}.{callback.__name__}"
+
+        async def timed(ev):
+            with track(label):
+                return await callback(ev)
+        timed.__name__ = callback.__name__
+        return super().add_event_handler(timed, event)
+
+
+# -----------------------------------------------------------------------------
+# Reporting
+# -----------------------------------------------------------------------------
+def _percentile(sorted_samples: List[float], q: float) -> float:
+    if not sorted_samples:
+        return 0.0
+    return sorted_samples[min(len(sorted_samples) - 1, int(q * len(sorted_samples)))]
+
+
+def snapshot() -> List[dict]:
+    """Per-handler summary, slowest p95 first."""
+    rows = []
+    for label, st in list(_stats.items()):
+        s = sorted(st.samples)
+        rows.append({
+            "handler": label, "calls": st.calls, "errors": st.errors,
+            "p50": _percentile(s, 0.50), "p95": _percentile(s, 0.95), "p99": _percentile(s, 0.99),
+            "mongo": st.mongo, "rpc": st.rpc,
+        })
+    rows.sort(key=lambda r: r["p95"], reverse=True)
+    return rows
+
+
+def reset() -> None:
+    _stats.clear()
+
+
+def _label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text() -> str:
+    out = [
+        "# HELP bot_handler_latency_seconds Handler latency.",
+        "# TYPE bot_handler_latency_seconds histogram",
+    ]
+    items = sorted(list(_stats.items()))
+    for label, st in items:
+        if not st.calls:
+            continue  # e.g. (background): round-trips only
+        h = _label(label)
+        cum = 0
+        for le, n in zip(BUCKETS, st.buckets):
+            cum += n
+            out.append(f'bot_handler_latency_seconds_bucket{{handler="{h}",le="{le}"}} {cum}')
+        out.append(f'bot_handler_latency_seconds_bucket{{handler="{h}",le="+Inf"}} {st.calls}')
+        out.append(f'bot_handler_latency_seconds_sum{{handler="{h}"}} {st.total}')
+        out.append(f'bot_handler_latency_seconds_count{{handler="{h}"}} {st.calls}')
+    for name, field, help_text in (
+        ("bot_handler_errors_total", "errors", "Handler calls that raised."),
+        ("bot_handler_mongo_roundtrips_total", "mongo", "MongoDB commands issued."),
+        ("bot_handler_telegram_rpcs_total", "rpc", "Telegram API requests issued."),
+    ):
+        out += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        out += [f'{name}{{handler="{_label(label)}"}} {getattr(st, field)}' for label, st in items]
+    return "\n".join(out) + "\n"
+
+
+async def _serve(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        await reader.readuntil(b"\r\n\r\n")
+        body = prometheus_text().encode()
+        writer.write(b"HTTP/1.1 200 OK\r\n"
+                     b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                     b"Connection: close\r\n\r\n" + body)
+        await writer.drain()
+    except Exception:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server() -> None:
+    """Serve /metrics (any path) on METRICS_HOST:METRICS_PORT unless disabled."""
+    global _server
+    if _server is not None or not METRICS_PORT:
+        return
+    _server = await asyncio.start_server(_serve, METRICS_HOST, int(METRICS_PORT))
+    print(f"[metrics] Prometheus endpoint on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+
+async def stop_server() -> None:
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
+
+
+def register(client):
+    import router
+    from permissions import is_owner
+
+    @router.command(r"^/perf(?:@[\w_]+)?(?:\s+(reset))?$")
+    async def perf_cmd(event):
+        """Owner: per-handler latency percentiles, errors and round-trips."""
+        if not await is_owner(event.sender_id):
+            await event.reply("❌ Owner-only command.")
+            return
+        if event.pattern_match.group(1):
+            reset()
+            await event.reply("🧹 Metrics reset.")
+            return
+        rows = [r for r in snapshot() if r["calls"]][:25]
+        if not rows:
+            await event.reply("📊 No handler calls recorded yet.")
+            return
+        lines = ["📊 **Handler latency** (ms, last %d calls each)" % SAMPLE_WINDOW]
+        for r in rows:
+            lines.append(
+                f"`{r['handler']}` n={r['calls']} • p50 {r['p50'] * 1000:.0f} • "
+                f"p95 {r['p95'] * 1000:.0f} • p99 {r['p99'] * 1000:.0f} • err {r['errors']} • "
+                f"mongo {r['mongo'] / r['calls']:.1f}/call • rpc {r['rpc'] / r['calls']:.1f}/call"
+            )
+        bg = _stats.get(BACKGROUND)
+        if bg is not None:
+            lines.append(f"`{BACKGROUND}` mongo {bg.mongo} • rpc {bg.rpc}")
+        await event.reply("\n".join(lines))
@@ -0,0 +1,14 @@
+import asyncio
+from db import ensure_indexes, migrate_counts_to_ist_periods
+
+
+async def main():
+    # re-key old date_utc daily docs onto the IST `period` key, then build the period indexes
+    moved = await migrate_counts_to_ist_periods()
+    await ensure_indexes()
+    print(f"✅ Re-keyed {moved} daily counter docs to IST periods")
+    print("ℹ️ Run `python reconcile.py --apply` to recompute exact IST days from closed_at")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
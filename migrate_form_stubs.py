@@ -0,0 +1,13 @@
+import asyncio
+from db import ensure_indexes, migrate_deal_stubs_to_form_stubs
+
+
+async def main():
+    # creates form_stubs indexes (unique key + TTL), then moves the pending deal_id=None stubs
+    await ensure_indexes()
+    moved = await migrate_deal_stubs_to_form_stubs()
+    print(f"✅ Moved {moved} form stubs from deals to form_stubs")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
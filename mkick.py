@@ -1,12 +1,35 @@
-from telethon import events
-from db import COL_ESCROWERS
+import asyncio
+import time
+
+from telethon.tl.functions.contacts import ResolveUsernameRequest
+from telethon.tl.types import InputPeerUser
+
+import router
+from permissions import is_escrower
+from moderation import kick_member, resolve_limiter
+
+EDIT_INTERVAL = 1.5  # seconds between progress edits
+
+
+def _cached_user(client, uname: str):
+    """InputPeerUser from the session cache, or None (no RPC)."""
+    try:
+        peer = client.session.get_input_entity(uname)
+    except Exception:
+        return None
+    return peer if isinstance(peer, InputPeerUser) else None
+
+
+async def _resolve(client, uname: str):
+    res = await resolve_limiter().run(client, ResolveUsernameRequest(uname))
+    for u in res.users:
+        if getattr(u, "username", None) and u.username.lower() == uname.lower():
+            return InputPeerUser(u.id, u.access_hash)
+    raise ValueError("not a user")
 
-async def is_escrower(user_id: int) -> bool:
-    doc = await COL_ESCROWERS.find_one({"user_id": user_id})
-    return bool(doc)
 
 def register(client):
-    @client.on(events.NewMessage(pattern=r"^/mkick\s+(.+)"))
+    @router.command(r"^/mkick\s+(.+)")
     async def mkick_handler(event):
         # ✅ Restriction check
         if not await is_escrower(event.sender_id):
@@ -18,19 +41,39 @@ def register(client):
             return
 
         args = event.pattern_match.group(1)
-        usernames = [u.strip().lstrip("@") for u in args.split(" ") if u.strip()]
+        usernames = list(dict.fromkeys(u.strip().lstrip("@") for u in args.split(" ") if u.strip()))
 
         if not usernames:
             await event.reply("⚠️ No valid usernames provided.")
             return
 
-        results = []
-        for uname in usernames:
+        results = {u: f"⏳ {u}" for u in usernames}
+        status = await event.reply("\n".join(results.values()))
+        last_edit = time.monotonic()
+        dirty = False
+
+        async def flush(force: bool = False):
+            nonlocal last_edit, dirty
+            if not dirty or (not force and time.monotonic() - last_edit < EDIT_INTERVAL):
+                return
+            dirty = False
+            last_edit = time.monotonic()
+            try:
+                await status.edit("\n".join(results.values()))
+            except Exception:
+                pass
+
+        async def handle(uname: str):
+            nonlocal dirty
             try:
-                user = await event.client.get_entity(uname)
-                await event.client.kick_participant(event.chat_id, user.id)
-                results.append(f"✅ Kicked {uname}")
+                # resolve in one pass: session cache first, ResolveUsername only for misses
+                user = _cached_user(event.client, uname) or await _resolve(event.client, uname)
+                await kick_member(event.client, event.chat_id, user)
+                results[uname] = f"✅ Kicked {uname}"
             except Exception as e:
-                results.append(f"❌ Failed to kick {uname} ({str(e)})")
+                results[uname] = f"❌ Failed to kick {uname} ({str(e)})"
+            dirty = True
+            await flush()
 
-        await event.reply("\n".join(results))
+        await asyncio.gather(*(handle(u) for u in usernames))
+        await flush(force=True)
@@ -0,0 +1,48 @@
+# moderation.py
+"""
+Shared kick path for /kickall and /mkick.
+
+Every kick holds one of KICKALL_CONCURRENCY slots and a token from the shared
+"kick" bucket (ratelimit.py), so concurrent moderation commands together stay
+under one FloodWait-aware budget. Username lookups use the "resolve" bucket.
+/mkick only ever kicks; /kickall asks for the permanent-ban fallback explicitly.
+"""
+
+import asyncio
+
+from telethon.tl.functions.channels import EditBannedRequest
+from telethon.tl.types import ChatBannedRights
+
+import config
+import ratelimit
+
+KICK_RATE: float = float(getattr(config, "KICKALL_RATE", 5))          # kicks per second (ceiling)
+KICK_CONCURRENCY: int = int(getattr(config, "KICKALL_CONCURRENCY", 4))
+RESOLVE_RATE: float = 2.0                                              # ResolveUsername per second
+
+_kick_slots = asyncio.Semaphore(KICK_CONCURRENCY)
+_BAN_RIGHTS = ChatBannedRights(until_date=None, view_messages=True)
+
+
+def kick_limiter() -> ratelimit.TokenBucket:
+    return ratelimit.get("kick", KICK_RATE)
+
+
+def resolve_limiter() -> ratelimit.TokenBucket:
+    return ratelimit.get("resolve", RESOLVE_RATE)
+
+
+async def kick_member(client, chat_id, user, *, ban_fallback: bool = False) -> None:
+    """
+    Kick (ban + unban). Only with ban_fallback (the /kickall sweep, as before) does a
+    failed kick fall back to a permanent ban; otherwise the error is raised to the
+    caller to report. Raises the last error.
+    """
+    limiter = kick_limiter()
+    async with _kick_slots:
+        try:
+            await limiter.run(client.kick_participant, chat_id, user)
+        except Exception:
+            if not ban_fallback:
+                raise
+            await limiter.run(client, EditBannedRequest(chat_id, user, _BAN_RIGHTS))
@@ -1,6 +1,6 @@
 from typing import Optional
-from db import COL_ESCROWERS
 from config import OWNER_ID
+import escrower_cache
 
 
 async def is_owner(user_id: int) -> bool:
@@ -13,9 +13,9 @@ async def is_owner(user_id: int) -> bool:
 
 
 async def is_escrower(user_id: int) -> bool:
-    """Check if a user exists in the escrowers database."""
-    doc = await COL_ESCROWERS.find_one({"user_id": user_id})
-    return bool(doc)
+    """Check if a user is a registered escrower (served from the in-process roster)."""
+    await escrower_cache.ensure_loaded()
+    return escrower_cache.is_escrower(user_id)
 
 
 async def is_admin_or_owner(user_id: int) -> bool:
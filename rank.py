@@ -1,112 +1,407 @@
+from bisect import bisect_left, bisect_right, insort
 from typing import Any, Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+UTC = timezone.utc
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import DESCENDING, ASCENDING, ReplaceOne, ReturnDocument, UpdateOne
+
+import config
 
 CONSIDERED_STATUSES = ["closed"]
+SEED_MARKER = "user_volumes"  # meta doc: { seeded, legacy_applied, seeded_at }
+SEED_BATCH: int = int(getattr(config, "RANK_SEED_BATCH", 1000))  # deals per seed transaction
 
-async def _deal_volumes(db: AsyncIOMotorDatabase) -> Dict[int, float]:
+# -----------------------------------------------------------------------------
+# In-memory order-statistics index over user_volumes
+# -----------------------------------------------------------------------------
+class VolumeIndex:
     """
-    Aggregate current closed deal volumes per user_id (buyer + seller).
-    We join deals -> users collection to resolve user_id.
+    Sorted-array index answering dense rank and top-N in O(log n) lookups.
+    - _keys: (-volume, user_id) ascending == leaderboard order
+    - _distinct: distinct volumes ascending, _mult: how many users share each
     """
-    # Buyer side
-    buyer_pipeline = [
-        {"$match": {"status": {"$in": CONSIDERED_STATUSES}}},
-        {"$lookup": {
-            "from": "users",
-            "localField": "buyer_username",
-            "foreignField": "username",
-            "as": "buyer_user"
-        }},
-        {"$unwind": {"path": "$buyer_user", "preserveNullAndEmptyArrays": True}},
-        {"$project": {
-            "user_id": "$buyer_user.user_id",
-            "amount": {"$ifNull": ["$amount", 0]}
-        }},
-        {"$match": {"user_id": {"$ne": None}}},
-        {"$group": {"_id": "$user_id", "total_volume": {"$sum": "$amount"}}},
-    ]
+    __slots__ = ("_rows", "_keys", "_distinct", "_mult", "loaded")
 
-    # Seller side
-    seller_pipeline = [
-        {"$match": {"status": {"$in": CONSIDERED_STATUSES}}},
-        {"$lookup": {
-            "from": "users",
-            "localField": "seller_username",
-            "foreignField": "username",
-            "as": "seller_user"
-        }},
-        {"$unwind": {"path": "$seller_user", "preserveNullAndEmptyArrays": True}},
+    def __init__(self) -> None:
+        self._rows: Dict[int, Dict[str, Any]] = {}
+        self._keys: List[Tuple[float, int]] = []
+        self._distinct: List[float] = []
+        self._mult: Dict[float, int] = {}
+        self.loaded = False
+
+    def load(self, rows: List[Dict[str, Any]]) -> None:
+        self._rows = {}
+        for r in rows:
+            uid = int(r["user_id"])
+            self._rows[uid] = {
+                "user_id": uid,
+                "name": r.get("name") or str(uid),
+                "total_volume": float(r.get("total_volume", 0.0) or 0.0),
+                "count": int(r.get("count", 0) or 0),
+            }
+        self._keys = sorted((-r["total_volume"], uid) for uid, r in self._rows.items())
+        self._mult = {}
+        for r in self._rows.values():
+            self._mult[r["total_volume"]] = self._mult.get(r["total_volume"], 0) + 1
+        self._distinct = sorted(self._mult)
+        self.loaded = True
+
+    def _unlink(self, uid: int, vol: float) -> None:
+        i = bisect_left(self._keys, (-vol, uid))
+        if i < len(self._keys) and self._keys[i] == (-vol, uid):
+            del self._keys[i]
+        left = self._mult.get(vol, 0) - 1
+        if left > 0:
+            self._mult[vol] = left
+        else:
+            self._mult.pop(vol, None)
+            j = bisect_left(self._distinct, vol)
+            if j < len(self._distinct) and self._distinct[j] == vol:
+                del self._distinct[j]
+
+    def _link(self, uid: int, vol: float) -> None:
+        insort(self._keys, (-vol, uid))
+        if vol not in self._mult:
+            insort(self._distinct, vol)
+        self._mult[vol] = self._mult.get(vol, 0) + 1
+
+    def add(self, uid: int, volume_delta: float, count_delta: int = 0, name: Optional[str] = None) -> None:
+        row = self._rows.get(uid)
+        if row is None:
+            row = {"user_id": uid, "name": name or str(uid), "total_volume": 0.0, "count": 0}
+            self._rows[uid] = row
+        else:
+            self._unlink(uid, row["total_volume"])
+        row["total_volume"] += float(volume_delta)
+        row["count"] += int(count_delta)
+        if name:
+            row["name"] = name
+        self._link(uid, row["total_volume"])
+
+    def get(self, uid: int) -> Optional[Dict[str, Any]]:
+        return self._rows.get(uid)
+
+    def rank(self, uid: int) -> Optional[Tuple[int, float]]:
+        row = self._rows.get(uid)
+        if row is None:
+            return None
+        v = row["total_volume"]
+        # dense rank = number of distinct higher volumes + 1
+        return len(self._distinct) - bisect_right(self._distinct, v) + 1, v
+
+    def top(self, n: int) -> List[Dict[str, Any]]:
+        return [dict(self._rows[uid]) for _neg, uid in self._keys[:max(0, int(n))]]
+
+
+INDEX = VolumeIndex()
+
+async def load_volume_index(db: AsyncIOMotorDatabase) -> None:
+    """(Re)build the in-memory index from the user_volumes projection."""
+    rows = [d async for d in db["user_volumes"].find({}, {"_id": 0, "user_id": 1, "name": 1, "total_volume": 1, "count": 1})]
+    INDEX.load(rows)
+
+# -----------------------------------------------------------------------------
+# Full recompute (used to seed / rebuild the user_volumes projection)
+# -----------------------------------------------------------------------------
+def _closed_by(snapshot: datetime) -> Dict[str, Any]:
+    """Closed deals as of snapshot (deals without closed_at predate the leaderboard)."""
+    return {
+        "status": {"$in": CONSIDERED_STATUSES},
+        "$or": [{"closed_at": {"$lte": snapshot}}, {"closed_at": None}],
+    }
+
+async def _deal_totals(db: AsyncIOMotorDatabase, snapshot: datetime, session=None) -> Dict[int, Dict[str, float]]:
+    """
+    Aggregate closed deal volumes + counts per user_id (buyer + seller) as of snapshot,
+    using the buyer_user_id/seller_user_id stored on each deal.
+    """
+    pipeline = [
+        {"$match": _closed_by(snapshot)},
         {"$project": {
-            "user_id": "$seller_user.user_id",
-            "amount": {"$ifNull": ["$amount", 0]}
+            "uids": {"$setUnion": [["$buyer_user_id"], ["$seller_user_id"]]},
+            "amount": {"$ifNull": ["$amount", 0]},
         }},
-        {"$match": {"user_id": {"$ne": None}}},
-        {"$group": {"_id": "$user_id", "total_volume": {"$sum": "$amount"}}},
+        {"$unwind": "$uids"},
+        {"$match": {"uids": {"$ne": None}}},
+        {"$group": {"_id": "$uids", "total_volume": {"$sum": "$amount"}, "count": {"$sum": 1}}},
     ]
-
-    buyer_cursor = db["deals"].aggregate(buyer_pipeline)
-    seller_cursor = db["deals"].aggregate(seller_pipeline)
-
-    totals: Dict[int, float] = {}
-    for cursor in (buyer_cursor, seller_cursor):
-        async for doc in cursor:
-            uid = int(doc["_id"])
-            amt = float(doc["total_volume"])
-            totals[uid] = totals.get(uid, 0.0) + amt
+    totals: Dict[int, Dict[str, float]] = {}
+    async for doc in db["deals"].aggregate(pipeline, session=session):
+        totals[int(doc["_id"])] = {"total_volume": float(doc["total_volume"]), "count": int(doc["count"])}
     return totals
 
-async def _legacy_volumes(db: AsyncIOMotorDatabase) -> Dict[int, float]:
+async def _legacy_totals(db: AsyncIOMotorDatabase, session=None) -> Dict[int, Dict[str, Any]]:
     """
-    Legacy totals (from old JSON import).
+    Legacy totals (from old JSON import) plus display names for every known user_id.
     """
-    cursor = db["users"].find({"legacy_volume": {"$gt": 0}}, {"user_id": 1, "legacy_volume": 1})
-    out: Dict[int, float] = {}
+    cursor = db["users"].find(
+        {"user_id": {"$ne": None}},
+        {"user_id": 1, "name": 1, "legacy_volume": 1, "legacy_count": 1},
+        session=session,
+    )
+    out: Dict[int, Dict[str, Any]] = {}
     async for u in cursor:
         uid = int(u["user_id"])
-        out[uid] = out.get(uid, 0.0) + float(u.get("legacy_volume", 0.0))
+        name = (u.get("name") or "").strip() or str(uid)
+        out[uid] = {
+            "name": name,
+            "total_volume": float(u.get("legacy_volume", 0.0) or 0.0),
+            "count": int(u.get("legacy_count", 0) or 0),
+        }
     return out
 
-async def _merged_volumes(db: AsyncIOMotorDatabase) -> List[Dict[str, Any]]:
+async def rebuild_user_volumes(db: AsyncIOMotorDatabase) -> int:
     """
-    Merge current + legacy volumes keyed by user_id, attach display names.
+    Recompute user_volumes from scratch: closed deals + legacy_volume/legacy_count.
+    Returns the number of leaderboard rows written.
+
+    Runs in one transaction when available (a concurrent close conflicts and the
+    rebuild is retried). Deals are flagged volumes_applied by the same snapshot
+    predicate they were aggregated with (closed at or before the snapshot), so a deal
+    closing mid-rebuild is credited by its own apply_closed_deal_volume instead.
+    Marks the leaderboard as seeded (see ensure_user_volumes).
     """
-    current = await _deal_volumes(db)
-    legacy = await _legacy_volumes(db)
-
-    totals: Dict[int, float] = {}
-    for uid, vol in current.items():
-        totals[uid] = totals.get(uid, 0.0) + vol
-    for uid, vol in legacy.items():
-        totals[uid] = totals.get(uid, 0.0) + vol
-
-    # fetch display names
-    users_map: Dict[int, str] = {}
-    cursor = db["users"].find({"user_id": {"$in": list(totals.keys())}}, {"user_id": 1, "name": 1})
-    async for u in cursor:
-        uid = int(u["user_id"])
-        display_name = u.get("name")
-        users_map[uid] = display_name.strip() if display_name else str(uid)
+    from db import backfill_deal_user_ids, run_in_transaction
+    await backfill_deal_user_ids()
 
-    merged = [
-        {"user_id": uid, "name": users_map.get(uid, str(uid)), "total_volume": vol}
-        for uid, vol in totals.items()
-    ]
-    merged.sort(key=lambda x: (-x["total_volume"], x["user_id"]))
-    return merged
+    async def op(session):
+        snapshot = datetime.now(UTC)
+        current = await _deal_totals(db, snapshot, session=session)
+        legacy = await _legacy_totals(db, session=session)
+
+        ops = []
+        for uid in set(current) | set(legacy):
+            cur = current.get(uid, {})
+            leg = legacy.get(uid, {})
+            vol = float(cur.get("total_volume", 0.0)) + float(leg.get("total_volume", 0.0))
+            cnt = int(cur.get("count", 0)) + int(leg.get("count", 0))
+            if vol <= 0 and cnt <= 0:
+                continue
+            ops.append(ReplaceOne(
+                {"user_id": uid},
+                {"user_id": uid, "name": leg.get("name") or str(uid),
+                 "total_volume": vol, "count": cnt, "updated_at": snapshot},
+                upsert=True,
+            ))
+
+        col = db["user_volumes"]
+        if ops:
+            await col.bulk_write(ops, ordered=False, session=session)
+        await col.delete_many({"updated_at": {"$lt": snapshot}}, session=session)
+        # mark the aggregated deals as accounted so the close path doesn't double count them
+        await db["deals"].update_many(
+            {**_closed_by(snapshot), "volumes_applied": {"$ne": True}},
+            {"$set": {"volumes_applied": True}},
+            session=session,
+        )
+        await db["meta"].update_one(
+            {"_id": SEED_MARKER},
+            {"$set": {"seeded": True, "legacy_applied": True, "seeded_at": snapshot}},
+            upsert=True, session=session,
+        )
+        return len(ops)
+
+    written = await run_in_transaction(op)
+    await load_volume_index(db)
+    return written
+
+async def _seed_legacy(db: AsyncIOMotorDatabase) -> None:
+    """Add legacy_volume/legacy_count once, gated on the marker's legacy_applied."""
+    from db import run_in_transaction
+    await db["meta"].update_one({"_id": SEED_MARKER}, {"$setOnInsert": {"seeded": False}}, upsert=True)
+
+    async def op(session):
+        res = await db["meta"].update_one(
+            {"_id": SEED_MARKER, "legacy_applied": {"$ne": True}},
+            {"$set": {"legacy_applied": True}},
+            session=session,
+        )
+        if res.modified_count != 1:
+            return
+        now = datetime.now(UTC)
+        ops = [
+            UpdateOne(
+                {"user_id": uid},
+                {"$inc": {"total_volume": leg["total_volume"], "count": leg["count"]},
+                 "$set": {"name": leg["name"], "updated_at": now}},
+                upsert=True,
+            )
+            for uid, leg in (await _legacy_totals(db, session=session)).items()
+            if leg["total_volume"] > 0 or leg["count"] > 0
+        ]
+        if ops:
+            await db["user_volumes"].bulk_write(ops, ordered=False, session=session)
+
+    await run_in_transaction(op)
+
+async def seed_user_volumes(db: AsyncIOMotorDatabase) -> int:
+    """
+    First-run seed, in SEED_BATCH-deal transactions instead of one: credit every closed
+    deal not yet flagged volumes_applied (flag + $inc per batch, the same gate the close
+    path uses, so rows it already credited stay valid), plus legacy totals once.
+    Resumable: a failed seed leaves the marker unset and the next start continues.
+    Sides without a stored user_id are credited later by db.link_user.
+    Returns the number of deals credited.
+    """
+    from db import run_in_transaction
+    await _seed_legacy(db)
+
+    credited = 0
+    last_id = None
+    while True:
+        async def op(session):
+            query: Dict[str, Any] = {"status": {"$in": CONSIDERED_STATUSES}, "volumes_applied": {"$ne": True}}
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            cursor = db["deals"].find(
+                query, {"buyer_user_id": 1, "seller_user_id": 1, "amount": 1}, session=session,
+            ).sort("_id", ASCENDING).limit(SEED_BATCH)
+            batch = [d async for d in cursor]
+            if not batch:
+                return None, 0
+            ids = [d["_id"] for d in batch]
+            await db["deals"].update_many(
+                {"_id": {"$in": ids}, "volumes_applied": {"$ne": True}},
+                {"$set": {"volumes_applied": True}},
+                session=session,
+            )
+            totals: Dict[int, List[float]] = {}
+            for d in batch:
+                amount = float(d.get("amount", 0.0) or 0.0)
+                for uid in {d.get("buyer_user_id"), d.get("seller_user_id")} - {None}:
+                    t = totals.setdefault(int(uid), [0.0, 0])
+                    t[0] += amount
+                    t[1] += 1
+            now = datetime.now(UTC)
+            ops = [
+                UpdateOne(
+                    {"user_id": uid},
+                    {"$inc": {"total_volume": vol, "count": cnt},
+                     "$set": {"updated_at": now}, "$setOnInsert": {"name": str(uid)}},
+                    upsert=True,
+                )
+                for uid, (vol, cnt) in totals.items()
+            ]
+            if ops:
+                await db["user_volumes"].bulk_write(ops, ordered=False, session=session)
+            return ids[-1], len(ids)
+
+        last_id, n = await run_in_transaction(op)
+        if last_id is None:
+            break
+        credited += n
+
+    await db["meta"].update_one(
+        {"_id": SEED_MARKER},
+        {"$set": {"seeded": True, "seeded_at": datetime.now(UTC)}},
+        upsert=True,
+    )
+    return credited
+
+async def credit_user_volume(db: AsyncIOMotorDatabase, user_id: int, amount: float, count: int) -> None:
+    """
+    Add already-closed deals to one user's leaderboard row. Callers must have won the
+    per-deal gate (see db.link_user) so each deal side is credited exactly once.
+    """
+    if not count:
+        return
+    user = await db["users"].find_one({"user_id": user_id}, {"name": 1}) or {}
+    name = (user.get("name") or "").strip()
+    update: Dict[str, Any] = {
+        "$inc": {"total_volume": amount, "count": count},
+        "$set": {"updated_at": datetime.now(UTC)},
+    }
+    if name:
+        update["$set"]["name"] = name
+    else:
+        update["$setOnInsert"] = {"name": str(user_id)}
+    await db["user_volumes"].update_one({"user_id": user_id}, update, upsert=True)
+    if INDEX.loaded:
+        INDEX.add(user_id, amount, count, name or None)
+
+async def ensure_user_volumes(db: AsyncIOMotorDatabase) -> None:
+    """Seed the projection until a seed has completed (marker in `meta`, not row presence)."""
+    marker = await db["meta"].find_one({"_id": SEED_MARKER}, {"seeded": 1})
+    if not (marker and marker.get("seeded")):
+        n = await seed_user_volumes(db)
+        print(f"[rank] user_volumes seeded ({n} deals credited)")
+
+# -----------------------------------------------------------------------------
+# Incremental maintenance (close path)
+# -----------------------------------------------------------------------------
+async def apply_closed_deal_volume(db: AsyncIOMotorDatabase, deal: dict) -> None:
+    """
+    Credit a freshly closed deal to buyer + seller in user_volumes.
+    Idempotent via 'volumes_applied'=True gate on the deal document. Only sides with a
+    stored user_id are credited; an unlinked side is credited by db.link_user later.
+    """
+    if not deal or deal.get("status") not in CONSIDERED_STATUSES:
+        return
+
+    # the gate returns the deal as flagged: a side late-bound by db.link_user before
+    # this point is credited here, one bound after it is credited by link_user
+    applied = await db["deals"].find_one_and_update(
+        {"_id": deal["_id"], "volumes_applied": {"$ne": True}},
+        {"$set": {"volumes_applied": True}},
+        projection={"buyer_user_id": 1, "seller_user_id": 1, "amount": 1},
+        return_document=ReturnDocument.AFTER,
+    )
+    if applied is None:
+        return
+
+    uids = {applied.get(f"{side}_user_id") for side in ("buyer", "seller")} - {None}
+    if not uids:
+        return
+    try:
+        amount = float(applied.get("amount", 0.0) or 0.0)
+    except Exception:
+        amount = 0.0
+
+    now = datetime.now(UTC)
+    names = {}
+    async for u in db["users"].find({"user_id": {"$in": list(uids)}}, {"user_id": 1, "name": 1}):
+        names[int(u["user_id"])] = (u.get("name") or "").strip()
+    ops = []
+    for uid in uids:
+        uid = int(uid)
+        name = names.get(uid, "")
+        update: Dict[str, Any] = {
+            "$inc": {"total_volume": amount, "count": 1},
+            "$set": {"updated_at": now},
+        }
+        if name:
+            update["$set"]["name"] = name
+        else:
+            update["$setOnInsert"] = {"name": str(uid)}
+        ops.append(UpdateOne({"user_id": uid}, update, upsert=True))
+        if INDEX.loaded:
+            INDEX.add(uid, amount, 1, name or None)
+    if ops:
+        await db["user_volumes"].bulk_write(ops, ordered=False)
+
+# -----------------------------------------------------------------------------
+# Reads (served from INDEX; Mongo only if the index was never loaded)
+# -----------------------------------------------------------------------------
+async def get_top_by_volume(db: AsyncIOMotorDatabase, n: int = 20) -> List[Dict[str, Any]]:
+    if INDEX.loaded:
+        return INDEX.top(n)
+    cursor = (
+        db["user_volumes"]
+        .find({}, {"_id": 0, "user_id": 1, "name": 1, "total_volume": 1})
+        .sort([("total_volume", DESCENDING), ("user_id", ASCENDING)])
+        .limit(int(n))
+    )
+    return [doc async for doc in cursor]
 
 async def get_top20_by_volume(db: AsyncIOMotorDatabase) -> List[Dict[str, Any]]:
-    vols = await _merged_volumes(db)
-    return vols[:20]
+    return await get_top_by_volume(db, 20)
+
+async def get_user_volume(db: AsyncIOMotorDatabase, user_id: int) -> Optional[Dict[str, Any]]:
+    if INDEX.loaded:
+        return INDEX.get(user_id)
+    return await db["user_volumes"].find_one({"user_id": user_id})
 
 async def get_user_rank_by_volume(db: AsyncIOMotorDatabase, user_id: int) -> Optional[Tuple[int, float]]:
-    vols = await _merged_volumes(db)
-    rank = 0
-    prev = None
-    for doc in vols:
-        v = float(doc.get("total_volume") or 0.0)
-        if prev is None or v < prev:
-            rank += 1
-            prev = v
-        if doc.get("user_id") == user_id:
-            return rank, v
-    return None
+    if not INDEX.loaded:
+        await load_volume_index(db)
+    return INDEX.rank(user_id)
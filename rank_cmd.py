@@ -1,10 +1,11 @@
 # rank_cmd.py
-from telethon import events
+import router
 from db import COL_USERS
 import logging
 
 # import your rank functions (your file is named rank.py)
-from rank import get_top20_by_volume
+from rank import get_top_by_volume, rebuild_user_volumes
+from permissions import is_owner
 
 log = logging.getLogger("rank_cmd")
 
@@ -12,7 +13,7 @@ def register(client):
     # Accept /rank, /rank 10, /rank@Bot, /rank@Bot 10
     pattern = r"^/rank(?:@[\w_]+)?(?:\s+(\d+))?$"
 
-    @client.on(events.NewMessage(pattern=pattern))
+    @router.command(pattern)
     async def rank_handler(event):
         try:
             log.info("[/rank] handler triggered from chat %s by %s", event.chat_id, event.sender_id)
@@ -22,14 +23,14 @@ def register(client):
             n = max(1, min(n, 50))
 
             db = COL_USERS.database  # AsyncIOMotorDatabase
-            rows = await get_top20_by_volume(db)  # [{user_id, name, total_volume}, ...]
+            rows = await get_top_by_volume(db, n)  # [{user_id, name, total_volume}, ...]
 
             if not rows:
                 await event.reply("🏆 Top by Escrowed Volume\nNo data yet.")
                 return
 
             lines = ["🏆 Top by Escrowed Volume"]
-            for i, r in enumerate(rows[:n], 1):
+            for i, r in enumerate(rows, 1):
                 name = (r.get("name") or str(r.get("user_id", ""))).strip() or str(r.get("user_id", ""))
                 amt = float(r.get("total_volume", 0.0))
                 lines.append(f"{i}. {name} - ${amt:,.2f}")
@@ -40,3 +41,16 @@ def register(client):
             # Show the actual error so we know what's wrong
             log.exception("[/rank] error")
             await event.reply(f"❌ /rank error: {e}")
+
+    @router.command(r"^/rebuildrank(?:@[\w_]+)?$")
+    async def rebuild_rank_handler(event):
+        """Owner-only: recompute the user_volumes leaderboard from deals + legacy."""
+        if not await is_owner(event.sender_id):
+            await event.reply("❌ Only owner can use this command.")
+            return
+        try:
+            rows = await rebuild_user_volumes(COL_USERS.database)
+            await event.reply(f"✅ Leaderboard rebuilt ({rows} users).")
+        except Exception as e:
+            log.exception("[/rebuildrank] error")
+            await event.reply(f"❌ /rebuildrank error: {e}")
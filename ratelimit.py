@@ -0,0 +1,85 @@
+# ratelimit.py
+"""
+Shared token-bucket limiter for bursts of Telegram admin RPCs (kicks, resolves).
+
+- acquire() waits for a token; callers are served in arrival order.
+- A FloodWaitError pauses the whole bucket for the requested time and halves its
+  rate; every success wins a little of the rate back (AIMD), so the bucket settles
+  just under whatever the server currently tolerates.
+- get(name, ...) returns one process-wide bucket per name, so e.g. /kickall and
+  /mkick draw from the same "kick" budget.
+"""
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from telethon.errors import FloodWaitError
+
+
+class TokenBucket:
+    __slots__ = ("max_rate", "min_rate", "rate", "capacity", "_tokens", "_last", "_paused_until", "_lock")
+
+    def __init__(self, rate: float, capacity: Optional[float] = None, min_rate: float = 0.2) -> None:
+        self.max_rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def on_flood_wait(self, seconds: float) -> None:
+        now = time.monotonic()
+        self._paused_until = max(self._paused_until, now + float(seconds) + 1)
+        self.rate = max(self.min_rate, self.rate / 2)
+        self._tokens = 0.0
+        self._last = now
+
+    def on_success(self) -> None:
+        self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    async def run(self, fn: Callable[..., Awaitable[Any]], *args: Any, retries: int = 3) -> Any:
+        """Call fn(*args) under the limiter; FloodWait → pause, slow down, retry (up to `retries`)."""
+        attempt = 0
+        while True:
+            await self.acquire()
+            try:
+                result = await fn(*args)
+            except FloodWaitError as e:
+                self.on_flood_wait(e.seconds)
+                attempt += 1
+                if attempt > retries:
+                    raise
+                continue
+            self.on_success()
+            return result
+
+
+_buckets: Dict[str, TokenBucket] = {}
+
+
+def get(name: str, rate: float, capacity: Optional[float] = None) -> TokenBucket:
+    """The shared bucket called `name` (created with rate/capacity on first use)."""
+    bucket = _buckets.get(name)
+    if bucket is None:
+        bucket = _buckets[name] = TokenBucket(rate, capacity)
+    return bucket
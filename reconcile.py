@@ -0,0 +1,249 @@
+# reconcile.py
+"""
+Counter rebuild + reconciliation.
+
+Streams every closed deal through ONE server-side aggregation ($facet) that recomputes
+each `counts` scope (global, plus the IST daily/weekly/monthly/yearly buckets of
+each dimension) and the simple count/_id="1" doc,
+diffs the result against what is stored, and (unless dry-run) applies the
+corrections with bulk writes.
+
+Closes still waiting in `counter_journal` (write-behind) are left out of the
+expected totals — their flush adds them — and `apply` runs the diff, the writes
+and the counters_applied flags in one transaction where available. The flags are
+set by the same predicate the aggregation matched (closed at or before the run's
+snapshot, not journaled), never by a list of deal ids.
+
+- /reconcile          (owner)  dry-run report
+- /reconcile apply    (owner)  apply corrections
+- python reconcile.py [--apply]
+"""
+
+import asyncio
+import sys
+from datetime import datetime, timezone
+UTC = timezone.utc
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import DeleteOne, UpdateOne
+
+import router
+from db import COL_DEALS, COL_COUNTS, COL_COUNT_SIMPLE, COL_COUNTER_JOURNAL, run_in_transaction
+from utils.timebuckets import UNITS, period_expr
+from permissions import is_owner
+import counter_buffer
+
+PERIOD_SCOPES = tuple(f"{p}{u}" for u in UNITS for p in ("", "group_", "escrower_"))
+SCOPES = ("global",) + PERIOD_SCOPES
+FIELDS = ("deals", "volume_main", "fees")
+EPS = 1e-6
+
+Key = Tuple[str, Any, Any, Any]  # (scope, group_id, escrower_id, bucket)
+
+
+def _bucket_field(scope: str) -> Any:
+    return "period" if scope in PERIOD_SCOPES else None
+
+
+def _num(field: str) -> dict:
+    return {"$convert": {"input": f"${field}", "to": "double", "onError": 0.0, "onNull": 0.0}}
+
+
+def _sums() -> dict:
+    return {"deals": {"$sum": 1}, "volume_main": {"$sum": "$amount"}, "fees": {"$sum": "$fee"}}
+
+
+def _facet(bucket: str, dim: Any) -> List[dict]:
+    match: Dict[str, Any] = {bucket: {"$ne": None}}
+    group_id: Dict[str, Any] = {"b": f"${bucket}"}
+    if dim:
+        match[dim] = {"$ne": None}
+        group_id["k"] = f"${dim}"
+    return [{"$match": match}, {"$group": {"_id": group_id, **_sums()}}]
+
+
+def _closed_match(exclude: List[Any], snapshot: datetime) -> dict:
+    """Closed deals as of snapshot, minus journaled ones (deals without closed_at are old)."""
+    return {
+        "status": "closed",
+        "_id": {"$nin": exclude},
+        "$or": [{"closed_at": {"$lte": snapshot}}, {"closed_at": None}],
+    }
+
+
+def _pipeline(exclude: List[Any], snapshot: datetime) -> List[dict]:
+    # bucket keys match db._scoped_counter_targets (utils.timebuckets.period_key)
+    project: Dict[str, Any] = {
+        "amount": _num("main_amount"),
+        "fee": _num("fee"),
+        "group_id": "$form_chat_id",
+        "escrower_id": "$escrower_id",
+    }
+    for unit in UNITS:
+        project[unit] = period_expr(unit, "$when")
+
+    facets: Dict[str, Any] = {
+        "global": [{"$group": {"_id": None, **_sums()}}],
+    }
+    for unit in UNITS:
+        facets[unit] = _facet(unit, None)
+        facets[f"group_{unit}"] = _facet(unit, "group_id")
+        facets[f"escrower_{unit}"] = _facet(unit, "escrower_id")
+
+    return [
+        {"$match": _closed_match(exclude, snapshot)},
+        {"$set": {"when": {"$ifNull": ["$closed_at", "$created_at"]}}},
+        {"$project": project},
+        {"$facet": facets},
+    ]
+
+
+def _key(doc: dict) -> Key:
+    scope = doc.get("scope")
+    field = _bucket_field(scope)
+    return (scope, doc.get("group_id"), doc.get("escrower_id"), doc.get(field) if field else None)
+
+
+def _filter(key: Key) -> dict:
+    scope, gid, eid, bucket = key
+    f: Dict[str, Any] = {"scope": scope}
+    if gid is not None:
+        f["group_id"] = gid
+    if eid is not None:
+        f["escrower_id"] = eid
+    if bucket is not None:
+        f[_bucket_field(scope)] = bucket
+    return f
+
+
+async def compute_expected(session=None, snapshot: Optional[datetime] = None) -> Tuple[Dict[Key, dict], Tuple[float, int], List[Any]]:
+    """
+    Recompute every scoped counter doc + the simple (amount, count) from deals closed
+    at or before snapshot (default: now), leaving out closes still pending in
+    counter_journal. Also returns those pending deal _ids (bounded by the flush).
+    """
+    snapshot = snapshot or datetime.now(UTC)
+    pending = [d["deal_oid"] async for d in COL_COUNTER_JOURNAL.find({}, {"deal_oid": 1}, session=session)]
+    res = [d async for d in COL_DEALS.aggregate(_pipeline(pending, snapshot), allowDiskUse=True, session=session)]
+    facets = res[0] if res else {}
+
+    def vals(d: dict) -> dict:
+        return {"deals": int(d.get("deals", 0)), "volume_main": float(d.get("volume_main", 0.0)),
+                "fees": float(d.get("fees", 0.0))}
+
+    expected: Dict[Key, dict] = {}
+    simple = (0.0, 0)
+    for d in facets.get("global", []):
+        expected[("global", None, None, None)] = vals(d)
+        simple = (float(d.get("volume_main", 0.0)), int(d.get("deals", 0)))
+    for scope in PERIOD_SCOPES:
+        for d in facets.get(scope, []):
+            k = d["_id"].get("k")
+            gid = int(k) if scope.startswith("group_") else None
+            eid = int(k) if scope.startswith("escrower_") else None
+            expected[(scope, gid, eid, d["_id"]["b"])] = vals(d)
+    return expected, simple, pending
+
+
+def _differs(stored: dict, want: dict) -> bool:
+    return any(abs(float(stored.get(f, 0) or 0) - float(want[f])) > EPS for f in FIELDS)
+
+
+async def reconcile(apply: bool = False) -> Dict[str, Any]:
+    """
+    Diff recomputed counters against stored docs; apply corrections if `apply`.
+    Returns a report: {checked, mismatched, missing, extra, simple_before, simple_after, applied, samples}.
+    """
+    # fold any write-behind deltas in first (anything journaled later is excluded by compute_expected)
+    await counter_buffer.flush()
+    if not apply:
+        return await _reconcile(None, apply=False)
+    return await run_in_transaction(lambda session: _reconcile(session, apply=True))
+
+
+async def _reconcile(session, *, apply: bool) -> Dict[str, Any]:
+    now = datetime.now(UTC)
+    expected, (s_amount, s_count), pending = await compute_expected(session, now)
+
+    ops: List[Any] = []
+    report: Dict[str, Any] = {"checked": 0, "mismatched": 0, "missing": 0, "extra": 0, "samples": []}
+    seen = set()
+    async for doc in COL_COUNTS.find({"scope": {"$in": list(SCOPES)}}, session=session):
+        report["checked"] += 1
+        key = _key(doc)
+        want = expected.get(key)
+        if want is None or key in seen:
+            # stale bucket (e.g. an old key format) or duplicate → remove
+            report["extra"] += 1
+            ops.append(DeleteOne({"_id": doc["_id"]}))
+            continue
+        seen.add(key)
+        if _differs(doc, want):
+            report["mismatched"] += 1
+            if len(report["samples"]) < 10:
+                report["samples"].append((key, {f: doc.get(f, 0) for f in FIELDS}, want))
+            ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": {**want, "updated_at": now}}))
+    for key, want in expected.items():
+        if key not in seen:
+            report["missing"] += 1
+            ops.append(UpdateOne(_filter(key), {"$set": {**want, "updated_at": now}}, upsert=True))
+
+    simple = await COL_COUNT_SIMPLE.find_one({"_id": "1"}, session=session) or {}
+    report["simple_before"] = (float(simple.get("amount", 0.0)), int(simple.get("count", 0)))
+    report["simple_after"] = (s_amount, s_count)
+
+    report["applied"] = False
+    if apply:
+        # deletes first so re-keyed upserts never hit a unique-index conflict
+        ops.sort(key=lambda op: not isinstance(op, DeleteOne))
+        if ops:
+            await COL_COUNTS.bulk_write(ops, ordered=True, session=session)
+        await COL_COUNT_SIMPLE.update_one(
+            {"_id": "1"}, {"$set": {"amount": s_amount, "count": s_count}}, upsert=True, session=session
+        )
+        # the aggregated deals are now accounted for → keep the close-path gate consistent
+        # (a deal closing after the snapshot is not matched and is counted by its own close)
+        await COL_DEALS.update_many(
+            {**_closed_match(pending, now), "counters_applied": {"$ne": True}},
+            {"$set": {"counters_applied": True}},
+            session=session,
+        )
+        report["applied"] = True
+    return report
+
+
+def format_report(r: Dict[str, Any]) -> str:
+    lines = [
+        "🧮 **Counter reconciliation** " + ("(applied)" if r["applied"] else "(dry-run)"),
+        f"➥ Docs checked: {r['checked']}",
+        f"➥ Mismatched: {r['mismatched']}",
+        f"➥ Missing: {r['missing']}",
+        f"➥ Stale/duplicate: {r['extra']}",
+        f"➥ Simple total: {r['simple_before'][0]:.2f}$ / {r['simple_before'][1]} → "
+        f"{r['simple_after'][0]:.2f}$ / {r['simple_after'][1]}",
+    ]
+    for key, have, want in r["samples"]:
+        scope, gid, eid, bucket = key
+        who = gid if gid is not None else (eid if eid is not None else "")
+        lines.append(f"  • {scope} {who} {bucket or ''}: {have} → {want}")
+    return "\n".join(lines)
+
+
+def register(client):
+    @router.command(r"^/reconcile(?:@[\w_]+)?(?:\s+(apply))?$")
+    async def reconcile_handler(event):
+        if not await is_owner(event.sender_id):
+            await event.reply("❌ Only owner can use this command.")
+            return
+        apply = bool(event.pattern_match.group(1))
+        try:
+            report = await reconcile(apply=apply)
+            await event.reply(format_report(report))
+        except Exception as e:
+            print(f"[reconcile] error: {e!r}")
+            await event.reply(f"❌ /reconcile error: {e}")
+
+
+if __name__ == "__main__":
+    _report = asyncio.run(reconcile(apply="--apply" in sys.argv))
+    print(format_report(_report))
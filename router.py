@@ -0,0 +1,99 @@
+# router.py
+"""
+Central NewMessage dispatch: ONE events.NewMessage handler instead of one per command.
+
+- A message starting with "/" is tokenized once ("/name[@bot] args" -> "name") and
+  looked up in a dict of command name -> handlers; only those handlers' patterns
+  are matched, and event.pattern_match is set as events.NewMessage(pattern=...) would.
+- Any other text reaches only the listeners scoped to its chat (and unscoped ones).
+
+Modules register with @router.command(pattern) / @router.listener(chats=[...]);
+bot.py calls router.install(client) once. Listeners run before command handlers;
+each group runs in registration order, and a failing handler does not stop the
+others (events.StopPropagation does), as with Telethon's own handlers. Each call
+is timed by metrics.track under "/<command>" or "module.function" for listeners.
+"""
+
+import re
+import traceback
+from typing import Callable, Dict, Iterable, List, Match, Optional, Pattern, Tuple
+
+from telethon import events
+
+import metrics
+
+_PATTERN_NAME = re.compile(r"\^/([A-Za-z0-9_]+)")  # command name at the start of a handler pattern
+_TOKEN = re.compile(r"/([A-Za-z0-9_]+)")           # command name at the start of a message
+
+Handler = Callable  # async def handler(event)
+
+
+class Router:
+    __slots__ = ("_commands", "_scoped", "_unscoped")
+
+    def __init__(self) -> None:
+        self._commands: Dict[str, List[Tuple[Pattern, Optional[bool], Handler, str]]] = {}
+        self._scoped: Dict[int, List[Tuple[Handler, str]]] = {}
+        self._unscoped: List[Tuple[Handler, str]] = []
+
+    def command(self, pattern: str, *, incoming: Optional[bool] = None):
+        """Decorator: handler for messages matching pattern, which must start with ^/<name>."""
+        m = _PATTERN_NAME.match(pattern)
+        if not m:
+            raise ValueError(f"router: pattern does not start with ^/<command>: {pattern!r}")
+        name, regex = m.group(1), re.compile(pattern)
+
+        def deco(fn: Handler) -> Handler:
+            self._commands.setdefault(name, []).append((regex, incoming, fn, f"/{name}"))
+            return fn
+        return deco
+
+    def listener(self, chats: Optional[Iterable[int]] = None):
+        """Decorator: handler for every message in chats (all chats if None)."""
+        def deco(fn: Handler) -> Handler:
+            entry = (fn, f"{fn.__module__}.{fn.__name__}")
+            if chats is None:
+                self._unscoped.append(entry)
+            else:
+                for chat_id in chats:
+                    self._scoped.setdefault(int(chat_id), []).append(entry)
+            return fn
+        return deco
+
+    def resolve(self, text: str, chat_id: Optional[int], out: bool = False) -> List[Tuple[Handler, Optional[Match], str]]:
+        """(handler, pattern match, metrics label) for one message, in call order."""
+        found = [(fn, None, label) for fn, label in self._scoped.get(chat_id, ())]
+        if self._unscoped:
+            found += [(fn, None, label) for fn, label in self._unscoped]
+        if text[:1] == "/":
+            tok = _TOKEN.match(text)
+            if tok:
+                for regex, incoming, fn, label in self._commands.get(tok.group(1), ()):
+                    if incoming is not None and incoming == out:
+                        continue
+                    m = regex.match(text)
+                    if m:
+                        found.append((fn, m, label))
+        return found
+
+    @metrics.self_timed
+    async def dispatch(self, event) -> None:
+        for fn, match, label in self.resolve(event.raw_text or "", event.chat_id, bool(event.out)):
+            event.pattern_match = match
+            try:
+                with metrics.track(label):
+                    await fn(event)
+            except events.StopPropagation:
+                return
+            except Exception as e:
+                print(f"[router] {fn.__module__}.{fn.__name__} failed: {e!r}")
+                traceback.print_exc()
+
+    def install(self, client) -> None:
+        client.add_event_handler(self.dispatch, events.NewMessage())
+
+
+_router = Router()
+command = _router.command
+listener = _router.listener
+install = _router.install
@@ -1,4 +1,5 @@
-from telethon import events, Button
+from telethon import Button
+import router
 from db import COL_DEALS
 
 def _build_private_link(chat_id: int, msg_id: int) -> str:
@@ -6,7 +7,7 @@ def _build_private_link(chat_id: int, msg_id: int) -> str:
     return f"https://t.me/c/{chat_id}/{msg_id}"
 
 def register(client):
-    @client.on(events.NewMessage(pattern=r'^/s\s+(\S+)'))
+    @router.command(r'^/s\s+(\S+)')
     async def show_deal_form(event):
         deal_id = event.pattern_match.group(1).strip().upper()
         deal = await COL_DEALS.find_one({"deal_id": deal_id})
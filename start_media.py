@@ -0,0 +1,84 @@
+# start_media.py
+"""
+Reusable /start image.
+
+The image is downloaded (in a worker thread) and uploaded to Telegram once; the
+resulting photo reference (id, access_hash, file_reference) is kept in memory and
+in `media_cache` (keyed by name, tagged with the source URL), so every later
+/start — also after a restart — sends it by reference with no download or upload.
+A changed URL or an expired file reference triggers one fresh upload.
+"""
+
+import asyncio
+from datetime import datetime, timezone
+UTC = timezone.utc
+from io import BytesIO
+from typing import Dict, Optional
+
+import requests
+from telethon.errors import FileReferenceExpiredError, MediaEmptyError
+from telethon.tl.types import InputPhoto
+
+from db import COL_MEDIA_CACHE
+
+_photos: Dict[str, InputPhoto] = {}
+_lock = asyncio.Lock()
+
+
+def _download(url: str) -> bytes:
+    """Blocking HTTP fetch; run via asyncio.to_thread."""
+    response = requests.get(url, timeout=10)
+    if response.status_code != 200:
+        raise Exception(f"HTTP {response.status_code}")
+    return response.content
+
+
+async def _cached(name: str, url: str) -> Optional[InputPhoto]:
+    photo = _photos.get(name)
+    if photo is not None:
+        return photo
+    doc = await COL_MEDIA_CACHE.find_one({"_id": name, "url": url})
+    if not doc:
+        return None
+    photo = InputPhoto(id=doc["photo_id"], access_hash=doc["access_hash"], file_reference=doc["file_reference"])
+    _photos[name] = photo
+    return photo
+
+
+async def _store(name: str, url: str, photo) -> None:
+    ref = InputPhoto(id=photo.id, access_hash=photo.access_hash, file_reference=photo.file_reference)
+    _photos[name] = ref
+    await COL_MEDIA_CACHE.update_one(
+        {"_id": name},
+        {"$set": {"url": url, "photo_id": ref.id, "access_hash": ref.access_hash,
+                  "file_reference": ref.file_reference, "updated_at": datetime.now(UTC)}},
+        upsert=True,
+    )
+
+
+async def _forget(name: str) -> None:
+    _photos.pop(name, None)
+    await COL_MEDIA_CACHE.delete_one({"_id": name})
+
+
+async def respond_with_photo(event, name: str, url: str, caption: str, **kwargs):
+    """event.respond(caption, file=<photo at url>) using the cached upload when there is one."""
+    photo = await _cached(name, url)
+    if photo is not None:
+        try:
+            return await event.respond(caption, file=photo, **kwargs)
+        except (FileReferenceExpiredError, MediaEmptyError) as e:
+            print(f"[start_media] cached {name} unusable ({e!r}); re-uploading")
+            await _forget(name)
+
+    # first use: one download + upload, shared by concurrent callers
+    async with _lock:
+        photo = _photos.get(name)
+        if photo is not None:
+            return await event.respond(caption, file=photo, **kwargs)
+        stream = BytesIO(await asyncio.to_thread(_download, url))
+        stream.name = f"{name}.png"  # Telethon needs a filename
+        msg = await event.respond(caption, file=stream, force_document=False, **kwargs)
+        if getattr(msg, "photo", None) is not None:
+            await _store(name, url, msg.photo)
+        return msg
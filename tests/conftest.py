@@ -0,0 +1,29 @@
+# tests/conftest.py
+"""
+Point the bot modules at a scratch database before any of them is imported.
+
+- TEST_MONGO_URI (default mongodb://localhost:27017) replaces config.MONGO_URI and
+  "<DB_NAME>_test" replaces config.DB_NAME, so db.py never touches the real deployment.
+- mongo_available() lets DB tests skip when no server answers.
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import config  # noqa: E402
+
+config.MONGO_URI = os.environ.get("TEST_MONGO_URI", "mongodb://localhost:27017")
+config.DB_NAME = f"{config.DB_NAME}_test"
+
+
+def mongo_available() -> bool:
+    from pymongo import MongoClient
+    try:
+        MongoClient(config.MONGO_URI, serverSelectionTimeoutMS=1500).admin.command("ping")
+        return True
+    except Exception:
+        return False
@@ -0,0 +1,41 @@
+# tests/test_close_deal.py
+"""Concurrent /close on one deal: exactly one caller closes it, the amount is applied once."""
+
+import asyncio
+
+import pytest
+
+from conftest import mongo_available
+
+pytestmark = pytest.mark.skipif(not mongo_available(), reason="MongoDB not reachable (set TEST_MONGO_URI)")
+
+DEAL_ID = "DL-TEST01"
+ESCROWER_ID = 42
+
+
+def test_concurrent_close_applies_once():
+    from close_cmd import _close_deal
+    from db import COL_DEALS, db
+
+    async def run():
+        await COL_DEALS.delete_many({"deal_id": DEAL_ID})
+        await COL_DEALS.insert_one({
+            "deal_id": DEAL_ID, "escrower_id": ESCROWER_ID, "status": "active",
+            "main_amount": 100.0, "remaining": 100.0,
+        })
+        try:
+            results = await asyncio.gather(*(_close_deal(DEAL_ID, ESCROWER_ID, 30.0) for _ in range(50)))
+            deal = await COL_DEALS.find_one({"deal_id": DEAL_ID})
+        finally:
+            await db.client.drop_database(db.name)
+        return results, deal
+
+    results, deal = asyncio.run(run())
+
+    closed = [r for r in results if r is not None]
+    assert len(closed) == 1
+    assert results.count(None) == 49
+    assert closed[0]["status"] == "closed"
+    assert closed[0]["remaining"] == 70.0
+    assert deal["status"] == "closed"
+    assert deal["remaining"] == 70.0
@@ -0,0 +1,108 @@
+# tests/test_form_listener.py
+"""Deal forms: a form in an escrow group reaches the fee prefetch and the stub; /add consumes the stub."""
+
+import asyncio
+from types import SimpleNamespace
+
+FORM = "Seller - @alice\nBuyer - @bob\nAmount - 120"
+
+
+def _event(chat_id: int, text: str = FORM):
+    return SimpleNamespace(
+        raw_text=text, chat_id=chat_id, out=False, pattern_match=None,
+        chat=SimpleNamespace(id=abs(chat_id) % 10**10),  # unmarked, as Telethon reports it
+        message=SimpleNamespace(id=7), client=object(),
+    )
+
+
+def _load_bot(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)  # bot.py creates its Telethon session file in the cwd
+    import bot
+    calls = {"prefetch": [], "stub": []}
+    monkeypatch.setattr(bot, "prefetch_form_fee", lambda client, b, s: calls["prefetch"].append((b, s)))
+
+    async def save_stub(chat_id, message_id, buyer, seller):
+        calls["stub"].append((chat_id, message_id, buyer, seller))
+    monkeypatch.setattr(bot, "save_form_stub", save_stub)
+    return bot, calls
+
+
+def test_form_in_escrow_group_reaches_prefetch(monkeypatch, tmp_path):
+    bot, calls = _load_bot(monkeypatch, tmp_path)
+    import router
+
+    chat_id = int(next(iter(bot.ESCROW_GROUP_IDS)))
+    asyncio.run(router._router.dispatch(_event(chat_id)))
+
+    assert calls["prefetch"] == [("bob", "alice")]
+    assert calls["stub"] == [(chat_id, 7, "bob", "alice")]
+
+
+def test_form_outside_escrow_groups_is_ignored(monkeypatch, tmp_path):
+    bot, calls = _load_bot(monkeypatch, tmp_path)
+    import router
+
+    asyncio.run(router._router.dispatch(_event(-1009999999999)))
+
+    assert calls == {"prefetch": [], "stub": []}
+
+
+def _add_event(form_text: str, chat_id: int):
+    import re
+
+    async def noop(*a, **k):
+        return None
+
+    form_msg = SimpleNamespace(raw_text=form_text, chat_id=chat_id, id=7, chat=None, reply=noop)
+
+    async def get_reply_message():
+        return form_msg
+    return SimpleNamespace(
+        sender_id=42, is_reply=True, client=object(), pattern_match=re.match(r"^/add\s+([0-9]+(\.[0-9]+)?)$", "/add 100"),
+        get_reply_message=get_reply_message, respond=noop, delete=noop,
+    )
+
+
+def _patch_add(monkeypatch, bot, stub):
+    calls = {"get": [], "delete": []}
+
+    async def is_escrower(uid):
+        return True
+
+    async def get_stub(chat_id, message_id):
+        calls["get"].append((chat_id, message_id))
+        return stub
+
+    async def delete_stub(chat_id, message_id):
+        calls["delete"].append((chat_id, message_id))
+
+    async def create_deal(**kw):
+        return {"deal_id": "DL-TEST01", "escrower_name": "E", "main_amount": kw["main_amount"], "fee": 1.0,
+                "seller_username": kw["seller_username"], "buyer_username": kw["buyer_username"]}
+
+    monkeypatch.setattr(bot, "is_escrower", is_escrower)
+    monkeypatch.setattr(bot.escrower_cache, "get", lambda uid: {"display_name": "E"})
+    monkeypatch.setattr(bot, "get_form_stub", get_stub)
+    monkeypatch.setattr(bot, "delete_form_stub", delete_stub)
+    monkeypatch.setattr(bot, "create_deal_from_form", create_deal)
+    return calls
+
+
+def test_add_consumes_stub_when_form_parses(monkeypatch, tmp_path):
+    bot, _ = _load_bot(monkeypatch, tmp_path)
+    calls = _patch_add(monkeypatch, bot, stub=None)
+
+    asyncio.run(bot.add_cmd(_add_event(FORM, -1002248727398)))
+
+    assert calls["get"] == []  # the text parsed: no read needed
+    assert calls["delete"] == [(-1002248727398, 7)]
+
+
+def test_add_falls_back_to_stub_and_consumes_it(monkeypatch, tmp_path):
+    bot, _ = _load_bot(monkeypatch, tmp_path)
+    calls = _patch_add(monkeypatch, bot, stub={"seller_username": "alice", "buyer_username": "bob"})
+
+    asyncio.run(bot.add_cmd(_add_event("edited: no parties here", -1002248727398)))
+
+    assert calls["get"] == [(-1002248727398, 7)]
+    assert calls["delete"] == [(-1002248727398, 7)]
@@ -0,0 +1,76 @@
+import sys
+import time
+from array import array
+from hashlib import blake2b
+from typing import Dict, Optional
+
+
+def text_hash(text: Optional[str]) -> int:
+    """64-bit digest of a message text (what the cache stores instead of the text)."""
+    return int.from_bytes(blake2b((text or "").encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class EditCache:
+    """
+    Fixed-capacity ring of (message_id, text hash, seen_at) in parallel arrays.
+
+    put() overwrites the oldest slot once full; entries older than max_age are
+    treated as misses. Memory is bounded by capacity (~24 bytes/slot in the arrays
+    plus one dict entry per live message id).
+    """
+    __slots__ = ("capacity", "max_age", "_ids", "_hashes", "_seen", "_slot", "_next",
+                 "hits", "misses", "expired", "evictions")
+
+    def __init__(self, capacity: int, max_age: float) -> None:
+        self.capacity = int(capacity)
+        self.max_age = float(max_age)
+        self._ids = array("q", [0] * self.capacity)
+        self._hashes = array("Q", [0] * self.capacity)
+        self._seen = array("d", [0.0] * self.capacity)
+        self._slot: Dict[int, int] = {}  # message_id -> slot
+        self._next = 0
+        self.hits = self.misses = self.expired = self.evictions = 0
+
+    def put(self, msg_id: int, text: Optional[str]) -> None:
+        h = text_hash(text)
+        slot = self._slot.get(msg_id)
+        if slot is None:
+            slot = self._next
+            self._next = (self._next + 1) % self.capacity
+            old = self._ids[slot]
+            if self._slot.get(old) == slot:
+                del self._slot[old]
+                self.evictions += 1
+            self._ids[slot] = msg_id
+            self._slot[msg_id] = slot
+        self._hashes[slot] = h
+        self._seen[slot] = time.monotonic()
+
+    def get(self, msg_id: int) -> Optional[int]:
+        """Stored hash for msg_id, or None on a miss (unknown, evicted or too old)."""
+        slot = self._slot.get(msg_id)
+        if slot is None:
+            self.misses += 1
+            return None
+        if time.monotonic() - self._seen[slot] > self.max_age:
+            del self._slot[msg_id]
+            self.expired += 1
+            self.misses += 1
+            return None
+        self.hits += 1
+        return self._hashes[slot]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        arrays = sum(a.itemsize * len(a) for a in (self._ids, self._hashes, self._seen))
+        return {
+            "size": len(self._slot),
+            "capacity": self.capacity,
+            "max_age": self.max_age,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            "bytes": arrays + sys.getsizeof(self._slot),
+        }
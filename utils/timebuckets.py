@@ -0,0 +1,71 @@
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+UTC = timezone.utc
+IST = timezone(timedelta(hours=5, minutes=30))
+IST_OFFSET = "+05:30"  # same zone for MongoDB date operators
+
+# Canonical counter buckets. Every periodic `counts` doc is keyed by
+# `period` = ISO date (IST) of the bucket start: the day itself, the week's
+# Monday, the 1st of the month, or Jan 1st.
+UNITS = ("daily", "weekly", "monthly", "yearly")
+
+_TRUNC_UNIT = {"daily": "day", "weekly": "week", "monthly": "month", "yearly": "year"}
+
+
+def ist_date(dt: Optional[datetime] = None) -> date:
+    """IST calendar date of dt (naive datetimes are treated as UTC, as Mongo returns them)."""
+    if dt is None:
+        dt = datetime.now(UTC)
+    elif dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)
+    return dt.astimezone(IST).date()
+
+
+def period_key(unit: str, dt: Optional[datetime] = None) -> str:
+    d = ist_date(dt)
+    if unit == "daily":
+        pass
+    elif unit == "weekly":
+        d = d - timedelta(days=d.weekday())
+    elif unit == "monthly":
+        d = d.replace(day=1)
+    elif unit == "yearly":
+        d = d.replace(month=1, day=1)
+    else:
+        raise ValueError(f"unknown bucket unit: {unit}")
+    return d.isoformat()
+
+
+def day_key(dt: Optional[datetime] = None) -> str:
+    return period_key("daily", dt)
+
+
+def week_key(dt: Optional[datetime] = None) -> str:
+    return period_key("weekly", dt)
+
+
+def month_key(dt: Optional[datetime] = None) -> str:
+    return period_key("monthly", dt)
+
+
+def period_expr(unit: str, date_expr: str = "$closed_at") -> dict:
+    """Aggregation expression producing the same key as period_key() server-side."""
+    trunc = {"$dateTrunc": {"date": date_expr, "unit": _TRUNC_UNIT[unit], "timezone": IST_OFFSET}}
+    if unit == "weekly":
+        trunc["$dateTrunc"]["startOfWeek"] = "monday"
+    return {"$dateToString": {"format": "%Y-%m-%d", "date": trunc, "timezone": IST_OFFSET}}
+
+
+def legacy_day_to_key(value) -> Optional[str]:
+    """
+    Map an old daily bucket value to the canonical IST day key:
+      - "YYYY-MM-DD" (db._utc_day_str, UTC day)  → same calendar date (the UTC day
+        overlaps that IST date for its first 18.5h; exact close times are not stored)
+      - datetime (IST midnight expressed in UTC, from the *_ist_bucket_utc helpers) → its IST date
+    """
+    if isinstance(value, datetime):
+        return ist_date(value).isoformat()
+    if isinstance(value, str) and len(value) == 10:
+        return value
+    return None